@@ -1,5 +1,5 @@
-from typing import AsyncGenerator
-import os
+from typing import AsyncGenerator, Optional
+import asyncio
 import traceback
 import httpx
 from browser_use.browser.context import BrowserContext
@@ -12,39 +12,118 @@ from .utils import (
     wrap_chunk,
     random_uuid,
     wrap_toolcall_response,
+    wrap_progress_event,
     refine_mcp_response
 )
 import logging
 import openai
 import json
 from .toolcalls import execute_toolcall, get_context_aware_available_toolcalls
+from .conversations import get_conversation_store
+from .uploads import get_upload_store
+from .context_budget import compact_messages
+from .tool_results import limit_tool_result
+from .progress import ProgressChannel
+from .budget import RequestBudget
+from .llms import get_openai_client, create_chat_completion
+from .llm_retry import llm_deadline
+from .speculation import SpeculativeNavigation, SPECULATIVE_NAVIGATION
 
 logger = logging.getLogger()
 
 
-async def prompt(messages: list[dict[str, str]], browser_context: BrowserContext, **_) -> AsyncGenerator[str, None]:
-    llm = openai.AsyncClient(
-        base_url=os.getenv("LLM_BASE_URL", "http://localmodel:65534/v1"),
-        api_key=os.getenv("LLM_API_KEY", "no-need")
-    )
+def add_usage(usage: Optional[oai_compatible_models.UsageInfo], prompt_tokens: int = 0, completion_tokens: int = 0):
+    if usage is None:
+        return
+
+    usage.prompt_tokens += prompt_tokens or 0
+    usage.completion_tokens = (usage.completion_tokens or 0) + (completion_tokens or 0)
+    usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+
+
+async def compact_context(messages: list[dict[str, str]], max_context_tokens: Optional[int] = None) -> list[dict[str, str]]:
+    # tokenizing a long history is CPU bound, keep it off the event loop
+    messages, report = await asyncio.to_thread(compact_messages, messages, budget=max_context_tokens)
+
+    if report.changed:
+        logger.info(
+            f"Compacted context from {report.tokens_before} to {report.tokens_after} tokens "
+            f"(budget {report.budget}): truncated {report.truncated_messages} messages, "
+            f"dropped {report.dropped_messages} {report.dropped_roles}"
+        )
+
+    return messages
+
+
+async def prompt(
+    messages: list[dict[str, str]], 
+    browser_context: BrowserContext, 
+    conversation_id: Optional[str] = None,
+    max_context_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+    deadline: Optional[float] = None,
+    max_steps: Optional[int] = None,
+    max_tool_calls: Optional[int] = None,
+    token_budget: Optional[int] = None,
+    network: Optional[dict] = None,
+    checkpoint_scope: Optional[str] = None,
+    usage: Optional[oai_compatible_models.UsageInfo] = None,
+    **_
+) -> AsyncGenerator[str, None]:
+    llm = get_openai_client("prompt")
 
-    messages = await refine_chat_history(messages, get_system_prompt())
-    
     response_uuid = random_uuid()
     error_details = ''
     error_message = ''
     calls = 0
+    completed = False
+    budget = RequestBudget.from_request(
+        timeout=timeout,
+        deadline=deadline,
+        max_steps=max_steps,
+        max_tool_calls=max_tool_calls,
+        max_tokens=token_budget
+    )
+    # LLM retries (ours and the browser agent's, which runs in a child task) stop at the request deadline
+    llm_deadline.set(budget.deadline)
     
     functions = await get_context_aware_available_toolcalls(browser_context)
+    conversation = None
+    speculation = None
+
+    if conversation_id is not None:
+        conversation = await get_conversation_store().open(conversation_id)
 
     try:
-        completion = await llm.chat.completions.create(
-            model=os.getenv("LLM_MODEL_ID", 'local-llm'),
+        if conversation is not None and len(conversation.messages) > 0:
+            # only the new turn needs refining, the stored history is already refined
+            messages = conversation.messages + await refine_chat_history(messages, '', owner=conversation_id)
+        else:
+            messages = await refine_chat_history(messages, get_system_prompt(), owner=conversation_id or response_uuid)
+
+        messages = await compact_context(messages, max_context_tokens)
+
+        if SPECULATIVE_NAVIGATION:
+            # starts loading the page the user mentions while the model decides whether to browse at all
+            speculation = await SpeculativeNavigation.start(messages)
+
+        completion = await create_chat_completion(
+            llm, "prompt",
             messages=messages,
             tools=functions,
             tool_choice="auto",
-            max_tokens=256
+            max_tokens=256,
+            timeout=budget.request_timeout() or openai.NOT_GIVEN
         )
+        budget.add_tokens(completion.usage.total_tokens if completion.usage else 0)
+
+        if speculation is not None and not any(
+            call.function.name == "xbrowse" for call in completion.choices[0].message.tool_calls or []
+        ):
+            await speculation.cancel()
+
+        if completion.usage:
+            add_usage(usage, completion.usage.prompt_tokens, completion.usage.completion_tokens)
         
         if completion.choices[0].message.content:
             yield completion.choices[0].message.content
@@ -67,6 +146,9 @@ async def prompt(messages: list[dict[str, str]], browser_context: BrowserContext
                 elif has_exception:
                     result = f"Exception raised. Skipping task...\n"
 
+                elif budget.exhausted():
+                    result = f"Tool call `{_name}` skipped: the request budget is exhausted"
+
                 else:
                     executed.add(identity)
 
@@ -79,23 +161,46 @@ async def prompt(messages: list[dict[str, str]], browser_context: BrowserContext
                     )
 
                     try:
-                        response = await execute_toolcall(
-                            ctx=browser_context, 
-                            tool_name=_name,
-                            args=_args
+                        progress = ProgressChannel()
+                        toolcall_task = asyncio.create_task(
+                            execute_toolcall(
+                                ctx=browser_context, 
+                                tool_name=_name,
+                                args=_args,
+                                progress=progress,
+                                budget=budget,
+                                network=network,
+                                speculation=speculation,
+                                checkpoint_scope=checkpoint_scope or (
+                                    f"conversation:{conversation_id}" if conversation_id is not None else None
+                                )
+                            )
                         )
 
+                        try:
+                            async for event in progress.iterate_until(toolcall_task):
+                                yield await to_chunk_data(wrap_progress_event(response_uuid, event))
+                        finally:
+                            if not toolcall_task.done():
+                                toolcall_task.cancel()
+
+                        response = toolcall_task.result()
+                        # the browser agent's own LLM calls, already charged to the budget by browse()
+                        add_usage(usage, response.input_tokens, response.output_tokens)
+
                         if response.success:
-                            yield to_chunk_data(
+                            tool_result = await limit_tool_result(_name, refine_mcp_response(response.result))
+
+                            yield await to_chunk_data(
                                 wrap_toolcall_response(
                                     uuid=response_uuid,
                                     fn_name=_name,
                                     args=_args,
-                                    result=response.result
+                                    result=tool_result
                                 )
                             )
 
-                            result = json.dumps(refine_mcp_response(response.result))
+                            result = json.dumps(tool_result)
 
                         else:
                             result = f"Tool call failed: {response.error}"
@@ -116,15 +221,23 @@ async def prompt(messages: list[dict[str, str]], browser_context: BrowserContext
                 if has_exception:
                     break 
 
-            need_toolcalls = calls < 10 and not has_exception
+            need_toolcalls = calls < budget.max_tool_calls \
+                and not has_exception \
+                and budget.nearly_spent() is None
+            messages = await compact_context(messages, max_context_tokens)
 
-            completion = await llm.chat.completions.create(
+            completion = await create_chat_completion(
+                llm, "prompt",
                 messages=messages,
-                model=os.getenv("LLM_MODEL_ID", 'local-llm'),
                 tools=functions if need_toolcalls else openai._types.NOT_GIVEN,  # type: ignore
                 tool_choice="auto" if need_toolcalls else openai._types.NOT_GIVEN,  # type: ignore
-                max_tokens=512
+                max_tokens=512,
+                timeout=budget.request_timeout() or openai.NOT_GIVEN
             )
+            budget.add_tokens(completion.usage.total_tokens if completion.usage else 0)
+
+            if completion.usage:
+                add_usage(usage, completion.usage.prompt_tokens, completion.usage.completion_tokens)
 
             logger.info(f"Assistant: {completion.choices[0].message.content!r}")
 
@@ -132,6 +245,8 @@ async def prompt(messages: list[dict[str, str]], browser_context: BrowserContext
                 yield completion.choices[0].message.content
 
             messages.append(await refine_assistant_message(completion.choices[0].message.model_dump()))
+
+        completed = True
       
     except openai.APIConnectionError as e:
         error_message=f"Failed to connect to language model: {e}"
@@ -151,6 +266,16 @@ async def prompt(messages: list[dict[str, str]], browser_context: BrowserContext
         error_details = traceback.format_exc(limit=-6)
         
     finally:
+        if speculation is not None:
+            await speculation.cancel()
+
+        if conversation is not None:
+            # an interrupted turn may end with unanswered tool calls, so only completed turns are stored
+            await conversation.close(messages if completed else None)
+        else:
+            # attachments of a one-off request are only pinned while it runs
+            await get_upload_store().release_owner(response_uuid)
+
         if error_message:
 
             logger.error(f"Error occurred: {error_message}")
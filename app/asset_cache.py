@@ -0,0 +1,330 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import weakref
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from pydantic import BaseModel
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# off by default: the route makes Chromium intercept every request and turns its own HTTP cache off
+ASSET_CACHE_ENABLED = os.getenv("ASSET_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", "/storage/asset-cache")
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+ASSET_CACHE_MAX_ITEM_BYTES = int(os.getenv("ASSET_CACHE_MAX_ITEM_BYTES", 10 * 1024 * 1024))
+ASSET_CACHE_RESOURCE_TYPES = {
+    e.strip() for e in os.getenv("ASSET_CACHE_RESOURCE_TYPES", "script,stylesheet,font,image").split(",") if e.strip()
+}
+# freshness for responses with Last-Modified but no explicit lifetime (RFC 9111 4.2.2), capped
+ASSET_CACHE_HEURISTIC_RATIO = 0.1
+ASSET_CACHE_HEURISTIC_MAX_SECONDS = 24 * 3600
+ASSET_CACHE_IMMUTABLE_SECONDS = 365 * 24 * 3600
+
+# headers describing the transfer, not the content; the cached body is stored decoded
+_HOP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive", "set-cookie"}
+# a request carrying these may get a personalized response, it is neither served from nor stored in the cache
+_CREDENTIAL_HEADERS = ("cookie", "authorization", "proxy-authorization")
+
+
+class CachedAsset(BaseModel):
+    url: str
+    status: int
+    headers: dict[str, str]
+    size: int
+    expires_at: float
+    # the request header values the response varies on, a request with other values is a miss
+    vary: dict[str, str] = {}
+    last_access: float = 0
+
+
+def parse_cache_control(value: str) -> dict[str, Optional[str]]:
+    directives = {}
+
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+
+        if name:
+            directives[name.lower()] = arg.strip('" ') or None
+
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def vary_headers(headers: dict[str, str]) -> list[str]:
+    # accept-encoding is left out, the body is stored decoded
+    names = [n.strip().lower() for n in headers.get("vary", "").split(",") if n.strip()]
+    return [n for n in names if n != "accept-encoding"]
+
+
+def freshness_lifetime(headers: dict[str, str], now: float) -> Optional[float]:
+    # seconds the response may be served from the cache, None when it must not be stored
+    cache_control = parse_cache_control(headers.get("cache-control", ""))
+
+    if {"no-store", "no-cache", "private"} & cache_control.keys() or "set-cookie" in headers:
+        return None
+
+    if "*" in vary_headers(headers):
+        return None
+
+    if "immutable" in cache_control:
+        return ASSET_CACHE_IMMUTABLE_SECONDS
+
+    for directive in ("s-maxage", "max-age"):
+        if cache_control.get(directive):
+            try:
+                return max(0.0, float(cache_control[directive]) - float(headers.get("age") or 0))
+            except ValueError:
+                return None
+
+    date = _http_date(headers.get("date")) or now
+    expires = _http_date(headers.get("expires"))
+
+    if expires is not None:
+        return max(0.0, expires - date)
+
+    last_modified = _http_date(headers.get("last-modified"))
+
+    if last_modified is not None:
+        return min(ASSET_CACHE_HEURISTIC_MAX_SECONDS, max(0.0, date - last_modified) * ASSET_CACHE_HEURISTIC_RATIO)
+
+    return None
+
+
+# size-bounded LRU cache of static assets served to the browser through playwright request interception;
+# bodies live under <directory>/<key[:2]>/<key>.body next to a .json with status, headers and expiry
+class AssetCache(object):
+    def __init__(self, directory: str, max_bytes: int, max_item_bytes: int = ASSET_CACHE_MAX_ITEM_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries: OrderedDict[str, CachedAsset] = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._installed: set[int] = set()
+        # requests answered from the cache, their "requestfinished" must not store them again
+        self._served: weakref.WeakSet = weakref.WeakSet()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{suffix}")
+
+    def _scan(self) -> list[tuple[str, CachedAsset]]:
+        found = []
+        os.makedirs(self.directory, exist_ok=True)
+
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+
+            for name in os.listdir(prefix_dir):
+                if not name.endswith(".json"):
+                    continue
+
+                key = name[:-len(".json")]
+
+                try:
+                    with open(os.path.join(prefix_dir, name)) as fp:
+                        entry = CachedAsset.model_validate_json(fp.read())
+
+                    entry.last_access = os.stat(self._path(key, ".body")).st_mtime
+                    found.append((key, entry))
+                except Exception:
+                    self._unlink(key)
+
+        return sorted(found, key=lambda e: e[1].last_access)
+
+    async def load(self):
+        if self._loaded:
+            return
+
+        self._loaded = True
+
+        for key, entry in await asyncio.to_thread(self._scan):
+            self._entries[key] = entry
+            self._total_bytes += entry.size
+
+        metrics.set("asset_cache_bytes", self._total_bytes)
+        logger.info(f"Asset cache: {len(self._entries)} entries, {self._total_bytes} bytes in {self.directory}")
+
+    async def install(self, browser_context):
+        if browser_context is None or id(browser_context) in self._installed:
+            return
+
+        await self.load()
+        await browser_context.route("**/*", self.handle)
+        # misses go to the network, their responses are stored once they finished
+        browser_context.on("requestfinished", self._on_request_finished)
+        self._installed.add(id(browser_context))
+
+    def _unlink(self, key: str):
+        for suffix in (".body", ".json"):
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _write(self, key: str, entry: CachedAsset, body: bytes):
+        os.makedirs(os.path.dirname(self._path(key, "")), exist_ok=True)
+
+        for suffix, data in ((".body", body), (".json", entry.model_dump_json(exclude={"last_access"}).encode())):
+            tmp_path = self._path(key, suffix + ".tmp")
+
+            with open(tmp_path, "wb") as fp:
+                fp.write(data)
+
+            os.replace(tmp_path, self._path(key, suffix))
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            path = self._path(key, ".body")
+
+            with open(path, "rb") as fp:
+                body = fp.read()
+
+            os.utime(path)
+            return body
+        except OSError:
+            return None
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    async def _store(self, key: str, url: str, status: int, headers: dict[str, str], vary: dict[str, str], body: bytes, lifetime: float):
+        self._forget(key)
+
+        entry = CachedAsset(
+            url=url,
+            status=status,
+            headers={k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS},
+            size=len(body),
+            expires_at=time.time() + lifetime,
+            vary=vary,
+            last_access=time.time()
+        )
+
+        await asyncio.to_thread(self._write, key, entry, body)
+        self._entries[key] = entry
+        self._total_bytes += entry.size
+
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            stale_key, _ = next(iter(self._entries.items()))
+            self._forget(stale_key)
+            await asyncio.to_thread(self._unlink, stale_key)
+            metrics.inc("asset_cache_evictions_total")
+
+        metrics.set("asset_cache_bytes", self._total_bytes)
+
+    async def _serve(self, route, key: str, entry: CachedAsset) -> bool:
+        body = await asyncio.to_thread(self._read, key)
+
+        if body is None:
+            self._forget(key)
+            return False
+
+        self._entries.move_to_end(key)
+        entry.last_access = time.time()
+
+        self._served.add(route.request)
+        await route.fulfill(status=entry.status, headers=entry.headers, body=body)
+        metrics.inc("asset_cache_served_bytes_total", len(body))
+        return True
+
+    async def _cacheable_request(self, request) -> Optional[dict[str, str]]:
+        # the request's headers when it may use the cache at all
+        if (
+            request.method != "GET"
+            or request.resource_type not in ASSET_CACHE_RESOURCE_TYPES
+            or not request.url.startswith(("http://", "https://"))
+        ):
+            return None
+
+        headers = await request.all_headers()
+
+        if any(headers.get(name) for name in _CREDENTIAL_HEADERS):
+            return None
+
+        return headers
+
+    async def handle(self, route):
+        request = route.request
+        headers = await self._cacheable_request(request)
+
+        if headers is None:
+            metrics.inc("asset_cache_requests_total", result="bypass")
+            await route.fallback()
+            return
+
+        key = hashlib.sha256(request.url.encode()).hexdigest()
+        entry = self._entries.get(key)
+
+        if (
+            entry is not None
+            and entry.expires_at > time.time()
+            and all(headers.get(name, "") == value for name, value in entry.vary.items())
+            and await self._serve(route, key, entry)
+        ):
+            metrics.inc("asset_cache_requests_total", result="hit")
+            return
+
+        # a miss or a stale entry: the request goes on to the network (and the browser's own cache)
+        # untouched, the response is picked up by _on_request_finished
+        metrics.inc("asset_cache_requests_total", result="miss")
+        await route.fallback()
+
+    async def _on_request_finished(self, request):
+        if request in self._served:
+            self._served.discard(request)
+            return
+
+        try:
+            headers = await self._cacheable_request(request)
+            response = await request.response() if headers is not None else None
+
+            if response is None or response.status != 200 or response.from_service_worker:
+                return
+
+            response_headers = await response.all_headers()
+            lifetime = freshness_lifetime(response_headers, time.time())
+
+            if not lifetime or int(response_headers.get("content-length") or 0) > self.max_item_bytes:
+                return
+
+            body = await response.body()
+
+            if len(body) > self.max_item_bytes:
+                return
+
+            vary = {name: headers.get(name, "") for name in vary_headers(response_headers)}
+            key = hashlib.sha256(request.url.encode()).hexdigest()
+
+            await self._store(key, request.url, response.status, response_headers, vary, body, lifetime)
+            metrics.inc("asset_cache_stored_total")
+        except Exception as err:
+            logger.debug(f"Failed to cache {request.url}: {err}")
+
+
+_cache: Optional[AssetCache] = None
+
+
+def get_asset_cache() -> AssetCache:
+    global _cache
+
+    if _cache is None:
+        _cache = AssetCache(ASSET_CACHE_DIR, max_bytes=ASSET_CACHE_MAX_BYTES)
+
+    return _cache
@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Optional
+from pydantic import BaseModel, ValidationError
+from .completions import (
+    collect_completion,
+    response_model_name,
+    run_chat_request,
+    InvalidChatRequestError,
+    PromptFailedError
+)
+from .metrics import metrics
+from .models.oai_compatible_models import (
+    BatchRequestInput,
+    BatchRequestOutput,
+    BatchResponseData,
+    ChatCompletionRequest,
+    UsageInfo
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_STORE_DIR = os.getenv("BATCH_STORE_DIR", os.path.join(os.getcwd(), "batches"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 32))
+
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+
+
+class BatchRequestCounts(BaseModel):
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+
+
+class BatchJob(BaseModel):
+    id: str
+    object: str = "batch"
+    endpoint: str
+    input_file_id: Optional[str] = None
+    status: str = "validating"  # validating | in_progress | completed | failed | cancelling | cancelled
+    concurrency: int = BATCH_CONCURRENCY
+    created_at: int
+    in_progress_at: Optional[int] = None
+    completed_at: Optional[int] = None
+    cancelled_at: Optional[int] = None
+    request_counts: BatchRequestCounts = BatchRequestCounts()
+    errors: list[str] = []
+    metadata: Optional[dict[str, Any]] = None
+
+
+def _read_lines(path: str) -> list[str]:
+    with open(path) as fp:
+        return [line for line in fp if line.strip()]
+
+
+def _read_finished(path: str) -> dict[str, bool]:
+    # custom_id -> succeeded, the last line for an id wins
+    finished = {}
+
+    if not os.path.exists(path):
+        return finished
+
+    with open(path) as fp:
+        for line in fp:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                # a torn last line from a crash
+                continue
+
+            response = data.get("response") or {}
+            finished[data.get("custom_id")] = data.get("error") is None and response.get("status_code") == 200
+
+    return finished
+
+
+def _append_line(path: str, line: str):
+    with open(path, "a") as fp:
+        fp.write(line + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+async def execute_batch_request(
+    request: BatchRequestInput,
+    browser_context,
+    checkpoint_scope: Optional[str] = None
+) -> BatchRequestOutput:
+    request_id = f"batch_req_{uuid.uuid4().hex}"
+
+    if request.url not in SUPPORTED_ENDPOINTS or not isinstance(request.body, ChatCompletionRequest):
+        return BatchRequestOutput(
+            id=request_id,
+            custom_id=request.custom_id,
+            response=BatchResponseData(status_code=400, request_id=request_id),
+            error={"code": "invalid_url", "message": f"Only {', '.join(SUPPORTED_ENDPOINTS)} is supported"}
+        )
+
+    body: ChatCompletionRequest = request.body
+    usage = UsageInfo()
+
+    try:
+        completion = await collect_completion(
+            run_chat_request(body, browser_context, usage=usage, checkpoint_scope=checkpoint_scope),
+            model=response_model_name(body),
+            usage=usage
+        )
+    except InvalidChatRequestError as err:
+        return BatchRequestOutput(
+            id=request_id,
+            custom_id=request.custom_id,
+            response=BatchResponseData(status_code=400, request_id=request_id),
+            error={"code": "invalid_request", "message": str(err)}
+        )
+    except PromptFailedError as err:
+        return BatchRequestOutput(
+            id=request_id,
+            custom_id=request.custom_id,
+            response=BatchResponseData(status_code=500, request_id=request_id),
+            error={"code": "prompt_failed", "message": err.message}
+        )
+
+    return BatchRequestOutput(
+        id=request_id,
+        custom_id=request.custom_id,
+        response=BatchResponseData(status_code=200, request_id=request_id, body=completion),
+        error=None
+    )
+
+
+# batch jobs live under <directory>/<batch id>/ as batch.json, input.jsonl and output.jsonl;
+# output lines are appended as requests finish, so a restarted job skips what already succeeded
+class BatchManager(object):
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._jobs: dict[str, BatchJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        for batch_id in os.listdir(self.directory):
+            try:
+                with open(self.job_path(batch_id, "batch.json")) as fp:
+                    self._jobs[batch_id] = BatchJob.model_validate_json(fp.read())
+            except (OSError, ValidationError):
+                continue
+
+    def job_path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(batch_id)
+
+    def list(self) -> list[BatchJob]:
+        return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def output_path(self, batch_id: str) -> Optional[str]:
+        path = self.job_path(batch_id, "output.jsonl")
+        return path if batch_id in self._jobs and os.path.exists(path) else None
+
+    def _write_job(self, job: BatchJob):
+        tmp_path = self.job_path(job.id, ".batch.json")
+
+        with open(tmp_path, "w") as fp:
+            fp.write(job.model_dump_json())
+
+        os.replace(tmp_path, self.job_path(job.id, "batch.json"))
+
+    async def _save(self, job: BatchJob):
+        await asyncio.to_thread(self._write_job, job)
+
+    async def create(
+        self, 
+        input_path: str, 
+        endpoint: str = "/v1/chat/completions", 
+        input_file_id: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        metadata: Optional[dict[str, Any]] = None
+    ) -> BatchJob:
+        if endpoint not in SUPPORTED_ENDPOINTS:
+            raise ValueError(f"Unsupported endpoint {endpoint!r}, only {', '.join(SUPPORTED_ENDPOINTS)} is supported")
+
+        job = BatchJob(
+            id=f"batch_{uuid.uuid4().hex}",
+            endpoint=endpoint,
+            input_file_id=input_file_id,
+            concurrency=max(1, min(int(concurrency or BATCH_CONCURRENCY), BATCH_MAX_CONCURRENCY)),
+            created_at=int(time.time()),
+            metadata=metadata
+        )
+
+        # the job keeps its own copy of the input so it can be resumed after the upload expired
+        os.makedirs(os.path.join(self.directory, job.id), exist_ok=True)
+        await asyncio.to_thread(shutil.copyfile, input_path, self.job_path(job.id, "input.jsonl"))
+        await self._save(job)
+
+        self._jobs[job.id] = job
+        return job
+
+    def start(self, job: BatchJob, browser_context):
+        if job.id in self._tasks and not self._tasks[job.id].done():
+            return
+
+        self._tasks[job.id] = asyncio.create_task(self._run(job, browser_context))
+
+    def resume_all(self, browser_context):
+        for job in self._jobs.values():
+            if job.status in ("validating", "in_progress"):
+                logger.info(f"Resuming batch {job.id}")
+                self.start(job, browser_context)
+
+    async def cancel(self, batch_id: str) -> Optional[BatchJob]:
+        job = self._jobs.get(batch_id)
+
+        if job is None or job.status not in ("validating", "in_progress"):
+            return job
+
+        job.status = "cancelling"
+        task = self._tasks.get(batch_id)
+
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        job.status, job.cancelled_at = "cancelled", int(time.time())
+        await self._save(job)
+        return job
+
+    async def shutdown(self):
+        # running jobs stay "in_progress" on disk and are resumed on the next start
+        tasks = [t for t in self._tasks.values() if not t.done()]
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: BatchJob, browser_context):
+        output_path = self.job_path(job.id, "output.jsonl")
+
+        try:
+            lines = await asyncio.to_thread(_read_lines, self.job_path(job.id, "input.jsonl"))
+            finished = await asyncio.to_thread(_read_finished, output_path)
+        except OSError as err:
+            job.status, job.errors = "failed", [f"Failed to read batch files: {err}"]
+            await self._save(job)
+            return
+
+        pending = []
+        job.errors = []
+
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                request = BatchRequestInput.model_validate_json(line)
+            except ValidationError as err:
+                job.errors.append(f"line {line_number}: {err.errors()[0]['msg'] if err.errors() else err}")
+                continue
+
+            if not finished.get(request.custom_id):
+                pending.append(request)
+
+        # counted from the output file, so a resumed job keeps the failures of its previous run;
+        # those requests are retried and their count moves when the retry finishes
+        retried = {cid for cid, succeeded in finished.items() if not succeeded}
+        job.request_counts = BatchRequestCounts(
+            total=len(lines),
+            completed=sum(1 for succeeded in finished.values() if succeeded),
+            failed=len(job.errors) + len(retried)
+        )
+
+        if not lines or len(job.errors) == len(lines):
+            job.status, job.completed_at = "failed", int(time.time())
+            await self._save(job)
+            return
+
+        job.status = "in_progress"
+        job.in_progress_at = job.in_progress_at or int(time.time())
+        await self._save(job)
+
+        queue = iter(pending)
+        write_lock = asyncio.Lock()
+
+        async def worker():
+            for request in queue:
+                started = time.time()
+
+                try:
+                    # a restarted job retries the request in the same scope and resumes its interrupted run
+                    output = await execute_batch_request(
+                        request, browser_context, checkpoint_scope=f"batch:{job.id}:{request.custom_id}"
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    logger.error(f"Batch {job.id} request {request.custom_id} failed: {err}", exc_info=True)
+                    output = BatchRequestOutput(
+                        id=f"batch_req_{uuid.uuid4().hex}",
+                        custom_id=request.custom_id,
+                        response=None,
+                        error={"code": "internal_error", "message": str(err)}
+                    )
+
+                succeeded = output.error is None
+                metrics.inc("batch_requests_total", status="completed" if succeeded else "failed")
+                metrics.observe("batch_request_seconds", time.time() - started)
+
+                async with write_lock:
+                    await asyncio.to_thread(_append_line, output_path, output.model_dump_json())
+
+                    if request.custom_id in retried:
+                        retried.discard(request.custom_id)
+                        job.request_counts.failed -= 1
+
+                    if succeeded:
+                        job.request_counts.completed += 1
+                    else:
+                        job.request_counts.failed += 1
+
+                    await self._save(job)
+
+        await asyncio.gather(*[worker() for _ in range(job.concurrency)])
+
+        counts = job.request_counts
+        job.status = "failed" if counts.failed == counts.total else "completed"
+        job.completed_at = int(time.time())
+        await self._save(job)
+        logger.info(f"Batch {job.id} finished: {job.request_counts}")
+
+
+_manager: Optional[BatchManager] = None
+
+
+def get_batch_manager() -> BatchManager:
+    global _manager
+
+    if _manager is None:
+        _manager = BatchManager(BATCH_STORE_DIR)
+
+    return _manager
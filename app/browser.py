@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Union
+from browser_use import BrowserSession
+from browser_use.browser.views import BrowserStateSummary
+from pydantic import PrivateAttr
+from .asset_cache import get_asset_cache, ASSET_CACHE_ENABLED
+from .metrics import metrics
+from .network import NetworkBlocker, NetworkPolicy
+from .page_load import get_page_load_stats, page_domain, wait_for_dom_quiet, PAGE_LOAD_DOM_QUIET
+from .screenshots import (
+    capture_screenshot,
+    same_frame,
+    screenshot_hash,
+    SCREENSHOT_CROP,
+    SCREENSHOT_DEDUP,
+    SCREENSHOT_FORMAT,
+    SCREENSHOT_MAX_EDGE,
+    SCREENSHOT_QUALITY
+)
+
+logger = logging.getLogger(__name__)
+
+NO_VISUAL_CHANGE_NOTE = "no visual change since the previous screenshot"
+
+
+# BrowserSession with a screenshot pipeline in front of the agent's LLM:
+# frames are scaled and re-encoded by the browser, skipped while vision is off
+# and dropped when identical to the frame the LLM saw last.
+# It also blocks unwanted requests (see app/network.py), serves static assets from a
+# shared on-disk cache (see app/asset_cache.py) and waits for pages to settle
+# with a per-domain learned cap instead of a fixed one (see app/page_load.py).
+class AgentBrowserSession(BrowserSession):
+    _screenshots_enabled: bool = PrivateAttr(default=True)
+    _last_frame_hash: Union[int, str, None] = PrivateAttr(default=None)
+    _network: NetworkBlocker = PrivateAttr(default_factory=NetworkBlocker)
+    _page_wait: float = PrivateAttr(default=0)
+
+    async def start(self):
+        await super().start()
+
+        # routes run in reverse registration order: blocking first, then the asset cache
+        if ASSET_CACHE_ENABLED:
+            await get_asset_cache().install(self.browser_context)
+
+        await self._network.install(self.browser_context)
+        return self
+
+    @asynccontextmanager
+    async def network_policy(self, overrides: Optional[dict] = None) -> AsyncIterator[NetworkPolicy]:
+        # per-task blocking rules on top of the defaults, restored when the task ends
+        previous = self._network.policy
+        self._network.policy = previous.with_overrides(overrides)
+        await self._network.update(self.browser_context)
+
+        try:
+            yield self._network.policy
+        finally:
+            self._network.policy = previous
+            await self._network.update(self.browser_context)
+
+    async def block_images(self, enabled: bool = True):
+        self._network.policy.block_images = enabled
+        await self._network.update(self.browser_context)
+
+    def set_screenshots_enabled(self, enabled: bool):
+        self._screenshots_enabled = enabled
+
+        if not enabled:
+            # the LLM does not see this step's frame, so the next one is never a duplicate
+            self._last_frame_hash = None
+
+    def pop_page_wait(self) -> float:
+        # seconds spent waiting for pages to settle since the last call
+        waited, self._page_wait = self._page_wait, 0
+        return waited
+
+    async def _wait_for_stable_network(self):
+        # settled = network idle (browser-use's own filtering) and no DOM mutations,
+        # bounded by the cap learned for the domain
+        page = await self.get_current_page()
+        domain = page_domain(page.url)
+        stats = get_page_load_stats()
+        cap = stats.cap_for(domain)
+
+        started = time.time()
+        network = asyncio.create_task(super()._wait_for_stable_network())
+        dom = asyncio.create_task(wait_for_dom_quiet(page, PAGE_LOAD_DOM_QUIET, cap))
+
+        try:
+            done, pending = await asyncio.wait({network, dom}, timeout=cap)
+        finally:
+            for task in (network, dom):
+                task.cancel()
+
+            await asyncio.gather(network, dom, return_exceptions=True)
+
+        waited = time.time() - started
+        settled = not pending
+        dom_settled = dom.result() if dom in done and not dom.cancelled() and dom.exception() is None else None
+
+        # a domain whose network never goes idle learns from when its DOM settled instead
+        stats.observe(domain, waited if settled else (dom_settled or waited))
+
+        self._page_wait += waited
+        metrics.observe("page_load_wait_seconds", waited, outcome="settled" if settled else "capped")
+        logger.debug(f"Waited {waited:.2f}s for {domain} to settle (cap {cap:.2f}s, {'settled' if settled else 'capped'})")
+
+    async def take_screenshot(self, full_page: bool = False) -> Optional[str]:
+        if full_page:
+            return await super().take_screenshot(full_page=full_page)
+
+        if not self._screenshots_enabled:
+            return None
+
+        page = await self.get_current_page()
+        await page.wait_for_load_state()
+
+        started = time.time()
+        data = await capture_screenshot(
+            page,
+            max_edge=SCREENSHOT_MAX_EDGE,
+            image_format=SCREENSHOT_FORMAT,
+            quality=SCREENSHOT_QUALITY,
+            crop=SCREENSHOT_CROP
+        )
+
+        if data is None:
+            return await super().take_screenshot()
+
+        metrics.observe("screenshot_capture_seconds", time.time() - started)
+        return data
+
+    async def get_state_summary(self, cache_clickable_elements_hashes: bool) -> BrowserStateSummary:
+        state = await super().get_state_summary(cache_clickable_elements_hashes)
+
+        # only the per-step state (the one caching element hashes) goes to the LLM
+        if not cache_clickable_elements_hashes or not state.screenshot:
+            return state
+
+        if SCREENSHOT_DEDUP:
+            try:
+                frame_hash = screenshot_hash(state.screenshot)
+            except Exception as err:
+                logger.debug(f"Failed to hash screenshot: {err}")
+                frame_hash = None
+
+            if same_frame(frame_hash, self._last_frame_hash):
+                metrics.inc("screenshots_deduplicated_total")
+                state.screenshot = None
+
+                for tab in state.tabs:
+                    if tab.url == state.url and NO_VISUAL_CHANGE_NOTE not in tab.title:
+                        tab.title = f"{tab.title} ({NO_VISUAL_CHANGE_NOTE})"
+
+                return state
+
+            self._last_frame_hash = frame_hash
+
+        metrics.inc("screenshots_sent_total")
+        metrics.inc("screenshot_bytes_total", len(state.screenshot) * 3 // 4)
+        return state
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Protocol
+from .browser import AgentBrowserSession
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# factory sessions kept created ahead of demand (part of the factory limit), refilled after each lease
+WARM_STANDBY_CONTEXTS = int(os.getenv("WARM_STANDBY_CONTEXTS", 1))
+# pages the spares open while waiting, round robin; empty keeps them on about:blank
+WARM_STANDBY_URLS = [e.strip() for e in os.getenv("WARM_STANDBY_URLS", "https://www.google.com").split(",") if e.strip()]
+WARM_STANDBY_NAVIGATION_TIMEOUT = float(os.getenv("WARM_STANDBY_NAVIGATION_TIMEOUT", 15))
+# spares older than this are replaced, their storage state would be stale
+WARM_STANDBY_MAX_AGE = float(os.getenv("WARM_STANDBY_MAX_AGE", 600))
+
+
+class LeaseTimeoutError(Exception):
+    pass
+
+
+class SessionFactory(Protocol):
+    async def create(self) -> AgentBrowserSession: ...
+
+    async def dispose(self, session: AgentBrowserSession): ...
+
+
+# browser sessions that browsing tasks lease one at a time, so concurrent requests never share a context.
+# Long-lived sessions are handed out first; with a factory, up to `limit` more are created per lease
+# and disposed of afterwards. `standby` of those are created (and pre-navigated) before they are asked for.
+class BrowserPool(object):
+    def __init__(self):
+        self._sessions: list[AgentBrowserSession] = []
+        self._idle: list[AgentBrowserSession] = []
+        self._factory: Optional[SessionFactory] = None
+        self._limit = 0
+        # factory sessions alive, leased or spare
+        self._created = 0
+        self._spares: list[tuple[float, AgentBrowserSession]] = []
+        self._standby = 0
+        self._warmed = 0
+        self._refilling: Optional[asyncio.Task] = None
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    @property
+    def size(self) -> int:
+        return len(self._sessions) + self._limit
+
+    @property
+    def isolated_limit(self) -> int:
+        # how many factory (isolated) sessions may exist at once, 0 without a factory
+        return self._limit if self._factory is not None else 0
+
+    def add(self, session: AgentBrowserSession):
+        self._sessions.append(session)
+        self._idle.append(session)
+        self._report()
+
+    def set_factory(self, factory: SessionFactory, limit: int, standby: int = 0):
+        self._factory = factory
+        self._limit = limit
+        self._standby = min(standby, limit)
+        self._report()
+        self._refill_soon()
+
+    def _report(self):
+        metrics.set("browser_pool_size", self.size)
+        metrics.set("browser_pool_idle", len(self._idle) + self._limit - self._created + len(self._spares))
+        metrics.set("browser_pool_spares", len(self._spares))
+
+    def _refill_soon(self):
+        if self._standby and not self._closed and (self._refilling is None or self._refilling.done()):
+            self._refilling = asyncio.create_task(self._refill())
+
+    async def _warm(self, session: AgentBrowserSession):
+        if not WARM_STANDBY_URLS:
+            return
+
+        url = WARM_STANDBY_URLS[self._warmed % len(WARM_STANDBY_URLS)]
+        self._warmed += 1
+
+        try:
+            await asyncio.wait_for(session.navigate_to(url), timeout=WARM_STANDBY_NAVIGATION_TIMEOUT)
+        except Exception as err:
+            logger.debug(f"Spare session failed to pre-navigate to {url}: {err}")
+
+    async def _refill(self):
+        while not self._closed:
+            async with self._changed:
+                if len(self._spares) >= self._standby or self._created >= self._limit:
+                    return
+
+                self._created += 1
+
+            try:
+                session = await self._factory.create()
+                await self._warm(session)
+            except Exception as err:
+                logger.warning(f"Failed to create a spare browser session: {err}")
+                await self._forget_created()
+                return
+
+            async with self._changed:
+                self._spares.append((time.time(), session))
+                self._changed.notify()
+
+            self._report()
+
+    async def _discard(self, session: AgentBrowserSession):
+        try:
+            await asyncio.shield(self._factory.dispose(session))
+        except Exception as err:
+            logger.warning(f"Failed to dispose of a pooled browser session: {err}")
+
+        await self._forget_created()
+
+    async def _acquire(
+        self,
+        wait: bool = True,
+        timeout: Optional[float] = None,
+        isolated: bool = False
+    ) -> Optional[tuple[AgentBrowserSession, bool]]:
+        # without `wait`, only a session that is ready right now (idle, spare or creatable) is handed out;
+        # with a `timeout`, waiting for a busy pool gives up after that many seconds;
+        # `isolated` never hands out a long-lived session (the main context on the persistent profile)
+        deadline = time.time() + timeout if timeout is not None else None
+        stale = []
+        create = False
+
+        try:
+            async with self._changed:
+                while True:
+                    if self._idle and not isolated:
+                        return self._idle.pop(0), False
+
+                    while self._spares and time.time() - self._spares[0][0] > WARM_STANDBY_MAX_AGE:
+                        stale.append(self._spares.pop(0)[1])
+
+                    if self._spares:
+                        session = self._spares.pop(0)[1]
+                        break
+
+                    session = None
+
+                    if self._created < self._limit and (wait or isolated):
+                        self._created += 1
+                        create = True
+                        break
+
+                    if not wait:
+                        break
+
+                    if deadline is None:
+                        await self._changed.wait()
+                        continue
+
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), max(0.0, deadline - time.time()))
+                    except asyncio.TimeoutError:
+                        metrics.inc("browser_pool_lease_timeouts_total")
+                        raise LeaseTimeoutError(f"No browser context became free within {timeout:.1f}s") from None
+        finally:
+            for old in stale:
+                asyncio.create_task(self._discard(old))
+
+        if session is None and not create:
+            return None
+
+        metrics.inc("browser_pool_spare_leases_total", hit=str(session is not None).lower())
+        self._refill_soon()
+
+        if session is not None:
+            return session, True
+
+        try:
+            return await self._factory.create(), True
+        except BaseException:
+            await self._forget_created()
+            raise
+
+    async def _forget_created(self):
+        async with self._changed:
+            self._created -= 1
+            self._changed.notify()
+
+        self._refill_soon()
+
+    @asynccontextmanager
+    async def lease(
+        self,
+        wait: bool = True,
+        timeout: Optional[float] = None,
+        isolated: bool = False
+    ) -> AsyncIterator[Optional[AgentBrowserSession]]:
+        started = time.time()
+        acquired = await self._acquire(wait=wait, timeout=timeout, isolated=isolated)
+
+        if acquired is None:
+            yield None
+            return
+
+        session, created = acquired
+        metrics.observe("browser_pool_wait_seconds", time.time() - started)
+        self._report()
+
+        try:
+            yield session
+        finally:
+            if created:
+                await self._discard(session)
+            else:
+                async with self._changed:
+                    self._idle.append(session)
+                    self._changed.notify()
+
+            self._report()
+
+    async def close(self):
+        self._closed = True
+
+        if self._refilling is not None:
+            self._refilling.cancel()
+
+        spares, self._spares = self._spares, []
+
+        for _, session in spares:
+            await self._discard(session)
+
+
+_pool: Optional[BrowserPool] = None
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+
+    if _pool is None:
+        _pool = BrowserPool()
+
+    return _pool
@@ -0,0 +1,87 @@
+import math
+import os
+import time
+from typing import Any, Optional
+from pydantic import BaseModel
+
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", 40))
+PROMPT_MAX_TOOL_CALLS = int(os.getenv("PROMPT_MAX_TOOL_CALLS", 10))
+# time kept aside to let the agent write up its partial findings before the deadline
+BUDGET_FINALIZE_RESERVE_SECONDS = float(os.getenv("BUDGET_FINALIZE_RESERVE_SECONDS", 20))
+# share of the token budget after which the agent is asked to wrap up
+BUDGET_FINALIZE_TOKEN_RATIO = float(os.getenv("BUDGET_FINALIZE_TOKEN_RATIO", 0.9))
+
+
+def parse_positive_number(value: Any, name: str) -> Optional[float]:
+    if value is None:
+        return None
+
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value <= 0:
+        raise ValueError(f"{name} must be a positive number")
+
+    return float(value)
+
+
+class RequestBudget(BaseModel):
+    deadline: Optional[float] = None  # unix timestamp
+    max_steps: int = AGENT_MAX_STEPS
+    max_tool_calls: int = PROMPT_MAX_TOOL_CALLS
+    max_tokens: Optional[int] = None
+    tokens_used: int = 0
+
+    @classmethod
+    def from_request(
+        cls,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        max_steps: Optional[int] = None,
+        max_tool_calls: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> "RequestBudget":
+        deadlines = [float(d) for d in [deadline] if d is not None]
+
+        if timeout is not None:
+            deadlines.append(time.time() + float(timeout))
+
+        return cls(
+            deadline=min(deadlines) if deadlines else None,
+            max_steps=min(int(max_steps), AGENT_MAX_STEPS) if max_steps is not None else AGENT_MAX_STEPS,
+            max_tool_calls=min(int(max_tool_calls), PROMPT_MAX_TOOL_CALLS) if max_tool_calls is not None else PROMPT_MAX_TOOL_CALLS,
+            max_tokens=int(max_tokens) if max_tokens is not None else None
+        )
+
+    def remaining_seconds(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+
+        return max(0.0, self.deadline - time.time())
+
+    def request_timeout(self, minimum: float = BUDGET_FINALIZE_RESERVE_SECONDS / 2) -> Optional[float]:
+        # an LLM call may run into the reserve, but never gets less than `minimum` seconds
+        remaining = self.remaining_seconds()
+        return None if remaining is None else max(remaining, minimum)
+
+    def add_tokens(self, tokens: int):
+        self.tokens_used += tokens or 0
+
+    def tokens_left(self, extra_used: int = 0) -> Optional[int]:
+        if self.max_tokens is None:
+            return None
+
+        return self.max_tokens - self.tokens_used - extra_used
+
+    def exhausted(self, extra_tokens: int = 0) -> bool:
+        remaining, tokens_left = self.remaining_seconds(), self.tokens_left(extra_tokens)
+        return (remaining is not None and remaining <= 0) or (tokens_left is not None and tokens_left <= 0)
+
+    def nearly_spent(self, expected_step_seconds: float = 0, extra_tokens: int = 0) -> Optional[str]:
+        # returns why the work should be wrapped up now, or None while there is room for another step
+        remaining = self.remaining_seconds()
+
+        if remaining is not None and remaining <= BUDGET_FINALIZE_RESERVE_SECONDS + expected_step_seconds:
+            return f"only {remaining:.0f}s left before the deadline"
+
+        if self.max_tokens is not None and self.tokens_used + extra_tokens >= self.max_tokens * BUDGET_FINALIZE_TOKEN_RATIO:
+            return f"{self.tokens_used + extra_tokens} of {self.max_tokens} tokens used"
+
+        return None
@@ -1,14 +1,177 @@
 from browser_use import Agent
+from langchain_core.messages import HumanMessage
 import logging
+from .progress import StepEvent, PROGRESS_THUMBNAILS, PROGRESS_THUMBNAIL_MAX_EDGE
+from .browser import AgentBrowserSession
+from .checkpoints import AgentCheckpoint, get_checkpoint_store
+from .screenshot_spool import is_spool_ref
+from .run_context import AgentRunContext
+from .network import NETWORK_BLOCK_IMAGES_WITHOUT_VISION
+from .screenshots import capture_screenshot
+from .vision import decide_vision, record_vision_decision, VISION_POLICY
 
 logger = logging.getLogger()
 
-async def on_task_start(agent: Agent) -> Agent: 
+
+def get_run_context(agent: Agent) -> AgentRunContext:
+    return agent.context if isinstance(agent.context, AgentRunContext) else None
+
+
+def summarize_last_step(agent: Agent, run_context: AgentRunContext, duration: float = None) -> StepEvent:
+    history = agent.state.history.history
+    last = history[-1] if history else None
+
+    actions, errors, url = [], [], None
+
+    if last is not None:
+        if last.model_output is not None:
+            actions = [a.model_dump(exclude_unset=True) for a in last.model_output.action]
+
+        errors = [r.error for r in last.result if r.error]
+        url = last.state.url or None
+
+    return StepEvent(
+        phase="completed",
+        step=len(history),
+        max_steps=run_context.max_steps,
+        actions=actions,
+        url=url,
+        duration=duration,
+        errors=errors
+    )
+
+
+def enforce_budget(agent: Agent, run_context: AgentRunContext):
+    if run_context.finalize_reason is not None:
+        return
+
+    reason = run_context.budget.nearly_spent(
+        expected_step_seconds=run_context.expected_step_seconds(),
+        extra_tokens=agent.state.history.total_input_tokens() - run_context.resumed_tokens
+    )
+
+    if reason is None:
+        return
+
+    logger.info(f"Request budget nearly spent ({reason}), asking the agent to finish")
+    run_context.finalize_reason = reason
+
+    agent._message_manager._add_message_with_tokens(
+        HumanMessage(
+            content=f'The time/token budget for this task is almost spent ({reason}). '
+            'Use only the "done" action now, with status "pending" if the task is not fully finished, '
+            'and put everything you found out so far into the message.'
+        )
+    )
+
+
+def set_screenshots_enabled(agent: Agent, enabled: bool):
+    if isinstance(agent.browser_session, AgentBrowserSession):
+        agent.browser_session.set_screenshots_enabled(enabled)
+
+
+async def spill_screenshots(agent: Agent, run_context: AgentRunContext):
+    for step, item in enumerate(agent.state.history.history, start=1):
+        if item.state.screenshot and not is_spool_ref(item.state.screenshot):
+            item.state.screenshot = await run_context.screenshot_spool.spill(step, item.state.screenshot)
+
+
+async def save_checkpoint(agent: Agent, run_context: AgentRunContext):
+    history = agent.state.history.history
+
+    # a failed step (e.g. the browser went away) keeps the last good checkpoint to resume from
+    if not history or agent.state.history.is_done() or any(r.error for r in history[-1].result):
+        return
+
+    await get_checkpoint_store().save(
+        AgentCheckpoint.capture(run_context.checkpoint_key, run_context.task, agent.state)
+    )
+
+
+async def apply_vision_policy(agent: Agent, run_context: AgentRunContext):
+    if run_context.vision_supported is None:
+        run_context.vision_supported = agent.settings.use_vision
+        run_context.vision_for_planner_supported = agent.settings.use_vision_for_planner
+
+        never_looks = not run_context.vision_supported or VISION_POLICY == "never"
+
+        if never_looks and NETWORK_BLOCK_IMAGES_WITHOUT_VISION and isinstance(agent.browser_session, AgentBrowserSession):
+            await agent.browser_session.block_images()
+
+    if not run_context.vision_supported:
+        set_screenshots_enabled(agent, False)
+        return
+
+    decision = await decide_vision(
+        await agent.browser_session.get_current_page(),
+        agent.state.last_result,
+        run_context.page_probe
+    )
+
+    run_context.page_probe = decision.probe
+    record_vision_decision(decision)
+
+    agent.settings.use_vision = decision.use_vision
+    agent.settings.use_vision_for_planner = run_context.vision_for_planner_supported and decision.use_vision
+    set_screenshots_enabled(agent, decision.use_vision)
+
+    logger.info(f"Vision {'on' if decision.use_vision else 'off'} for this step ({decision.reason})")
+
+
+async def on_task_start(agent: Agent) -> Agent:
     logger.info("on_agent_start: reached")
+    run_context = get_run_context(agent)
+
+    if run_context is not None:
+        run_context.mark_step_start()
+        enforce_budget(agent, run_context)
+        await apply_vision_policy(agent, run_context)
+
+        if run_context.progress is not None:
+            await run_context.progress.publish(
+                StepEvent(
+                    phase="started",
+                    step=len(agent.state.history.history) + 1,
+                    max_steps=run_context.max_steps
+                )
+            )
+
     # custom your logic here
     return agent
 
 async def on_task_completed(agent: Agent) -> Agent:
     logger.info("on_task_completed: reached")
+    run_context = get_run_context(agent)
+
+    if run_context is None:
+        return agent
+
+    duration = run_context.mark_step_end()
+
+    if run_context.screenshot_spool is not None:
+        await spill_screenshots(agent, run_context)
+
+    if run_context.checkpoint_key is not None:
+        await save_checkpoint(agent, run_context)
+
+    if run_context.finalize_reason is not None and not agent.state.history.is_done():
+        # the agent ignored the request to finish, browse() turns its history into a partial result
+        agent.stop()
+
+    if run_context.progress is not None:
+        event = summarize_last_step(agent, run_context, duration=duration)
+
+        if isinstance(agent.browser_session, AgentBrowserSession):
+            event.page_wait = round(agent.browser_session.pop_page_wait(), 2)
+
+        if PROGRESS_THUMBNAILS:
+            event.thumbnail = await capture_screenshot(
+                await agent.browser_session.get_current_page(),
+                max_edge=PROGRESS_THUMBNAIL_MAX_EDGE,
+                quality=50
+            )
+
+        await run_context.progress.publish(event)
+
     # custom your logic here
     return agent
@@ -0,0 +1,210 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+from browser_use.agent.message_manager.views import MessageManagerState
+from browser_use.agent.views import AgentHistoryList, AgentOutput, AgentState
+from pydantic import BaseModel
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "1").lower() in ("1", "true", "yes")
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "/storage/agent-checkpoints")
+# checkpoints older than this are not resumed and get swept
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", 6 * 3600))
+
+
+def checkpoint_key(scope: str, task: str) -> str:
+    # a retried request carries the same scope (its conversation or batch request) and task, which is
+    # what finds the interrupted run again; the scope keeps other clients' runs of the same task apart
+    return hashlib.sha256(f"{scope}\n{task}".encode("utf-8")).hexdigest()[:32]
+
+
+def last_url(history: AgentHistoryList) -> Optional[str]:
+    for item in reversed(history.history):
+        if item.state.url and not item.state.url.startswith("about:"):
+            return item.state.url
+
+    return None
+
+
+class AgentCheckpoint(BaseModel):
+    key: str
+    task: str
+    url: Optional[str] = None
+    n_steps: int
+    last_plan: Optional[str] = None
+    input_tokens: int = 0
+    history: dict[str, Any]
+    messages: dict[str, Any]
+    updated_at: float
+
+    @classmethod
+    def capture(cls, key: str, task: str, state: AgentState) -> "AgentCheckpoint":
+        history = state.history.model_dump()
+
+        # screenshots are the bulk of the history and are retaken on resume anyway
+        for item in history["history"]:
+            item["state"]["screenshot"] = None
+
+        return cls(
+            key=key,
+            task=task,
+            url=last_url(state.history),
+            n_steps=state.n_steps,
+            last_plan=state.last_plan,
+            input_tokens=state.history.total_input_tokens(),
+            history=history,
+            messages=state.message_manager_state.model_dump(mode="json"),
+            updated_at=time.time()
+        )
+
+    def restore(self, output_model: type[AgentOutput]) -> AgentState:
+        data = copy.deepcopy(self.history)
+
+        # same enrichment as AgentHistoryList.load_from_file, the actions depend on the controller
+        for item in data["history"]:
+            if isinstance(item.get("model_output"), dict):
+                item["model_output"] = output_model.model_validate(item["model_output"])
+
+            item["state"].setdefault("interacted_element", None)
+
+        history = AgentHistoryList.model_validate(data)
+
+        return AgentState(
+            n_steps=self.n_steps,
+            last_plan=self.last_plan,
+            last_result=history.history[-1].result if history.history else None,
+            history=history,
+            message_manager_state=MessageManagerState.model_validate(copy.deepcopy(self.messages))
+        )
+
+
+class CheckpointStore(object):
+    # one json file per task key, rewritten after every step; a key is held by at most one run at a time
+    def __init__(self, directory: str, ttl_seconds: float):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._claimed: set[str] = set()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def claim(self, key: str) -> bool:
+        if key in self._claimed:
+            return False
+
+        self._claimed.add(key)
+        return True
+
+    def release(self, key: str):
+        self._claimed.discard(key)
+
+    def _read(self, key: str) -> Optional[AgentCheckpoint]:
+        path = self._path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "r") as fp:
+                checkpoint = AgentCheckpoint.model_validate(json.load(fp))
+        except Exception as err:
+            logger.warning(f"Failed to read checkpoint {key}: {err}")
+            return None
+
+        if self.ttl_seconds > 0 and time.time() - checkpoint.updated_at > self.ttl_seconds:
+            return None
+
+        return checkpoint
+
+    def _write(self, checkpoint: AgentCheckpoint):
+        path = self._path(checkpoint.key)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "w") as fp:
+            fp.write(checkpoint.model_dump_json())
+
+        os.replace(tmp_path, path)
+
+    def _unlink(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def load(self, key: str) -> Optional[AgentCheckpoint]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def save(self, checkpoint: AgentCheckpoint):
+        started = time.time()
+
+        try:
+            await asyncio.to_thread(self._write, checkpoint)
+        except Exception as err:
+            logger.warning(f"Failed to write checkpoint {checkpoint.key}: {err}")
+            return
+
+        metrics.inc("agent_checkpoints_saved_total")
+        metrics.observe("agent_checkpoint_save_seconds", time.time() - started)
+
+    async def discard(self, key: str):
+        await asyncio.to_thread(self._unlink, key)
+
+    def _sweep(self) -> int:
+        removed = 0
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            key = name.split(".")[0]
+
+            try:
+                if key not in self._claimed and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+
+        return removed
+
+    async def sweep(self) -> int:
+        if self.ttl_seconds <= 0:
+            return 0
+
+        return await asyncio.to_thread(self._sweep)
+
+
+_store: Optional[CheckpointStore] = None
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    global _store
+
+    if _store is None:
+        _store = CheckpointStore(CHECKPOINT_DIR, ttl_seconds=CHECKPOINT_TTL_SECONDS)
+
+    return _store
+
+
+async def resume_agent_state(session, controller, checkpoint: AgentCheckpoint) -> Optional[AgentState]:
+    # fast-forwards a fresh context to where the interrupted run was, instead of replaying its steps
+    try:
+        state = checkpoint.restore(AgentOutput.type_with_custom_actions(controller.registry.create_action_model()))
+
+        if checkpoint.url:
+            await session.navigate_to(checkpoint.url)
+    except Exception as err:
+        logger.warning(f"Failed to resume checkpoint {checkpoint.key}, starting over: {err}")
+        metrics.inc("agent_checkpoints_resumed_total", status="error")
+        return None
+
+    logger.info(f"Resuming task from step {checkpoint.n_steps} at {checkpoint.url}")
+    metrics.inc("agent_checkpoints_resumed_total", status="ok")
+    return state
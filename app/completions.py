@@ -0,0 +1,226 @@
+import json
+import logging
+from typing import Any, AsyncGenerator, Optional, Union
+from pydantic import ValidationError
+from .agent import prompt
+from .budget import parse_positive_number
+from .context_budget import parse_token_limit
+from .conversations import is_valid_conversation_id
+from .llms import get_llm_config
+from .network import parse_network_overrides
+from .models.oai_compatible_models import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    ChatCompletionResponseChoice,
+    ChatCompletionStreamResponse,
+    ChatMessage,
+    UsageInfo,
+    random_uuid
+)
+from .sse import ChunkEncoder, dumps_json
+
+logger = logging.getLogger(__name__)
+
+
+class PromptFailedError(Exception):
+    def __init__(self, message: str, details: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+
+class InvalidChatRequestError(ValueError):
+    pass
+
+
+def parse_chat_request(data: Any) -> ChatCompletionRequest:
+    try:
+        request = ChatCompletionRequest.model_validate(data)
+    except ValidationError as err:
+        details = "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in err.errors())
+        raise InvalidChatRequestError(details or str(err)) from err
+
+    if not request.messages:
+        raise InvalidChatRequestError("messages: at least one message is required")
+
+    if (request.n or 1) != 1:
+        raise InvalidChatRequestError("n: only one choice per request is supported")
+
+    return request
+
+
+def response_model_name(request: ChatCompletionRequest) -> str:
+    return request.model or get_llm_config("prompt").model
+
+
+# non OpenAI body fields passed on to prompt()
+_OPTION_NAMES = {
+    "conversation_id", "timeout", "deadline", "max_steps", "max_tool_calls",
+    "token_budget", "max_context_tokens", "network"
+}
+
+
+def chat_request_options(request: ChatCompletionRequest) -> dict[str, Any]:
+    # the non OpenAI body fields prompt() understands, validated; anything else is ignored
+    extra = request.model_extra or {}
+    options: dict[str, Any] = {}
+
+    for name in sorted(extra.keys() - _OPTION_NAMES):
+        logger.debug(f"Ignoring unsupported chat completion field {name!r}")
+
+    if extra.get("conversation_id") is not None:
+        if not is_valid_conversation_id(extra["conversation_id"]):
+            raise InvalidChatRequestError("conversation_id: must be 1-128 characters of [A-Za-z0-9_-]")
+
+        options["conversation_id"] = extra["conversation_id"]
+
+    for name in ("timeout", "deadline"):
+        try:
+            options[name] = parse_positive_number(extra.get(name), name)
+        except ValueError as err:
+            raise InvalidChatRequestError(f"{name}: must be a positive number") from err
+
+    for name in ("max_steps", "max_tool_calls", "token_budget", "max_context_tokens"):
+        try:
+            options[name] = parse_token_limit(extra.get(name), name)
+        except ValueError as err:
+            raise InvalidChatRequestError(f"{name}: must be a positive integer") from err
+
+    try:
+        options["network"] = parse_network_overrides(extra.get("network"))
+    except ValueError as err:
+        raise InvalidChatRequestError(str(err)) from err
+
+    return options
+
+
+def new_turn_messages(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # clients resend the whole history, a stored conversation already has everything up to
+    # the last assistant message; the first turn has none and is kept whole
+    last_assistant = max((i for i, m in enumerate(messages) if m.get("role") == "assistant"), default=-1)
+    return messages[last_assistant + 1:]
+
+
+def run_chat_request(
+    request: ChatCompletionRequest, 
+    browser_context, 
+    usage: Optional[UsageInfo] = None,
+    checkpoint_scope: Optional[str] = None
+) -> AsyncGenerator[Union[str, bytes], None]:
+    # raises InvalidChatRequestError right away, before anything is streamed
+    options = chat_request_options(request)
+    messages = [dict(m) for m in request.messages]
+
+    if options.get("conversation_id") is not None:
+        messages = new_turn_messages(messages)
+
+        if not messages:
+            raise InvalidChatRequestError("messages: a conversation turn needs a message after the last assistant message")
+
+    return prompt(
+        messages,
+        browser_context=browser_context,
+        usage=usage,
+        checkpoint_scope=checkpoint_scope,
+        **options
+    )
+
+
+def parse_error_chunk(chunk: bytes) -> Optional[dict]:
+    # prompt() reports failures as a `data: {"type": "error", ...}` chunk
+    if b'"error"' not in chunk:
+        return None
+
+    try:
+        data = json.loads(chunk.decode().removeprefix("data: ").strip())
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+    return data if isinstance(data, dict) and data.get("type") == "error" else None
+
+
+async def collect_completion(
+    stream: AsyncGenerator[Union[str, bytes], None],
+    model: str,
+    usage: Optional[UsageInfo] = None,
+    response_id: Optional[str] = None
+) -> ChatCompletionResponse:
+    # drains a prompt() stream into a single chat.completion; text chunks are the assistant's answer,
+    # tool / progress chunks are dropped
+    content = []
+
+    async for chunk in stream:
+        if isinstance(chunk, str):
+            content.append(chunk)
+            continue
+
+        error = parse_error_chunk(chunk) if chunk else None
+
+        if error is not None:
+            raise PromptFailedError(error.get("message") or "Unknown error", error.get("details"))
+
+    return ChatCompletionResponse(
+        id=response_id or f"chatcmpl-{random_uuid()}",
+        model=model,
+        choices=[
+            ChatCompletionResponseChoice(
+                index=0,
+                message=ChatMessage(role="assistant", content="".join(content))
+            )
+        ],
+        usage=usage or UsageInfo()
+    )
+
+
+async def stream_completion(
+    stream: AsyncGenerator[Union[str, bytes], None],
+    model: str,
+    usage: Optional[UsageInfo] = None,
+    include_usage: bool = False,
+    response_id: Optional[str] = None
+) -> AsyncGenerator[bytes, None]:
+    # openai style chat.completion.chunk stream: assistant text only, a finish chunk,
+    # an optional usage chunk and [DONE]; errors are sent as {"error": {...}}
+    encoder = ChunkEncoder(response_id or f"chatcmpl-{random_uuid()}", model=model)
+    error = None
+
+    try:
+        async for chunk in stream:
+            if isinstance(chunk, str):
+                if chunk:
+                    yield encoder.encode(chunk)
+
+                continue
+
+            error = parse_error_chunk(chunk) if chunk else None
+
+            if error is not None:
+                break
+    except Exception as err:
+        logger.error(f"Chat completion stream failed: {err}", exc_info=True)
+        error = {"message": f"Unhandled error: {err}"}
+    finally:
+        await stream.aclose()
+
+    if error is not None:
+        yield b"data: " + dumps_json({"error": {"message": error.get("message"), "type": "server_error", "code": 500}}) + b"\n\n"
+    else:
+        finish = ChatCompletionStreamResponse(
+            id=encoder.response_id,
+            created=encoder.created,
+            model=model,
+            choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        )
+        yield f"data: {finish.model_dump_json()}\n\n".encode()
+
+        if include_usage:
+            usage_chunk = ChatCompletionStreamResponse(
+                id=encoder.response_id,
+                created=encoder.created,
+                model=model,
+                choices=[],
+                usage=usage or UsageInfo()
+            )
+            yield f"data: {usage_chunk.model_dump_json()}\n\n".encode()
+
+    yield b"data: [DONE]\n\n"
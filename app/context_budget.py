@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Optional
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 24000))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+# old tool results and long turns are cut down to roughly this many tokens
+CONTEXT_TRUNCATE_TOKENS = int(os.getenv("CONTEXT_TRUNCATE_TOKENS", 512))
+
+_MESSAGE_OVERHEAD_TOKENS = 4
+_TRUNCATION_MARKER = "\n[... {omitted} tokens omitted to fit the context budget ...]\n"
+
+_encoding = None
+_encoding_state = "unloaded"  # unloaded | loading | ready | failed
+_encoding_lock = threading.Lock()
+
+
+def _load_encoding():
+    global _encoding, _encoding_state
+
+    try:
+        import tiktoken
+        # tiktoken downloads the encoding on first use unless it is in TIKTOKEN_CACHE_DIR,
+        # the image bakes it in, elsewhere the download happens here in the background
+        _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER)
+        _encoding_state = "ready"
+    except Exception as err:
+        logger.warning(f"Tokenizer {CONTEXT_TOKENIZER!r} unavailable, estimating tokens from length: {err}")
+        _encoding_state = "failed"
+
+
+def _get_encoding():
+    global _encoding_state
+
+    if _encoding_state == "unloaded" and CONTEXT_TOKENIZER:
+        with _encoding_lock:
+            if _encoding_state == "unloaded":
+                _encoding_state = "loading"
+                threading.Thread(target=_load_encoding, name="tokenizer-loader", daemon=True).start()
+
+    # until the encoding is loaded (or if it never is) tokens are estimated from the length
+    return _encoding
+
+
+def count_text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    return (len(text) + 3) // 4
+
+
+def parse_token_limit(value: Any, name: str = "max_context_tokens") -> Optional[int]:
+    if value is None:
+        return None
+
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be a positive integer")
+
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a positive integer") from None
+
+    if limit <= 0:
+        raise ValueError(f"{name} must be a positive integer")
+
+    return limit
+
+
+def _content_text(content: Any) -> str:
+    if content is None:
+        return ""
+
+    if isinstance(content, str):
+        return content
+
+    return json.dumps(content, ensure_ascii=False)
+
+
+def count_message_tokens(message: dict[str, Any]) -> int:
+    tokens = _MESSAGE_OVERHEAD_TOKENS + count_text_tokens(_content_text(message.get("content")))
+
+    for call in message.get("tool_calls") or []:
+        function = call.get("function") or {}
+        tokens += count_text_tokens(function.get("name") or "") + count_text_tokens(function.get("arguments") or "")
+
+    return tokens
+
+
+def count_messages_tokens(messages: list[dict[str, Any]]) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+
+def truncate_text(text: str, max_tokens: int) -> tuple[str, int]:
+    total = count_text_tokens(text)
+
+    if total <= max_tokens:
+        return text, 0
+
+    # keep head and tail, the middle of long pages / dumps is the least useful part
+    ratio = max_tokens / total
+    head = int(len(text) * ratio * 0.75)
+    tail = int(len(text) * ratio * 0.25)
+    omitted = total - max_tokens
+
+    return text[:head] + _TRUNCATION_MARKER.format(omitted=omitted) + (text[-tail:] if tail > 0 else ""), omitted
+
+
+class CompactionReport(BaseModel):
+    budget: int
+    tokens_before: int
+    tokens_after: int
+    truncated_messages: int = 0
+    dropped_messages: int = 0
+    dropped_roles: dict[str, int] = {}
+
+    @property
+    def changed(self) -> bool:
+        return self.truncated_messages > 0 or self.dropped_messages > 0
+
+
+def _group_units(messages: list[dict[str, Any]], start: int) -> list[list[int]]:
+    # an assistant message with tool calls and its tool answers have to be kept or dropped together
+    units: list[list[int]] = []
+
+    for i in range(start, len(messages)):
+        if messages[i].get("role") == "tool" and units and messages[units[-1][0]].get("tool_calls"):
+            units[-1].append(i)
+        else:
+            units.append([i])
+
+    return units
+
+
+def compact_messages(
+    messages: list[dict[str, Any]],
+    budget: Optional[int] = None,
+    truncate_tokens: Optional[int] = None
+) -> tuple[list[dict[str, Any]], CompactionReport]:
+    budget = budget or CONTEXT_TOKEN_BUDGET
+    truncate_tokens = truncate_tokens or CONTEXT_TRUNCATE_TOKENS
+
+    sizes = [count_message_tokens(m) for m in messages]
+    report = CompactionReport(budget=budget, tokens_before=sum(sizes), tokens_after=sum(sizes))
+
+    if report.tokens_before <= budget:
+        return messages, report
+
+    messages = list(messages)
+
+    # the leading system messages are never touched, so the cached prompt prefix stays valid
+    prefix = 0
+    while prefix < len(messages) and messages[prefix].get("role") == "system":
+        prefix += 1
+
+    last_user = max(
+        [i for i in range(prefix, len(messages)) if messages[i].get("role") == "user"],
+        default=len(messages) - 1
+    )
+
+    def total() -> int:
+        return sum(sizes)
+
+    def shrink(i: int, limit: int) -> bool:
+        content = messages[i].get("content")
+
+        if not isinstance(content, str):
+            return False
+
+        truncated, omitted = truncate_text(content, limit)
+
+        if omitted == 0:
+            return False
+
+        messages[i] = {**messages[i], "content": truncated}
+        sizes[i] = count_message_tokens(messages[i])
+        report.truncated_messages += 1
+        return True
+
+    units = _group_units(messages, prefix)
+    recent = set(units[-1]) if units else set()
+
+    # 1. old tool results, 2. other long turns before the latest user message,
+    # 3. the current turn's tool results down to half of the budget, 4. whole old units,
+    # 5. as a last resort the current turn's tool results down to the truncation size
+    for i in range(prefix, len(messages)):
+        if total() <= budget:
+            break
+
+        if messages[i].get("role") == "tool" and i not in recent:
+            shrink(i, truncate_tokens)
+
+    for i in range(prefix, last_user):
+        if total() <= budget:
+            break
+
+        if messages[i].get("role") != "tool":
+            shrink(i, truncate_tokens)
+
+    for i in range(last_user, len(messages)):
+        if total() <= budget:
+            break
+
+        if messages[i].get("role") == "tool":
+            shrink(i, max(budget // 2, truncate_tokens))
+
+    dropped: set[int] = set()
+
+    for unit in units:
+        if total() <= budget or unit[-1] >= last_user:
+            break
+
+        for i in unit:
+            dropped.add(i)
+            role = messages[i].get("role", "undefined")
+            report.dropped_roles[role] = report.dropped_roles.get(role, 0) + 1
+            sizes[i] = 0
+
+    for i in range(last_user, len(messages)):
+        if total() <= budget:
+            break
+
+        if messages[i].get("role") == "tool":
+            shrink(i, truncate_tokens)
+
+    report.dropped_messages = len(dropped)
+    report.tokens_after = total()
+
+    if report.tokens_after > budget:
+        logger.warning(f"Context still exceeds the budget after compaction: {report.tokens_after} > {budget} tokens")
+
+    return [m for i, m in enumerate(messages) if i not in dropped], report
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from .uploads import get_upload_store
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_STORE_DIR = os.getenv("CONVERSATION_STORE_DIR", os.path.join(os.getcwd(), "conversations"))
+CONVERSATION_STORE_MAX_ITEMS = int(os.getenv("CONVERSATION_STORE_MAX_ITEMS", 256))
+CONVERSATION_TTL_SECONDS = float(os.getenv("CONVERSATION_TTL_SECONDS", 24 * 3600))
+
+_CONVERSATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,128}$")
+
+
+def is_valid_conversation_id(conversation_id: Any) -> bool:
+    return isinstance(conversation_id, str) and _CONVERSATION_ID_PATTERN.match(conversation_id) is not None
+
+
+class Conversation(object):
+    def __init__(self, store: "ConversationStore", conversation_id: str, messages: list[dict[str, Any]]):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.messages = messages
+
+    async def close(self, messages: Optional[list[dict[str, Any]]] = None):
+        # messages=None means the turn failed, keep the previous history untouched
+        try:
+            if messages is not None:
+                await self.store.save(self.conversation_id, messages)
+        finally:
+            self.store.release(self.conversation_id)
+
+
+class ConversationStore(object):
+    # refined histories are kept in a bounded LRU in memory and written through to disk,
+    # so a turn only has to refine the newly received messages
+    def __init__(self, directory: str, max_items: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+
+        self._cache: OrderedDict[str, tuple[float, list[dict[str, Any]]]] = OrderedDict()
+        self._locks: dict[str, asyncio.Lock] = {}
+        # turns holding or waiting for each lock; a lock is dropped once unused and not cached
+        self._lock_users: dict[str, int] = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, f"{conversation_id}.json")
+
+    def _expired(self, updated_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - updated_at > self.ttl_seconds
+
+    def lock(self, conversation_id: str) -> asyncio.Lock:
+        if conversation_id not in self._locks:
+            self._locks[conversation_id] = asyncio.Lock()
+
+        return self._locks[conversation_id]
+
+    def _remember(self, conversation_id: str, updated_at: float, messages: list[dict[str, Any]]):
+        self._cache[conversation_id] = (updated_at, messages)
+        self._cache.move_to_end(conversation_id)
+
+        while len(self._cache) > self.max_items:
+            evicted, _ = self._cache.popitem(last=False)
+            if not self._lock_users.get(evicted):
+                self._locks.pop(evicted, None)
+
+    def _read(self, conversation_id: str) -> Optional[tuple[float, list[dict[str, Any]]]]:
+        path = self._path(conversation_id)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "r") as fp:
+                data = json.load(fp)
+
+            return data["updated_at"], data["messages"]
+        except Exception as err:
+            logger.warning(f"Failed to read conversation {conversation_id!r}: {err}")
+            return None
+
+    def _write(self, conversation_id: str, updated_at: float, messages: list[dict[str, Any]]):
+        path = self._path(conversation_id)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "w") as fp:
+            json.dump({"updated_at": updated_at, "messages": messages}, fp, ensure_ascii=False)
+
+        os.replace(tmp_path, path)
+
+    async def load(self, conversation_id: str) -> list[dict[str, Any]]:
+        entry = self._cache.get(conversation_id)
+
+        if entry is None:
+            entry = await asyncio.to_thread(self._read, conversation_id)
+
+        if entry is None:
+            return []
+
+        updated_at, messages = entry
+
+        if self._expired(updated_at):
+            await self._delete(conversation_id)
+            return []
+
+        self._remember(conversation_id, updated_at, messages)
+        return list(messages)
+
+    async def save(self, conversation_id: str, messages: list[dict[str, Any]]):
+        updated_at = time.time()
+        self._remember(conversation_id, updated_at, messages)
+
+        try:
+            await asyncio.to_thread(self._write, conversation_id, updated_at, messages)
+        except Exception as err:
+            logger.error(f"Failed to persist conversation {conversation_id!r}: {err}")
+
+    async def _acquire(self, conversation_id: str):
+        self._lock_users[conversation_id] = self._lock_users.get(conversation_id, 0) + 1
+
+        try:
+            await self.lock(conversation_id).acquire()
+        except BaseException:
+            self._unuse(conversation_id)
+            raise
+
+    def _unuse(self, conversation_id: str):
+        users = self._lock_users.pop(conversation_id, 0) - 1
+
+        if users > 0:
+            self._lock_users[conversation_id] = users
+        elif conversation_id not in self._cache:
+            # nothing was stored (failed first turn, deleted), the lock is not needed anymore
+            self._locks.pop(conversation_id, None)
+
+    def release(self, conversation_id: str):
+        self._locks[conversation_id].release()
+        self._unuse(conversation_id)
+
+    async def delete(self, conversation_id: str) -> bool:
+        # waits for an in-flight turn, which would otherwise write the conversation back on close
+        await self._acquire(conversation_id)
+
+        try:
+            return await self._delete(conversation_id)
+        finally:
+            self.release(conversation_id)
+
+    async def _delete(self, conversation_id: str) -> bool:
+        await get_upload_store().release_owner(conversation_id)
+        existed = self._cache.pop(conversation_id, None) is not None
+        path = self._path(conversation_id)
+
+        if os.path.exists(path):
+            await asyncio.to_thread(os.remove, path)
+            existed = True
+
+        return existed
+
+    async def open(self, conversation_id: str) -> Conversation:
+        await self._acquire(conversation_id)
+
+        try:
+            messages = await self.load(conversation_id)
+        except BaseException:
+            self.release(conversation_id)
+            raise
+
+        return Conversation(self, conversation_id, messages)
+
+    def ids(self) -> list[str]:
+        return [file[:-len(".json")] for file in os.listdir(self.directory) if file.endswith(".json")]
+
+    def _sweep(self, busy: set[str]) -> list[str]:
+        removed = []
+
+        for file in os.listdir(self.directory):
+            if not file.endswith(".json") or file[:-len(".json")] in busy:
+                continue
+
+            path = os.path.join(self.directory, file)
+
+            try:
+                if self._expired(os.path.getmtime(path)):
+                    os.remove(path)
+                    removed.append(file[:-len(".json")])
+            except FileNotFoundError:
+                pass
+
+        return removed
+
+    async def sweep(self) -> int:
+        for conversation_id, (updated_at, _) in list(self._cache.items()):
+            if self._expired(updated_at):
+                self._cache.pop(conversation_id, None)
+
+        removed = await asyncio.to_thread(self._sweep, set(self._lock_users))
+
+        for conversation_id in removed:
+            await get_upload_store().release_owner(conversation_id)
+
+        return len(removed)
+
+
+_store: Optional[ConversationStore] = None
+
+
+def get_conversation_store() -> ConversationStore:
+    global _store
+
+    if _store is None:
+        _store = ConversationStore(
+            CONVERSATION_STORE_DIR,
+            max_items=CONVERSATION_STORE_MAX_ITEMS,
+            ttl_seconds=CONVERSATION_TTL_SECONDS
+        )
+
+    return _store
@@ -0,0 +1,207 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import re
+import socket
+import time
+from typing import Optional
+import httpx
+from bs4 import BeautifulSoup
+from cachetools import TTLCache
+from markdownify import markdownify
+from pydantic import BaseModel
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 15))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", 2 * 1024 * 1024))
+FETCH_MAX_CHARS = int(os.getenv("FETCH_MAX_CHARS", 40000))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", 32))
+FETCH_CACHE_TTL_SECONDS = float(os.getenv("FETCH_CACHE_TTL_SECONDS", 300))
+FETCH_CACHE_MAX_ITEMS = int(os.getenv("FETCH_CACHE_MAX_ITEMS", 256))
+FETCH_USER_AGENT = os.getenv(
+    "FETCH_USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+# lets the model fetch loopback, private and link-local (cloud metadata) addresses, off by default
+FETCH_ALLOW_PRIVATE_NETWORKS = os.getenv("FETCH_ALLOW_PRIVATE_NETWORKS", "0").lower() in ("1", "true", "yes")
+# below this many characters of text an html page most likely needs javascript to render
+FETCH_MIN_TEXT_CHARS = 200
+
+_TEXT_CONTENT_TYPES = ("text/", "application/json", "application/xml", "application/xhtml+xml", "application/rss+xml")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+class FetchedPage(BaseModel):
+    url: str
+    status: int
+    content_type: str
+    title: Optional[str] = None
+    content: str
+    truncated: bool = False
+    needs_browser: bool = False
+
+    def to_text(self) -> str:
+        text = f"Source: {self.url} (HTTP {self.status})\n"
+
+        if self.title:
+            text = f"# {self.title}\n{text}"
+
+        text += "\n" + self.content
+
+        if self.truncated:
+            text += "\n\n[content truncated]"
+
+        if self.needs_browser:
+            text += "\n\n[this page renders its content with javascript, use xbrowse to read it]"
+
+        return text
+
+
+class FetchError(Exception):
+    pass
+
+
+class BlockedAddressError(FetchError):
+    pass
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+
+    # not global covers loopback, RFC 1918, link-local (169.254.169.254), CGNAT and reserved ranges
+    return ip.is_global and not ip.is_multicast
+
+
+async def _check_destination(request: httpx.Request):
+    # runs for the first request and every redirect hop; the name is resolved again when connecting,
+    # so a DNS answer that changes in between is not caught
+    if FETCH_ALLOW_PRIVATE_NETWORKS:
+        return
+
+    host = request.url.host
+    port = request.url.port or (443 if request.url.scheme == "https" else 80)
+
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError:
+        return  # unresolvable, the connection fails on its own
+
+    blocked = [info[4][0] for info in infos if not is_public_address(info[4][0])]
+
+    if blocked:
+        raise BlockedAddressError(f"Refusing to fetch {request.url}: {host} resolves to a non-public address {blocked[0]}")
+
+
+_client: Optional[httpx.AsyncClient] = None
+_cache: TTLCache = TTLCache(maxsize=FETCH_CACHE_MAX_ITEMS, ttl=FETCH_CACHE_TTL_SECONDS)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=FETCH_TIMEOUT,
+            follow_redirects=True,
+            max_redirects=5,
+            event_hooks={"request": [_check_destination]},
+            limits=httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS, max_keepalive_connections=FETCH_MAX_CONNECTIONS),
+            headers={"User-Agent": FETCH_USER_AGENT, "Accept": "text/html,application/xhtml+xml,text/plain,application/json;q=0.9,*/*;q=0.5"}
+        )
+
+    return _client
+
+
+def html_to_markdown(html: str) -> tuple[Optional[str], str]:
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else None
+
+    for tag in soup(["script", "style", "noscript", "svg", "iframe", "template", "head"]):
+        tag.decompose()
+    body = soup.find("main") or soup.body or soup
+    text = markdownify(str(body), heading_style="ATX", strip=["img"])
+
+    return title, _BLANK_LINES.sub("\n\n", text).strip()
+
+
+async def _read_limited(response: httpx.Response, limit: int) -> tuple[bytes, bool]:
+    data = bytearray()
+
+    async for chunk in response.aiter_bytes():
+        data.extend(chunk)
+
+        if len(data) > limit:
+            return bytes(data[:limit]), True
+
+    return bytes(data), False
+
+
+async def fetch_page(url: str) -> FetchedPage:
+    if not url.startswith(("http://", "https://")):
+        raise FetchError(f"Only http(s) URLs can be fetched, got {url!r}")
+
+    cached = _cache.get(url)
+
+    if cached is not None:
+        metrics.inc("fetch_requests_total", result="cached")
+        return cached
+
+    started = time.time()
+
+    try:
+        async with get_http_client().stream("GET", url) as response:
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+
+            if content_type and not content_type.startswith(_TEXT_CONTENT_TYPES):
+                raise FetchError(f"{url} returned {content_type}, which is not a text document")
+
+            raw, truncated = await _read_limited(response, FETCH_MAX_BYTES)
+            encoding = response.encoding or "utf-8"
+            status, final_url = response.status_code, str(response.url)
+    except BlockedAddressError:
+        metrics.inc("fetch_requests_total", result="blocked")
+        raise
+    except httpx.HTTPError as err:
+        metrics.inc("fetch_requests_total", result="error")
+        raise FetchError(f"Failed to fetch {url}: {err}") from err
+
+    text = raw.decode(encoding, errors="replace")
+    title, needs_browser = None, False
+
+    if content_type in ("", "text/html", "application/xhtml+xml"):
+        title, text = await asyncio.to_thread(html_to_markdown, text)
+        needs_browser = len(text) < FETCH_MIN_TEXT_CHARS
+
+    if len(text) > FETCH_MAX_CHARS:
+        text, truncated = text[:FETCH_MAX_CHARS], True
+
+    page = FetchedPage(
+        url=final_url,
+        status=status,
+        content_type=content_type,
+        title=title,
+        content=text,
+        truncated=truncated,
+        needs_browser=needs_browser
+    )
+
+    if status == 200:
+        _cache[url] = page
+
+    metrics.inc("fetch_requests_total", result="fetched")
+    metrics.observe("fetch_seconds", time.time() - started)
+    return page
+
+
+async def close_http_client():
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 5))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 20))
+# consecutive failed attempts (connection errors / 5xx) that open the circuit, and how long it stays open
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 8))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", 30))
+
+_RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+
+# unix timestamp after which no more retries are started, set per request by prompt()
+llm_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after-ms")
+
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = response.headers.get("retry-after")
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    # full jitter: uniform between 0 and the exponential cap
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker(object):
+    # closed -> open after too many consecutive failures -> half_open after the reset period,
+    # where a single probe request decides between closed and open again
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"LLM circuit {self.name}: {self.state} -> {state}")
+
+        self.state = state
+        metrics.set("llm_circuit_open", int(state == "open"), circuit=self.name)
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.time() - self.opened_at >= LLM_CIRCUIT_RESET_SECONDS:
+            self._set_state("half_open")
+
+        if self.state == "closed":
+            return True
+
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+
+        return False
+
+    def record(self, ok: bool):
+        self._probing = False
+
+        if ok:
+            self.failures = 0
+            self._set_state("closed")
+            return
+
+        self.failures += 1
+
+        if self.state == "half_open" or self.failures >= LLM_CIRCUIT_FAILURE_THRESHOLD:
+            self.opened_at = time.time()
+            self._set_state("open")
+
+    def release(self):
+        # the probe ended without telling whether the server works, let the next request probe
+        self._probing = False
+
+
+# retries transient failures of the wrapped transport with jittered exponential backoff,
+# honoring Retry-After and the request deadline, behind a circuit breaker
+class RetryingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self._transport = transport
+        self.breaker = breaker
+
+    def _give_up(self, attempt: int, delay: float) -> bool:
+        deadline = llm_deadline.get()
+        return attempt >= LLM_RETRY_MAX_ATTEMPTS or (deadline is not None and time.time() + delay >= deadline)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            metrics.inc("llm_circuit_rejections_total", circuit=self.breaker.name)
+            raise CircuitOpenError(f"LLM endpoint {self.breaker.name} is failing, circuit is open")
+
+        await request.aread()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            response, error = None, None
+
+            try:
+                response = await self._transport.handle_async_request(request)
+            except _RETRY_ERRORS as err:
+                error = err
+            except BaseException:
+                self.breaker.release()
+                raise
+
+            if response is not None and response.status_code not in _RETRY_STATUSES:
+                self.breaker.record(response.status_code < 500)
+                return response
+
+            # 408 / 409 / 429 mean the server is alive, only errors and 5xx count against the circuit
+            server_failed = error is not None or response.status_code >= 500
+            reason = type(error).__name__ if error is not None else str(response.status_code)
+
+            if server_failed:
+                self.breaker.record(False)
+
+            delay = backoff_delay(attempt)
+
+            if response is not None:
+                delay = max(delay, retry_after_seconds(response) or 0)
+
+            if self._give_up(attempt, delay) or self.breaker.state == "open":
+                self.breaker.release()
+                metrics.inc("llm_retries_exhausted_total", reason=reason)
+
+                if response is not None:
+                    return response
+
+                raise error
+
+            if response is not None:
+                await response.aclose()
+
+            metrics.inc("llm_retries_total", reason=reason)
+            logger.info(f"LLM call failed ({reason}), retry {attempt}/{LLM_RETRY_MAX_ATTEMPTS - 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+
+    return _breakers[name]
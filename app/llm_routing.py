@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Optional
+import httpx
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "ewma": lowest smoothed latency x (outstanding + 1), "least_outstanding": fewest in-flight requests
+LLM_ROUTING = os.getenv("LLM_ROUTING", "ewma").lower()
+LLM_ENDPOINT_MAX_CONCURRENCY = int(os.getenv("LLM_ENDPOINT_MAX_CONCURRENCY", 16))
+# consecutive failures after which an endpoint is skipped until a health check passes
+LLM_ENDPOINT_MAX_FAILURES = int(os.getenv("LLM_ENDPOINT_MAX_FAILURES", 3))
+LLM_HEALTH_CHECK_INTERVAL = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", 15))
+LLM_HEALTH_CHECK_TIMEOUT = float(os.getenv("LLM_HEALTH_CHECK_TIMEOUT", 5))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 128))
+# weight of the newest latency sample
+LLM_EWMA_ALPHA = 0.2
+
+# statuses meaning this server cannot take the request right now, worth trying another one
+_FAILOVER_STATUSES = {502, 503, 504}
+
+
+class NoEndpointAvailable(Exception):
+    pass
+
+
+def parse_endpoints(value: str) -> list[tuple[str, int]]:
+    # "http://a:8000/v1,http://b:8000/v1|4" -> [(url, max_concurrency), ...]
+    endpoints = []
+
+    for entry in value.split(","):
+        url, _, limit = entry.strip().partition("|")
+
+        if url:
+            endpoints.append((url.rstrip("/"), int(limit) if limit.strip() else LLM_ENDPOINT_MAX_CONCURRENCY))
+
+    return endpoints
+
+
+class LLMEndpoint(object):
+    def __init__(self, url: str, max_concurrency: int = LLM_ENDPOINT_MAX_CONCURRENCY):
+        self.url = httpx.URL(url)
+        self.name = url
+        self.max_concurrency = max(1, max_concurrency)
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.healthy = True
+        self.consecutive_failures = 0
+
+    def score(self) -> tuple:
+        if LLM_ROUTING == "least_outstanding":
+            return (self.outstanding, self.ewma_latency or 0)
+
+        # endpoints without samples yet score 0, so each one gets tried early
+        return ((self.ewma_latency or 0) * (self.outstanding + 1), self.outstanding)
+
+    def observe(self, latency: float):
+        self.ewma_latency = latency if self.ewma_latency is None \
+            else self.ewma_latency + LLM_EWMA_ALPHA * (latency - self.ewma_latency)
+
+        metrics.observe("llm_endpoint_latency_seconds", latency, endpoint=self.name)
+        metrics.set("llm_endpoint_ewma_seconds", self.ewma_latency, endpoint=self.name)
+
+    def mark(self, ok: bool):
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        healthy = ok or self.consecutive_failures < LLM_ENDPOINT_MAX_FAILURES
+
+        if healthy != self.healthy:
+            logger.warning(f"LLM endpoint {self.name} is now {'healthy' if healthy else 'unhealthy'}")
+
+        self.healthy = healthy
+        metrics.set("llm_endpoint_healthy", int(healthy), endpoint=self.name)
+
+
+# endpoints serving the same models; roles configured with the same URLs share one group
+class EndpointGroup(object):
+    def __init__(self, endpoints: list[tuple[str, int]], api_key: Optional[str] = None):
+        self.endpoints = [LLMEndpoint(url, limit) for url, limit in endpoints]
+        self.api_key = api_key
+        self._cond = asyncio.Condition()
+
+        for endpoint in self.endpoints:
+            metrics.set("llm_endpoint_healthy", 1, endpoint=endpoint.name)
+
+    def _candidates(self, exclude: list[LLMEndpoint]) -> Optional[list[LLMEndpoint]]:
+        remaining = [e for e in self.endpoints if e not in exclude]
+
+        if not remaining:
+            return None
+
+        # unhealthy endpoints are only used when nothing healthy is left
+        preferred = [e for e in remaining if e.healthy] or remaining
+        return [e for e in preferred if e.outstanding < e.max_concurrency]
+
+    async def acquire(self, exclude: list[LLMEndpoint]) -> LLMEndpoint:
+        started = time.time()
+
+        async with self._cond:
+            while True:
+                candidates = self._candidates(exclude)
+
+                if candidates is None:
+                    raise NoEndpointAvailable("all LLM endpoints failed")
+
+                if candidates:
+                    endpoint = min(candidates, key=LLMEndpoint.score)
+                    endpoint.outstanding += 1
+                    break
+
+                # every usable endpoint is at its concurrency limit
+                await self._cond.wait()
+
+        metrics.observe("llm_endpoint_queue_seconds", time.time() - started)
+        metrics.set("llm_endpoint_outstanding", endpoint.outstanding, endpoint=endpoint.name)
+        return endpoint
+
+    async def release(self, endpoint: LLMEndpoint):
+        async with self._cond:
+            endpoint.outstanding -= 1
+            self._cond.notify_all()
+
+        metrics.set("llm_endpoint_outstanding", endpoint.outstanding, endpoint=endpoint.name)
+
+    async def check_health(self, client: httpx.AsyncClient):
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+        async def check(endpoint: LLMEndpoint):
+            try:
+                response = await client.get(f"{endpoint.name}/models", headers=headers, timeout=LLM_HEALTH_CHECK_TIMEOUT)
+                endpoint.mark(response.status_code < 500)
+            except httpx.HTTPError:
+                endpoint.consecutive_failures = LLM_ENDPOINT_MAX_FAILURES - 1
+                endpoint.mark(False)
+
+        await asyncio.gather(*[check(e) for e in self.endpoints])
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    # keeps the endpoint slot until the (possibly streamed) body is fully read or closed
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                await self._on_close()
+
+
+# httpx transport for the openai / langchain clients: requests addressed to the first endpoint's
+# base URL are sent to the best endpoint of the group, failing over on connection errors and 502-504
+class LoadBalancingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, group: EndpointGroup, base_url: str):
+        self.group = group
+        self.base_path = httpx.URL(base_url).path.rstrip("/")
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        )
+
+    def _target(self, request: httpx.Request, endpoint: LLMEndpoint, body: bytes) -> httpx.Request:
+        path = request.url.path
+        path = path[len(self.base_path):] if path.startswith(self.base_path) else path
+        url = endpoint.url.copy_with(path=endpoint.url.path.rstrip("/") + path, query=request.url.query or None)
+
+        headers = request.headers.copy()
+        headers["Host"] = url.netloc.decode("ascii")
+
+        return httpx.Request(request.method, url, headers=headers, content=body, extensions=request.extensions)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        tried: list[LLMEndpoint] = []
+        last_error: Optional[Exception] = None
+
+        while True:
+            try:
+                endpoint = await self.group.acquire(exclude=tried)
+            except NoEndpointAvailable:
+                raise last_error
+
+            started = time.time()
+
+            try:
+                response = await self._transport.handle_async_request(self._target(request, endpoint, body))
+            except (httpx.ConnectError, httpx.ConnectTimeout) as err:
+                # nothing reached the server, safe to send it elsewhere
+                await self.group.release(endpoint)
+                endpoint.mark(False)
+                metrics.inc("llm_endpoint_requests_total", endpoint=endpoint.name, status="connect_error")
+                logger.warning(f"LLM endpoint {endpoint.name} unreachable: {err}")
+                tried.append(endpoint)
+                last_error = err
+                continue
+            except BaseException:
+                await self.group.release(endpoint)
+                raise
+
+            if response.status_code in _FAILOVER_STATUSES and len(tried) + 1 < len(self.group.endpoints):
+                await response.aclose()
+                await self.group.release(endpoint)
+                endpoint.mark(False)
+                metrics.inc("llm_endpoint_requests_total", endpoint=endpoint.name, status=str(response.status_code))
+                tried.append(endpoint)
+                continue
+
+            endpoint.observe(time.time() - started)
+            endpoint.mark(response.status_code < 500)
+            metrics.inc("llm_endpoint_requests_total", endpoint=endpoint.name, status=str(response.status_code))
+
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                stream=_ReleasingStream(response.stream, lambda: self.group.release(endpoint)),
+                extensions=response.extensions,
+                request=request
+            )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+_groups: dict[tuple, EndpointGroup] = {}
+
+
+def get_endpoint_group(endpoints: list[tuple[str, int]], api_key: Optional[str] = None) -> EndpointGroup:
+    key = tuple(url for url, _ in endpoints)
+
+    if key not in _groups:
+        _groups[key] = EndpointGroup(endpoints, api_key=api_key)
+
+    return _groups[key]
+
+
+async def check_llm_endpoints():
+    async with httpx.AsyncClient() as client:
+        await asyncio.gather(*[group.check_health(client) for group in _groups.values()])
@@ -0,0 +1,147 @@
+import logging
+import os
+import time
+from typing import Any, Optional
+from uuid import UUID
+import httpx
+import openai
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+from .llm_retry import get_circuit_breaker, RetryingTransport
+from .llm_routing import get_endpoint_group, parse_endpoints, LoadBalancingTransport
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "prompt" drives the outer tool-calling loop, "agent" picks browser actions,
+# "extraction" reads page content and "planner" plans the next steps.
+# Each role reads LLM_MODEL_ID_<ROLE> / LLM_BASE_URL_<ROLE> / LLM_API_KEY_<ROLE>
+# and falls back to the shared LLM_MODEL_ID / LLM_BASE_URL / LLM_API_KEY.
+# LLM_BASE_URLS(_<ROLE>) lists several servers of the same model to balance over.
+LLM_ROLES = ("prompt", "agent", "extraction", "planner")
+
+
+class LLMConfig(BaseModel):
+    role: str
+    model: str
+    base_url: str
+    api_key: str
+    endpoints: list[tuple[str, int]]
+
+
+def _role_env(name: str, role: str, default: str) -> str:
+    return os.getenv(f"{name}_{role.upper()}") or os.getenv(name) or default
+
+
+def get_llm_config(role: str) -> LLMConfig:
+    base_url = _role_env(
+        "LLM_BASE_URL", role, 
+        "http://localmodel:65534/v1" if role == "prompt" else "http://localhost:65534/v1"
+    )
+    endpoints = parse_endpoints(_role_env("LLM_BASE_URLS", role, "")) or parse_endpoints(base_url)
+
+    return LLMConfig(
+        role=role,
+        model=_role_env("LLM_MODEL_ID", role, "local-llm"),
+        base_url=endpoints[0][0],
+        api_key=_role_env("LLM_API_KEY", role, "no-need"),
+        endpoints=endpoints
+    )
+
+
+_http_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def get_http_client(role: str) -> httpx.AsyncClient:
+    # one pooled client per role: retries and circuit breaker on top of routing over the role's endpoints
+    if role not in _http_clients:
+        config = get_llm_config(role)
+
+        _http_clients[role] = openai.DefaultAsyncHttpxClient(
+            transport=RetryingTransport(
+                LoadBalancingTransport(
+                    get_endpoint_group(config.endpoints, api_key=config.api_key), 
+                    config.base_url
+                ),
+                breaker=get_circuit_breaker(",".join(url for url, _ in config.endpoints))
+            )
+        )
+
+    return _http_clients[role]
+
+
+def record_llm_call(role: str, model: str, duration: float, usage: Optional[dict[str, Any]] = None, error: bool = False):
+    metrics.observe("llm_request_seconds", duration, role=role, model=model)
+    metrics.inc("llm_requests_total", role=role, model=model, status="error" if error else "ok")
+
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage and usage.get(kind):
+            metrics.inc("llm_tokens_total", usage[kind], role=role, model=model, kind=kind.split("_")[0])
+
+
+class LLMMetricsCallback(AsyncCallbackHandler):
+    def __init__(self, role: str, model: str):
+        self.role = role
+        self.model = model
+        self._started: dict[UUID, float] = {}
+
+    async def on_chat_model_start(self, serialized: dict[str, Any], messages: list, *, run_id: UUID, **kwargs: Any):
+        self._started[run_id] = time.time()
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        started = self._started.pop(run_id, None)
+
+        if started is not None:
+            usage = (response.llm_output or {}).get("token_usage")
+            record_llm_call(self.role, self.model, time.time() - started, usage)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        started = self._started.pop(run_id, None)
+
+        if started is not None:
+            record_llm_call(self.role, self.model, time.time() - started, error=True)
+
+
+def get_chat_model(role: str) -> ChatOpenAI:
+    config = get_llm_config(role)
+
+    return ChatOpenAI(
+        model=config.model,
+        openai_api_base=config.base_url,
+        openai_api_key=config.api_key,
+        http_async_client=get_http_client(role),
+        max_retries=0,  # retries happen in the transport, within the request deadline
+        callbacks=[LLMMetricsCallback(role, config.model)]
+    )
+
+
+def get_openai_client(role: str) -> openai.AsyncClient:
+    config = get_llm_config(role)
+
+    return openai.AsyncClient(
+        base_url=config.base_url,
+        api_key=config.api_key,
+        http_client=get_http_client(role),
+        max_retries=0
+    )
+
+
+async def create_chat_completion(client: openai.AsyncClient, role: str, **kwargs):
+    # chat.completions.create with per-role latency / token metrics
+    model = kwargs.setdefault("model", get_llm_config(role).model)
+    started = time.time()
+
+    try:
+        completion = await client.chat.completions.create(**kwargs)
+    except Exception:
+        record_llm_call(role, model, time.time() - started, error=True)
+        raise
+
+    record_llm_call(
+        role, model, time.time() - started,
+        completion.usage.model_dump() if completion.usage else None
+    )
+
+    return completion
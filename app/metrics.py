@@ -0,0 +1,81 @@
+import threading
+from typing import Optional
+
+
+def _labels_key(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple[tuple[str, str], ...]) -> str:
+    if not key:
+        return ""
+
+    escaped = (v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+class Metrics(object):
+    # tiny in-process registry: counters, gauges and summaries (count/sum/max),
+    # rendered in the prometheus text format by GET /metrics
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, dict[tuple, float]] = {}
+        self._summaries: dict[str, dict[tuple, list[float]]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels_key(labels)
+
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels_key(labels)
+
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            count, total, maximum = series.get(key, [0, 0.0, value])
+            series[key] = [count + 1, total + value, max(maximum, value)]
+
+    def get(self, name: str, **labels) -> Optional[float]:
+        key = _labels_key(labels)
+
+        with self._lock:
+            for family in (self._counters, self._gauges):
+                if name in family and key in family[name]:
+                    return family[name][key]
+
+        return None
+
+    def render(self) -> str:
+        lines = []
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{_format_labels(k)} {v}" for k, v in series.items())
+
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(f"{name}{_format_labels(k)} {v}" for k, v in series.items())
+
+            for name, series in sorted(self._summaries.items()):
+                lines.append(f"# TYPE {name} summary")
+
+                for k, (count, total, _) in series.items():
+                    lines.append(f"{name}_count{_format_labels(k)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(k)} {total}")
+
+                # a summary only has _count, _sum and quantiles, the max is a family of its own
+                lines.append(f"# TYPE {name}_max gauge")
+                lines.extend(f"{name}_max{_format_labels(k)} {maximum}" for k, (_, _, maximum) in series.items())
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,189 @@
+import logging
+import os
+from typing import Any, Optional
+from urllib.parse import urlsplit
+from pydantic import BaseModel, ValidationError, field_validator
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_list(name: str, default: str) -> set[str]:
+    return {e.strip().lower() for e in os.getenv(name, default).split(",") if e.strip()}
+
+
+# any playwright route makes Chromium intercept every request and turns its HTTP cache off,
+# so by default the default rules are off and only a task that asks for blocking installs the route
+NETWORK_BLOCKING = os.getenv("NETWORK_BLOCKING", "0").lower() in ("1", "true", "yes")
+# playwright resource types: document, stylesheet, image, media, font, script, texttrack,
+# xhr, fetch, eventsource, websocket, manifest, other
+NETWORK_BLOCK_RESOURCE_TYPES = _env_list("NETWORK_BLOCK_RESOURCE_TYPES", "media,font")
+NETWORK_BLOCK_DOMAINS = _env_list(
+    "NETWORK_BLOCK_DOMAINS",
+    "doubleclick.net,googlesyndication.com,googleadservices.com,google-analytics.com,"
+    "googletagmanager.com,adservice.google.com,amazon-adsystem.com,adnxs.com,criteo.com,"
+    "taboola.com,outbrain.com,scorecardresearch.com,hotjar.com,facebook.net,ads-twitter.com"
+)
+# optional file with one domain per line, added to NETWORK_BLOCK_DOMAINS
+NETWORK_BLOCK_DOMAINS_FILE = os.getenv("NETWORK_BLOCK_DOMAINS_FILE")
+# block images for tasks whose models never look at screenshots
+NETWORK_BLOCK_IMAGES_WITHOUT_VISION = os.getenv("NETWORK_BLOCK_IMAGES_WITHOUT_VISION", "1").lower() in ("1", "true", "yes")
+
+
+def _load_domains_file(path: Optional[str]) -> set[str]:
+    if not path:
+        return set()
+
+    try:
+        with open(path) as fp:
+            return {
+                line.strip().lower() for line in fp 
+                if line.strip() and not line.startswith("#")
+            }
+    except OSError as err:
+        logger.warning(f"Failed to read {path}: {err}")
+        return set()
+
+
+def _host_suffixes(url: str) -> list[str]:
+    labels = (urlsplit(url).hostname or "").split(".")
+    return [".".join(labels[i:]) for i in range(len(labels) - 1)]
+
+
+class NetworkPolicy(BaseModel):
+    block_resource_types: set[str] = set()
+    block_domains: set[str] = set()
+    allow_domains: set[str] = set()
+    block_images: bool = False
+
+    @field_validator("block_resource_types", "block_domains", "allow_domains")
+    @classmethod
+    def _lowercase(cls, value: set[str]) -> set[str]:
+        return {v.lower() for v in value}
+
+    @classmethod
+    def default(cls) -> "NetworkPolicy":
+        if not NETWORK_BLOCKING:
+            return cls()
+
+        return cls(
+            block_resource_types=NETWORK_BLOCK_RESOURCE_TYPES,
+            block_domains=NETWORK_BLOCK_DOMAINS | _load_domains_file(NETWORK_BLOCK_DOMAINS_FILE)
+        )
+
+    def with_overrides(self, overrides: Optional[dict]) -> "NetworkPolicy":
+        # overrides replace the matching fields, e.g. {"block_resource_types": [], "allow_domains": ["example.com"]};
+        # raises ValidationError for a value of the wrong type
+        merged = self.model_dump()
+
+        for key, value in (overrides or {}).items():
+            if key not in NetworkPolicy.model_fields:
+                logger.warning(f"Ignoring unknown network override {key!r}")
+                continue
+
+            merged[key] = value
+
+        return NetworkPolicy.model_validate(merged)
+
+    def is_active(self) -> bool:
+        return bool(self.block_resource_types or self.block_domains or self.block_images)
+
+    def block_reason(self, url: str, resource_type: str) -> Optional[str]:
+        if resource_type == "document":
+            # never break the navigation itself
+            return None
+
+        suffixes = _host_suffixes(url)
+
+        if any(s in self.allow_domains for s in suffixes):
+            return None
+
+        if any(s in self.block_domains for s in suffixes):
+            return "domain"
+
+        if resource_type in self.block_resource_types or (self.block_images and resource_type == "image"):
+            return "resource_type"
+
+        return None
+
+
+def parse_network_overrides(value: Any) -> Optional[dict]:
+    # checked when the request comes in, the policy itself is only built once a session is leased
+    if value is None:
+        return None
+
+    if not isinstance(value, dict):
+        raise ValueError("network must be an object")
+
+    try:
+        NetworkPolicy().with_overrides(value)
+    except ValidationError as err:
+        error = err.errors()[0]
+        raise ValueError(f"network.{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}") from None
+
+    return value
+
+
+# request interception on the playwright context; one instance is shared by a session and its agent copies.
+# The route is only registered while the policy blocks anything, see NETWORK_BLOCKING
+class NetworkBlocker(object):
+    def __init__(self, policy: Optional[NetworkPolicy] = None):
+        self.policy = policy or NetworkPolicy.default()
+        self._watched: set[int] = set()
+        self._routed: dict[int, Any] = {}
+
+    async def install(self, browser_context):
+        if browser_context is None:
+            return
+
+        if id(browser_context) not in self._watched:
+            # listening does not intercept anything, the cache stays on
+            browser_context.on("requestfinished", self._on_request_finished)
+            self._watched.add(id(browser_context))
+
+        await self.update(browser_context)
+
+    async def update(self, browser_context):
+        # (un)registers the route after the policy changed
+        if browser_context is None:
+            return
+
+        routed = id(browser_context) in self._routed
+
+        if self.policy.is_active() and not routed:
+            await browser_context.route("**/*", self.handle)
+            self._routed[id(browser_context)] = browser_context
+        elif not self.policy.is_active() and routed:
+            del self._routed[id(browser_context)]
+
+            try:
+                await browser_context.unroute("**/*", self.handle)
+            except Exception as err:
+                logger.debug(f"Failed to remove the blocking route: {err}")
+
+    async def handle(self, route):
+        request = route.request
+        reason = self.policy.block_reason(request.url, request.resource_type) if self.policy.is_active() else None
+
+        if reason is None:
+            await route.fallback()
+            return
+
+        metrics.inc("network_requests_blocked_total", reason=reason, resource_type=request.resource_type)
+
+        try:
+            await route.abort("blockedbyclient")
+        except Exception as err:
+            logger.debug(f"Failed to abort {request.url}: {err}")
+
+    async def _on_request_finished(self, request):
+        # the encoded body size as transferred, also for chunked or compressed responses without Content-Length
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            return
+
+        metrics.inc("network_responses_total", resource_type=request.resource_type)
+
+        if sizes.get("responseBodySize", 0) > 0:
+            metrics.inc("network_response_bytes_total", sizes["responseBodySize"], resource_type=request.resource_type)
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# hard cap for any page-load wait, and the cap used for domains without history
+PAGE_LOAD_MAX_WAIT = float(os.getenv("PAGE_LOAD_MAX_WAIT", 8))
+PAGE_LOAD_DEFAULT_WAIT = float(os.getenv("PAGE_LOAD_DEFAULT_WAIT", 5))
+PAGE_LOAD_MIN_WAIT = float(os.getenv("PAGE_LOAD_MIN_WAIT", 1))
+# the cap for a known domain is its estimated settle time times this factor
+PAGE_LOAD_ESTIMATE_FACTOR = float(os.getenv("PAGE_LOAD_ESTIMATE_FACTOR", 1.5))
+# the DOM counts as settled after this long without node / text mutations
+PAGE_LOAD_DOM_QUIET = float(os.getenv("PAGE_LOAD_DOM_QUIET", 0.3))
+PAGE_LOAD_STATS_FILE = os.getenv("PAGE_LOAD_STATS_FILE", "/storage/page-load-times.json")
+PAGE_LOAD_STATS_MAX_DOMAINS = int(os.getenv("PAGE_LOAD_STATS_MAX_DOMAINS", 5000))
+# weight of the newest sample in the per-domain moving average
+PAGE_LOAD_EWMA_ALPHA = 0.3
+
+_DOM_QUIET_JS = """
+([quietMs, timeoutMs]) => new Promise((resolve) => {
+    const start = performance.now();
+    let last = start;
+    const observer = new MutationObserver(() => { last = performance.now(); });
+    observer.observe(document, {subtree: true, childList: true, characterData: true});
+
+    const tick = () => {
+        const now = performance.now();
+
+        if (now - last >= quietMs || now - start >= timeoutMs) {
+            observer.disconnect();
+            resolve((now - start) / 1000);
+        } else {
+            setTimeout(tick, 50);
+        }
+    };
+
+    setTimeout(tick, 50);
+})
+"""
+
+
+def page_domain(url: str) -> Optional[str]:
+    host = urlsplit(url or "").hostname
+    return host.lower() if host else None
+
+
+async def wait_for_dom_quiet(page, quiet: float, timeout: float) -> Optional[float]:
+    # seconds until the DOM stopped changing, None when the page could not be probed (e.g. it navigated away)
+    try:
+        return await page.evaluate(_DOM_QUIET_JS, [quiet * 1000, timeout * 1000])
+    except Exception as err:
+        logger.debug(f"DOM quiet probe failed: {err}")
+        return None
+
+
+# per-domain moving average of how long pages take to settle, persisted as a small JSON table
+class PageLoadStats(object):
+    def __init__(self, path: Optional[str], max_domains: int = PAGE_LOAD_STATS_MAX_DOMAINS):
+        self.path = path
+        self.max_domains = max_domains
+        self._table: dict[str, list[float]] = {}  # domain -> [estimate, samples, updated_at]
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as fp:
+                self._table = {
+                    k: [float(e) for e in v] for k, v in json.load(fp).items()
+                    if isinstance(v, list) and len(v) == 3
+                }
+        except Exception as err:
+            logger.warning(f"Failed to load page load stats from {self.path}: {err}")
+
+    def estimate(self, domain: Optional[str]) -> Optional[float]:
+        entry = self._table.get(domain) if domain else None
+        return entry[0] if entry else None
+
+    def cap_for(self, domain: Optional[str]) -> float:
+        estimate = self.estimate(domain)
+
+        if estimate is None:
+            return min(PAGE_LOAD_DEFAULT_WAIT, PAGE_LOAD_MAX_WAIT)
+
+        return min(max(estimate * PAGE_LOAD_ESTIMATE_FACTOR, PAGE_LOAD_MIN_WAIT), PAGE_LOAD_MAX_WAIT)
+
+    def observe(self, domain: Optional[str], seconds: float):
+        if not domain:
+            return
+
+        estimate, samples, _ = self._table.get(domain, [seconds, 0, 0])
+        self._table[domain] = [
+            estimate + PAGE_LOAD_EWMA_ALPHA * (seconds - estimate) if samples else seconds,
+            samples + 1,
+            time.time()
+        ]
+        self._dirty = True
+
+        if len(self._table) > self.max_domains:
+            for stale in sorted(self._table, key=lambda k: self._table[k][2])[:len(self._table) - self.max_domains]:
+                del self._table[stale]
+
+    def _write(self, data: str):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+
+        with open(tmp_path, "w") as fp:
+            fp.write(data)
+
+        os.replace(tmp_path, self.path)
+
+    async def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        self._dirty = False
+        await asyncio.to_thread(self._write, json.dumps(self._table))
+
+
+_stats: Optional[PageLoadStats] = None
+
+
+def get_page_load_stats() -> PageLoadStats:
+    global _stats
+
+    if _stats is None:
+        _stats = PageLoadStats(PAGE_LOAD_STATS_FILE)
+
+    return _stats
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Iterator
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# durable copy of the profile, on persistent (often network) storage
+BROWSER_PROFILE_DIR = os.getenv("BROWSER_PROFILE_DIR", "/storage/browser-profiles")
+# where Chromium actually runs from: tmpfs or local disk. Same as BROWSER_PROFILE_DIR turns syncing off
+BROWSER_LIVE_PROFILE_DIR = os.getenv("BROWSER_LIVE_PROFILE_DIR", "/tmp/browser-profile")
+PROFILE_SYNC_INTERVAL = float(os.getenv("PROFILE_SYNC_INTERVAL", 300))
+# the parts worth keeping across restarts (logins, site storage); caches and history are not
+PROFILE_SYNC_PATHS = [
+    e.strip() for e in os.getenv(
+        "PROFILE_SYNC_PATHS",
+        "Default/Cookies,Default/Network/Cookies,Default/Local Storage,Default/Preferences"
+    ).split(",") if e.strip()
+]
+
+
+def _files(root: str, rel: str) -> Iterator[str]:
+    path = os.path.join(root, rel)
+
+    if os.path.isfile(path):
+        yield rel
+        return
+
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            yield os.path.relpath(os.path.join(dirpath, filename), root)
+
+
+def _unchanged(src: os.stat_result, dst: os.stat_result) -> bool:
+    return src.st_size == dst.st_size and int(src.st_mtime) == int(dst.st_mtime)
+
+
+_SQLITE_HEADER = b"SQLite format 3\x00"
+# rollback journals / WAL files of a live database, a backed up copy must not come with them
+_SQLITE_SIDE_FILES = ("-journal", "-wal", "-shm")
+
+
+def _is_sqlite(path: str) -> bool:
+    try:
+        with open(path, "rb") as fp:
+            return fp.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def _in_leveldb(root: str, name: str) -> bool:
+    # leveldb keeps CURRENT next to its MANIFEST and table files
+    return os.path.isfile(os.path.join(root, os.path.dirname(name), "CURRENT"))
+
+
+def _backup_sqlite(src: str, dst: str):
+    # a consistent copy even while Chromium writes to the database, unlike copying the file.
+    # Not read-only: a journal left by a crash has to be rolled back before the database can be read
+    source = sqlite3.connect(f"file:{src}?mode=rw", uri=True, timeout=1)
+
+    try:
+        target = sqlite3.connect(dst)
+
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+class ProfileSync(object):
+    def __init__(self, live_dir: str, snapshot_dir: str, paths: list[str]):
+        self.live_dir = live_dir
+        self.snapshot_dir = snapshot_dir
+        self.paths = paths
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return os.path.abspath(self.live_dir) != os.path.abspath(self.snapshot_dir)
+
+    def _copy_changed(self, src_root: str, dst_root: str, final: bool = True) -> tuple[int, int]:
+        # copies files that differ in size / mtime and drops the ones gone from the source.
+        # SQLite databases go through the backup API; leveldb directories change as a whole
+        # while the browser runs, so unless `final` (the browser is closed) they are left alone
+        copied, copied_bytes = 0, 0
+
+        for rel in self.paths:
+            present = set()
+
+            for name in _files(src_root, rel):
+                if name.endswith(_SQLITE_SIDE_FILES):
+                    continue
+
+                present.add(name)
+                src, dst = os.path.join(src_root, name), os.path.join(dst_root, name)
+
+                if not final and _in_leveldb(src_root, name):
+                    continue
+
+                try:
+                    src_stat = os.stat(src)
+
+                    if os.path.exists(dst) and _unchanged(src_stat, os.stat(dst)):
+                        continue
+
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+                    if _is_sqlite(src):
+                        if os.path.exists(dst + ".tmp"):
+                            os.remove(dst + ".tmp")
+
+                        _backup_sqlite(src, dst + ".tmp")
+                        shutil.copystat(src, dst + ".tmp")
+                    else:
+                        shutil.copy2(src, dst + ".tmp")
+
+                    os.replace(dst + ".tmp", dst)
+                except FileNotFoundError:
+                    # Chromium removed it while we were walking (e.g. a compacted leveldb file)
+                    continue
+                except sqlite3.Error as err:
+                    # e.g. locked exclusively by Chromium; the previous copy stays until the next sync
+                    logger.info(f"Skipped {name} in this profile sync: {err}")
+
+                    if os.path.exists(dst + ".tmp"):
+                        os.remove(dst + ".tmp")
+
+                    continue
+
+                copied += 1
+                copied_bytes += src_stat.st_size
+
+            for name in set(_files(dst_root, rel)) - present:
+                if not final and _in_leveldb(dst_root, name):
+                    continue
+
+                try:
+                    os.remove(os.path.join(dst_root, name))
+                except FileNotFoundError:
+                    pass
+
+        return copied, copied_bytes
+
+    def restore(self):
+        if not self.enabled:
+            return
+
+        os.makedirs(self.live_dir, exist_ok=True)
+
+        # a live profile left by a previous process in this container is newer than the snapshot
+        if os.path.isdir(os.path.join(self.live_dir, "Default")):
+            logger.info(f"Reusing live browser profile {self.live_dir}")
+            return
+
+        started = time.time()
+        copied, copied_bytes = self._copy_changed(self.snapshot_dir, self.live_dir)
+        logger.info(f"Restored {copied} profile files ({copied_bytes} bytes) into {self.live_dir} in {time.time() - started:.2f}s")
+
+    async def sync(self, final: bool = False):
+        # `final` once the browser has closed: only then are its leveldb directories consistent on disk.
+        # Without a live profile (the browser never started) there is nothing to sync, and deleting is wrong
+        if not self.enabled or not os.path.isdir(os.path.join(self.live_dir, "Default")):
+            return
+
+        async with self._lock:
+            started = time.time()
+
+            try:
+                copied, copied_bytes = await asyncio.to_thread(self._copy_changed, self.live_dir, self.snapshot_dir, final)
+            except Exception as err:
+                logger.warning(f"Failed to sync browser profile to {self.snapshot_dir}: {err}")
+                metrics.inc("profile_sync_total", status="error")
+                return
+
+            metrics.inc("profile_sync_total", status="ok")
+            metrics.inc("profile_sync_files_total", copied)
+            metrics.inc("profile_sync_bytes_total", copied_bytes)
+            metrics.observe("profile_sync_seconds", time.time() - started)
+
+_sync = None
+
+
+def get_profile_sync() -> ProfileSync:
+    global _sync
+
+    if _sync is None:
+        _sync = ProfileSync(BROWSER_LIVE_PROFILE_DIR, BROWSER_PROFILE_DIR, PROFILE_SYNC_PATHS)
+
+    return _sync
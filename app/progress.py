@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+from typing import Any, AsyncGenerator, Optional
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_QUEUE_SIZE = int(os.getenv("PROGRESS_QUEUE_SIZE", 64))
+# how long a publisher waits for a slow reader before the event is dropped
+PROGRESS_PUT_TIMEOUT = float(os.getenv("PROGRESS_PUT_TIMEOUT", 2))
+PROGRESS_THUMBNAILS = os.getenv("PROGRESS_THUMBNAILS", "0").lower() in ("1", "true", "yes")
+PROGRESS_THUMBNAIL_MAX_EDGE = int(os.getenv("PROGRESS_THUMBNAIL_MAX_EDGE", 320))
+
+
+class StepEvent(BaseModel):
+    type: str = "agent_step"
+    phase: str  # "started" | "completed"
+    step: int
+    max_steps: Optional[int] = None
+    actions: list[dict[str, Any]] = []
+    url: Optional[str] = None
+    duration: Optional[float] = None
+    errors: list[str] = []
+    page_wait: Optional[float] = None  # seconds spent waiting for pages to settle
+    thumbnail: Optional[str] = None  # base64 jpeg
+
+    def to_markdown(self) -> str:
+        if self.phase == "started":
+            return f"**Step {self.step}**: thinking...\n"
+
+        actions = ", ".join(
+            name + "(" + ", ".join(f"{k}={v!r}" for k, v in (params or {}).items()) + ")"
+            for action in self.actions
+            for name, params in action.items()
+        ) or "no action"
+
+        text = f"**Step {self.step}**: {actions}"
+
+        if self.url:
+            text += f" at {self.url}"
+
+        if self.duration is not None:
+            text += f" ({self.duration:.1f}s)"
+
+        for error in self.errors:
+            text += f"\n> {error.strip().splitlines()[0] if error.strip() else error}"
+
+        if self.thumbnail:
+            text += f"\n\n![step {self.step}](data:image/jpeg;base64,{self.thumbnail})"
+
+        return text + "\n"
+
+
+class ProgressChannel(object):
+    # bounded queue between the agent callbacks and the /prompt SSE stream
+    def __init__(self, maxsize: int = PROGRESS_QUEUE_SIZE, put_timeout: float = PROGRESS_PUT_TIMEOUT):
+        self.queue: asyncio.Queue[StepEvent] = asyncio.Queue(maxsize=maxsize)
+        self.put_timeout = put_timeout
+        self.dropped = 0
+
+    async def publish(self, event: StepEvent):
+        try:
+            await asyncio.wait_for(self.queue.put(event), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            logger.warning(f"Progress reader is too slow, dropped step event ({self.dropped} so far)")
+
+    async def iterate_until(self, task: asyncio.Future) -> AsyncGenerator[StepEvent, None]:
+        # yields events while `task` runs, then flushes what is left
+        while not task.done():
+            getter = asyncio.ensure_future(self.queue.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+
+            if getter in done:
+                yield getter.result()
+            else:
+                getter.cancel()
+
+        while not self.queue.empty():
+            yield self.queue.get_nowait()
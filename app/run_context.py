@@ -0,0 +1,47 @@
+import time
+from typing import Optional
+from pydantic import BaseModel, ConfigDict
+from .budget import RequestBudget
+from .progress import ProgressChannel
+from .screenshot_spool import ScreenshotSpool
+from .vision import PageProbe
+
+
+# per browse() run state, handed to the Agent as `context` so the step callbacks can reach it
+class AgentRunContext(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    task: str
+    max_steps: int
+    budget: RequestBudget
+    progress: Optional[ProgressChannel] = None
+    step_started_at: float = 0
+    step_durations: list[float] = []
+    # set once the agent has been told to wrap up, with the reason why
+    finalize_reason: Optional[str] = None
+    # whether the agent's models accept images at all, captured before the vision policy changes it
+    vision_supported: Optional[bool] = None
+    vision_for_planner_supported: Optional[bool] = None
+    page_probe: Optional[PageProbe] = None
+    # set while the run is checkpointed after each step, see app/checkpoints.py
+    checkpoint_key: Optional[str] = None
+    # input tokens already spent by the interrupted run this one resumed
+    resumed_tokens: int = 0
+    resumed_steps: int = 0
+    # where the history screenshots go instead of staying in memory
+    screenshot_spool: Optional[ScreenshotSpool] = None
+
+    def mark_step_start(self):
+        self.step_started_at = time.time()
+
+    def mark_step_end(self) -> Optional[float]:
+        if not self.step_started_at:
+            return None
+
+        duration = time.time() - self.step_started_at
+        self.step_durations.append(duration)
+        return duration
+
+    def expected_step_seconds(self) -> float:
+        recent = self.step_durations[-5:]
+        return sum(recent) / len(recent) if recent else 0
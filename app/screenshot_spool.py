@@ -0,0 +1,83 @@
+import asyncio
+import base64
+import logging
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCREENSHOT_SPOOL_ENABLED = os.getenv("SCREENSHOT_SPOOL_ENABLED", "1").lower() in ("1", "true", "yes")
+# local disk on purpose, the spool only lives as long as a browse() run
+SCREENSHOT_SPOOL_DIR = os.getenv("SCREENSHOT_SPOOL_DIR", "/tmp/agent-screenshots")
+# per run; the oldest screenshots are dropped beyond it
+SCREENSHOT_SPOOL_MAX_BYTES = int(os.getenv("SCREENSHOT_SPOOL_MAX_BYTES", 64 * 1024 * 1024))
+
+SPOOL_REF_PREFIX = "spool://"
+
+
+def is_spool_ref(screenshot: Optional[str]) -> bool:
+    return screenshot is not None and screenshot.startswith(SPOOL_REF_PREFIX)
+
+
+class ScreenshotSpool(object):
+    # keeps a run's history screenshots as files, the history itself only holds spool:// references;
+    # write-only, nothing in the run reads a past frame back
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._files: OrderedDict[str, int] = OrderedDict()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write(self, name: str, data: bytes):
+        with open(self._path(name), "wb") as fp:
+            fp.write(data)
+
+    def _unlink(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    async def spill(self, step: int, screenshot: str) -> str:
+        data = base64.b64decode(screenshot)
+        name = f"{step:04d}-{uuid.uuid4().hex[:8]}"
+
+        await asyncio.to_thread(self._write, name, data)
+
+        self._files[name] = len(data)
+        self.bytes += len(data)
+        metrics.inc("screenshot_spool_bytes_total", len(data))
+
+        while self.bytes > self.max_bytes and len(self._files) > 1:
+            evicted, size = self._files.popitem(last=False)
+            self.bytes -= size
+            await asyncio.to_thread(self._unlink, evicted)
+            metrics.inc("screenshot_spool_evictions_total")
+
+        return SPOOL_REF_PREFIX + name
+
+    async def close(self):
+        self._files.clear()
+        self.bytes = 0
+        await asyncio.to_thread(shutil.rmtree, self.directory, True)
+
+
+def create_screenshot_spool() -> ScreenshotSpool:
+    return ScreenshotSpool(
+        os.path.join(SCREENSHOT_SPOOL_DIR, uuid.uuid4().hex), 
+        max_bytes=SCREENSHOT_SPOOL_MAX_BYTES
+    )
+
+
+def clear_screenshot_spools():
+    # whatever is left at startup belongs to runs of a previous process
+    shutil.rmtree(SCREENSHOT_SPOOL_DIR, ignore_errors=True)
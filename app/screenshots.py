@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+from typing import Optional, Union
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# screenshots sent to the agent's LLM: longest edge, encoding and quality
+SCREENSHOT_MAX_EDGE = int(os.getenv("SCREENSHOT_MAX_EDGE", 1024))
+SCREENSHOT_FORMAT = os.getenv("SCREENSHOT_FORMAT", "jpeg").lower()
+SCREENSHOT_QUALITY = int(os.getenv("SCREENSHOT_QUALITY", 70))
+# replace a frame identical to the previously sent one with a "no visual change" note
+SCREENSHOT_DEDUP = os.getenv("SCREENSHOT_DEDUP", "1").lower() in ("1", "true", "yes")
+# crop to the part of the viewport that has content, e.g. drops the empty margins of a centered layout
+SCREENSHOT_CROP = os.getenv("SCREENSHOT_CROP", "1").lower() in ("1", "true", "yes")
+# padding around the content box, in CSS pixels
+SCREENSHOT_CROP_PADDING = int(os.getenv("SCREENSHOT_CROP_PADDING", 16))
+# compare frames by a perceptual hash instead of their exact bytes; also matches near-identical frames,
+# so a small text change can go unseen
+SCREENSHOT_DEDUP_PERCEPTUAL = os.getenv("SCREENSHOT_DEDUP_PERCEPTUAL", "0").lower() in ("1", "true", "yes")
+# how many bits of the perceptual hash may differ for two frames to count as identical
+SCREENSHOT_DEDUP_DISTANCE = int(os.getenv("SCREENSHOT_DEDUP_DISTANCE", 0))
+# side of the grayscale grid the perceptual hash is computed on
+SCREENSHOT_HASH_SIZE = 16
+# a crop smaller than this share of the viewport area is not worth a different frame size
+_CROP_MIN_SAVING = 0.1
+
+# the bounding box of the visible text, media and form elements, in viewport coordinates
+_CONTENT_BOX_SCRIPT = """
+() => {
+    const width = innerWidth, height = innerHeight;
+    const media = new Set(["IMG", "SVG", "VIDEO", "CANVAS", "IFRAME", "INPUT", "BUTTON", "SELECT", "TEXTAREA"]);
+    const root = document.body || document.documentElement;
+    const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT);
+    let left = width, top = height, right = 0, bottom = 0;
+
+    for (let el = walker.currentNode, n = 0; el && n < 5000; el = walker.nextNode(), n++) {
+        const leaf = media.has(el.tagName.toUpperCase())
+            || Array.from(el.childNodes).some(c => c.nodeType === 3 && c.textContent.trim());
+
+        if (!leaf) continue;
+
+        const r = el.getBoundingClientRect();
+
+        if (r.width === 0 || r.height === 0 || r.right <= 0 || r.bottom <= 0 || r.left >= width || r.top >= height) continue;
+
+        left = Math.min(left, r.left);
+        top = Math.min(top, r.top);
+        right = Math.max(right, r.right);
+        bottom = Math.max(bottom, r.bottom);
+    }
+
+    return {
+        x: scrollX, y: scrollY, width: width, height: height,
+        content: right > left && bottom > top ? {left: Math.max(0, left), top: Math.max(0, top), right: Math.min(width, right), bottom: Math.min(height, bottom)} : null
+    };
+}
+"""
+
+
+def crop_region(viewport: dict, padding: int = SCREENSHOT_CROP_PADDING) -> dict:
+    # the clip for Page.captureScreenshot: the padded content box in page coordinates, or the whole viewport
+    box = viewport.get("content")
+    full = {"x": viewport["x"], "y": viewport["y"], "width": viewport["width"], "height": viewport["height"]}
+
+    if not box:
+        return full
+
+    left = max(0, box["left"] - padding)
+    top = max(0, box["top"] - padding)
+    right = min(viewport["width"], box["right"] + padding)
+    bottom = min(viewport["height"], box["bottom"] + padding)
+
+    if (right - left) * (bottom - top) > (1 - _CROP_MIN_SAVING) * viewport["width"] * viewport["height"]:
+        return full
+
+    return {"x": viewport["x"] + left, "y": viewport["y"] + top, "width": right - left, "height": bottom - top}
+
+
+async def capture_screenshot(
+    page, 
+    max_edge: Optional[int] = None, 
+    image_format: str = "jpeg", 
+    quality: int = 60,
+    crop: bool = False
+) -> Optional[str]:
+    # CDP can scale and encode in the browser, so no full-size PNG ever reaches python
+    try:
+        if crop:
+            clip = crop_region(await page.evaluate(_CONTENT_BOX_SCRIPT))
+        else:
+            clip = await page.evaluate("({x: scrollX, y: scrollY, width: innerWidth, height: innerHeight})")
+
+        scale = min(1.0, max_edge / max(clip["width"], clip["height"], 1)) if max_edge else 1.0
+
+        params = {
+            "format": image_format,
+            "clip": {**clip, "scale": scale},
+        }
+
+        if image_format in ("jpeg", "webp"):
+            params["quality"] = quality
+
+        session = await page.context.new_cdp_session(page)
+
+        try:
+            response = await session.send("Page.captureScreenshot", params)
+        finally:
+            await session.detach()
+
+        return response["data"]
+    except Exception as err:
+        logger.warning(f"Failed to capture screenshot: {err}")
+        return None
+
+
+def screenshot_hash(data: str) -> Union[int, str]:
+    # exact digest of the encoded frame, or a difference hash when perceptual dedup is on and Pillow is around
+    raw = base64.b64decode(data)
+
+    if not SCREENSHOT_DEDUP_PERCEPTUAL or Image is None:
+        return hashlib.sha1(raw).hexdigest()
+
+    with Image.open(io.BytesIO(raw)) as img:
+        grid = img.convert("L").resize((SCREENSHOT_HASH_SIZE + 1, SCREENSHOT_HASH_SIZE), Image.Resampling.BILINEAR)
+        pixels = list(grid.getdata())
+
+    bits = 0
+    width = SCREENSHOT_HASH_SIZE + 1
+
+    for row in range(SCREENSHOT_HASH_SIZE):
+        for col in range(SCREENSHOT_HASH_SIZE):
+            bits = (bits << 1) | (pixels[row * width + col] > pixels[row * width + col + 1])
+
+    return bits
+
+
+def same_frame(a: Union[int, str, None], b: Union[int, str, None]) -> bool:
+    if a is None or b is None:
+        return False
+
+    if isinstance(a, int) and isinstance(b, int):
+        return bin(a ^ b).count("1") <= SCREENSHOT_DEDUP_DISTANCE
+
+    return a == b
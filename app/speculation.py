@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+from urllib.parse import urlparse
+from .browser import AgentBrowserSession
+from .browser_pool import get_browser_pool
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_NAVIGATION = os.getenv("SPECULATIVE_NAVIGATION", "1").lower() in ("1", "true", "yes")
+# bare domains are only trusted with a common TLD, so "utils.py" or "v1.2" never load anything
+SPECULATION_TLDS = os.getenv(
+    "SPECULATION_TLDS", 
+    "com,org,net,io,dev,ai,co,app,edu,gov,info,me,tv,uk,de,fr,jp,vn,us,ca,au,in"
+).split(",")
+
+_URL_PATTERN = re.compile(r"https?://[^\s<>\"'`()\[\]{}]+", re.IGNORECASE)
+_DOMAIN_PATTERN = re.compile(
+    r"(?<![\w@.-])((?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+(?:" + "|".join(map(re.escape, SPECULATION_TLDS)) + r"))"
+    r"(/[^\s<>\"'`()\[\]{}]*)?(?![\w-])",
+    re.IGNORECASE
+)
+
+
+def detect_url(text: str) -> Optional[str]:
+    # the first explicit URL, otherwise the first thing that looks like a domain
+    match = _URL_PATTERN.search(text or "")
+
+    if match is not None:
+        return match.group(0).rstrip(".,;:!?")
+
+    match = _DOMAIN_PATTERN.search(text or "")
+
+    if match is not None:
+        return "https://" + match.group(0).rstrip(".,;:!?")
+
+    return None
+
+
+def url_host(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def message_text(message: dict[str, Any]) -> str:
+    content = message.get("content")
+
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+    return content if isinstance(content, str) else ""
+
+
+class SpeculativeNavigation(object):
+    # a page loading the URL the user asked about while the outer LLM is still deciding what to do,
+    # in an isolated pooled session (a spare, or a new one within the limit) that is held until browse()
+    # takes it over or it gets cancelled. The main context is never used: a wrong guess would navigate
+    # away the persistent profile's page, and it would hold the context other requests queue for.
+    # The URL comes from the user's message, not from the xbrowse task the model writes later, so
+    # matches() only checks that both point at the same host
+    def __init__(self, url: str):
+        self.url = url
+        self.session: Optional[AgentBrowserSession] = None
+        self.page = None
+        self.started_at = time.time()
+        self._stack = AsyncExitStack()
+
+    @classmethod
+    async def start(cls, messages: list[dict[str, Any]]) -> Optional["SpeculativeNavigation"]:
+        user_messages = [m for m in messages if m.get("role") == "user"]
+        url = detect_url(message_text(user_messages[-1])) if user_messages else None
+
+        if url is None or not get_browser_pool().isolated_limit:
+            return None
+
+        speculation = cls(url)
+
+        try:
+            speculation.session = await speculation._stack.enter_async_context(get_browser_pool().lease(wait=False, isolated=True))
+
+            if speculation.session is None:
+                await speculation._stack.aclose()
+                metrics.inc("speculative_navigations_total", outcome="no_session")
+                return None
+
+            # the Agent works on a copy of the session without a current page, which falls back to the
+            # context's first tab: that one has to carry the preloaded page, not an extra tab
+            pages = speculation.session.browser_context.pages
+            speculation.page = pages[0] if pages else await speculation.session.browser_context.new_page()
+        except Exception as err:
+            logger.debug(f"Failed to start speculative navigation to {url}: {err}")
+            await speculation._stack.aclose()
+            return None
+
+        # not awaited: the agent waits for the page to load anyway, and a failed load costs nothing
+        load = asyncio.create_task(speculation.page.goto(url, wait_until="domcontentloaded"))
+        load.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        logger.info(f"Speculatively loading {url}")
+        return speculation
+
+    @property
+    def active(self) -> bool:
+        return self.session is not None
+
+    def matches(self, task: str) -> bool:
+        url = detect_url(task)
+        return self.active and url is not None and url_host(url) == url_host(self.url)
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[AgentBrowserSession]:
+        # hands the session to browse(); the preloaded page is its first tab, where the agent starts
+        session = self.session
+        self.session = None
+
+        metrics.inc("speculative_navigations_total", outcome="hit")
+        metrics.observe("speculative_navigation_head_start_seconds", time.time() - self.started_at)
+
+        try:
+            yield session
+        finally:
+            try:
+                await self.page.close()
+            except Exception as err:
+                logger.debug(f"Failed to close the speculative page: {err}")
+            finally:
+                await self._stack.aclose()
+
+    async def cancel(self):
+        if not self.active:
+            return
+
+        self.session = None
+        metrics.inc("speculative_navigations_total", outcome="miss")
+
+        try:
+            await self.page.close()
+        except Exception as err:
+            logger.debug(f"Failed to close the speculative page: {err}")
+        finally:
+            await self._stack.aclose()
@@ -0,0 +1,57 @@
+import json
+import time
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_json(value) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            pass  # e.g. lone surrogates, which orjson refuses to encode
+
+    text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    try:
+        return text.encode("utf-8")
+    except UnicodeEncodeError:
+        # lone surrogates are not valid utf-8, as \uXXXX escapes they are still valid json
+        return json.dumps(value, ensure_ascii=True, separators=(",", ":")).encode("ascii")
+
+
+class ChunkEncoder(object):
+    # byte-for-byte the same output as ChatCompletionStreamResponse(...).model_dump_json(),
+    # but only the delta content is escaped per chunk, everything else is a precompiled template
+    def __init__(self, response_id: str, model: str = "unspecified", created: Optional[int] = None):
+        self.response_id = response_id
+        self.model = model
+        self.created = int(time.time()) if created is None else created
+        self._templates: dict[str, tuple[bytes, bytes]] = {}
+
+    def _template(self, role: str) -> tuple[bytes, bytes]:
+        template = self._templates.get(role)
+
+        if template is None:
+            prefix = (
+                b'data: {"id":' + dumps_json(self.response_id)
+                + b',"object":"chat.completion.chunk","created":' + str(self.created).encode()
+                + b',"model":' + dumps_json(self.model)
+                + b',"choices":[{"index":0,"delta":{"role":' + dumps_json(role)
+                + b',"content":'
+            )
+            suffix = (
+                b',"reasoning_content":null,"tool_calls":[]},"logprobs":null,"finish_reason":null,"stop_reason":null}]'
+                b',"usage":null}\n\n'
+            )
+            template = self._templates[role] = (prefix, suffix)
+
+        return template
+
+    def encode(self, content: str, role: str = "assistant") -> bytes:
+        prefix, suffix = self._template(role)
+        return prefix + dumps_json(content) + suffix
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+from .browser import AgentBrowserSession
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# isolated contexts leased to tasks on top of the main (persistent profile) one, 0 turns them off
+BROWSER_POOL_ISOLATED_CONTEXTS = int(os.getenv("BROWSER_POOL_ISOLATED_CONTEXTS", 0))
+STORAGE_STATE_FILE = os.getenv("STORAGE_STATE_FILE", "/storage/browser-storage-state.json")
+STORAGE_STATE_REFRESH_INTERVAL = float(os.getenv("STORAGE_STATE_REFRESH_INTERVAL", 300))
+# "merge" writes cookies / localStorage of a finished isolated context back, "discard" drops them
+STORAGE_STATE_MERGE = os.getenv("STORAGE_STATE_MERGE", "merge").lower()
+
+
+def _cookie_key(cookie: dict[str, Any]) -> tuple:
+    return (cookie.get("name"), cookie.get("domain"), cookie.get("path", "/"))
+
+
+def merge_storage_state(base: dict[str, Any], update: dict[str, Any]) -> dict[str, Any]:
+    # cookies merge by (name, domain, path) and localStorage by origin, `update` wins; expired cookies go
+    now = time.time()
+    cookies = {_cookie_key(c): c for c in base.get("cookies", [])}
+    cookies.update((_cookie_key(c), c) for c in update.get("cookies", []))
+
+    origins = {o["origin"]: o for o in base.get("origins", [])}
+    origins.update((o["origin"], o) for o in update.get("origins", []))
+
+    return {
+        "cookies": [c for c in cookies.values() if not 0 < c.get("expires", -1) < now],
+        "origins": list(origins.values())
+    }
+
+
+def diff_storage_state(before: dict[str, Any], after: dict[str, Any]) -> dict[str, Any]:
+    # what a context changed since it was created, so untouched entries never overwrite newer ones
+    cookies = {_cookie_key(c): c for c in before.get("cookies", [])}
+    origins = {o["origin"]: o for o in before.get("origins", [])}
+
+    return {
+        "cookies": [c for c in after.get("cookies", []) if cookies.get(_cookie_key(c)) != c],
+        "origins": [o for o in after.get("origins", []) if origins.get(o["origin"]) != o]
+    }
+
+
+class StorageStateStore(object):
+    # the storage state new isolated contexts start from: captured from the main context, kept in memory
+    # and written to disk so the next start does not depend on the profile being there
+    def __init__(self, path: str):
+        self.path = path
+        self.state: dict[str, Any] = {"cookies": [], "origins": []}
+        self._main: Optional[AgentBrowserSession] = None
+
+    def _read(self) -> Optional[dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, "r") as fp:
+                return json.load(fp)
+        except Exception as err:
+            logger.warning(f"Failed to read storage state {self.path}: {err}")
+            return None
+
+    def _write(self, state: dict[str, Any]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "w") as fp:
+            json.dump(state, fp)
+
+        os.replace(tmp_path, self.path)
+
+    async def load(self, main: AgentBrowserSession):
+        self._main = main
+        state = await asyncio.to_thread(self._read)
+
+        if state is not None:
+            self.state = merge_storage_state(self.state, state)
+
+        await self.refresh()
+
+    async def refresh(self):
+        # the main context is where logins happen (noVNC, earlier tasks), its state wins over the file
+        if self._main is None or self._main.browser_context is None:
+            return
+
+        try:
+            self.state = merge_storage_state(self.state, await self._main.browser_context.storage_state())
+        except Exception as err:
+            logger.warning(f"Failed to capture storage state: {err}")
+            return
+
+        metrics.set("storage_state_cookies", len(self.state["cookies"]))
+        metrics.set("storage_state_origins", len(self.state["origins"]))
+        await self.save()
+
+    async def save(self):
+        try:
+            await asyncio.to_thread(self._write, self.state)
+        except Exception as err:
+            logger.warning(f"Failed to write storage state {self.path}: {err}")
+
+    async def merge_back(self, update: dict[str, Any]):
+        self.state = merge_storage_state(self.state, update)
+
+        # cookies also go to the main context, so the next refresh does not bring back stale values
+        # and the profile sync persists them
+        if self._main is not None and self._main.browser_context is not None and update.get("cookies"):
+            try:
+                await self._main.browser_context.add_cookies(update["cookies"])
+            except Exception as err:
+                logger.warning(f"Failed to merge cookies into the main context: {err}")
+
+        metrics.inc("storage_state_merges_total")
+
+
+class IsolatedContextFactory(object):
+    # fresh contexts in a separate incognito browser (a persistent context cannot host more contexts),
+    # hydrated from the storage state snapshot
+    def __init__(self, main: AgentBrowserSession, store: StorageStateStore):
+        self.main = main
+        self.store = store
+        self._browser = None
+        self._launch_lock = asyncio.Lock()
+        self._initial_states: dict[int, dict[str, Any]] = {}
+
+    def _profile(self):
+        return self.main.browser_profile.model_copy(update={"user_data_dir": None, "keep_alive": True})
+
+    async def _get_browser(self):
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                self._browser = await self.main.playwright.chromium.launch(
+                    **self._profile().kwargs_for_launch().model_dump()
+                )
+
+        return self._browser
+
+    async def create(self) -> AgentBrowserSession:
+        started = time.time()
+        profile = self._profile()
+        browser = await self._get_browser()
+
+        kwargs = profile.kwargs_for_new_context().model_dump()
+        kwargs["storage_state"] = self.store.state
+        context = await browser.new_context(**kwargs)
+
+        session = AgentBrowserSession(browser_profile=profile, browser_context=context)
+        await session.start()
+        self._initial_states[id(session)] = kwargs["storage_state"]
+
+        metrics.observe("isolated_context_create_seconds", time.time() - started)
+        return session
+
+    async def dispose(self, session: AgentBrowserSession):
+        context = session.browser_context
+        initial = self._initial_states.pop(id(session), {})
+
+        try:
+            if STORAGE_STATE_MERGE == "merge":
+                await self.store.merge_back(diff_storage_state(initial, await context.storage_state()))
+        except Exception as err:
+            logger.warning(f"Failed to capture storage state of an isolated context: {err}")
+        finally:
+            await context.close()
+
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+
+
+_store: Optional[StorageStateStore] = None
+
+
+def get_storage_state_store() -> StorageStateStore:
+    global _store
+
+    if _store is None:
+        _store = StorageStateStore(STORAGE_STATE_FILE)
+
+    return _store
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+TOOL_RESULT_STORE_DIR = os.getenv("TOOL_RESULT_STORE_DIR", os.path.join(os.getcwd(), "tool-results"))
+TOOL_RESULT_TTL_SECONDS = float(os.getenv("TOOL_RESULT_TTL_SECONDS", 24 * 3600))
+TOOL_RESULT_MAX_CHARS = int(os.getenv("TOOL_RESULT_MAX_CHARS", 16000))
+TOOL_RESULT_PREVIEW_CHARS = int(os.getenv("TOOL_RESULT_PREVIEW_CHARS", 2000))
+
+# per tool overrides, e.g. TOOL_RESULT_LIMITS='{"xbrowse": 8000}'
+try:
+    TOOL_RESULT_LIMITS: dict[str, int] = json.loads(os.getenv("TOOL_RESULT_LIMITS", "{}"))
+except json.JSONDecodeError:
+    logger.warning("TOOL_RESULT_LIMITS is not valid JSON, ignoring it")
+    TOOL_RESULT_LIMITS = {}
+
+_HANDLE_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def get_tool_result_limit(tool_name: str) -> int:
+    return int(TOOL_RESULT_LIMITS.get(tool_name, TOOL_RESULT_MAX_CHARS))
+
+
+def is_valid_handle(handle: str) -> bool:
+    return _HANDLE_PATTERN.match(handle or "") is not None
+
+
+def get_tool_result_path(handle: str) -> Optional[str]:
+    if not is_valid_handle(handle):
+        return None
+
+    path = os.path.join(TOOL_RESULT_STORE_DIR, f"{handle}.json")
+    return path if os.path.exists(path) else None
+
+
+def _write(path: str, data: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as fp:
+        fp.write(data)
+
+
+async def limit_tool_result(tool_name: str, result: Any) -> Any:
+    # small results pass through untouched; oversized ones are stored out of band
+    # and replaced by a handle plus a preview, both in the SSE stream and in the LLM context
+    if isinstance(result, str):
+        serialized = result
+    else:
+        try:
+            serialized = json.dumps(result, ensure_ascii=False)
+        except Exception:
+            serialized = str(result)
+
+    limit = get_tool_result_limit(tool_name)
+
+    if limit <= 0 or len(serialized) <= limit:
+        return result
+
+    # the file is served as application/json, so text is stored as a JSON string; ascii escapes also
+    # cover lone surrogates from scraped pages, which cannot be encoded to utf-8
+    try:
+        stored = json.dumps(result)
+    except Exception:
+        stored = json.dumps(serialized)
+
+    handle = uuid.uuid4().hex
+    await asyncio.to_thread(_write, os.path.join(TOOL_RESULT_STORE_DIR, f"{handle}.json"), stored)
+
+    logger.info(f"Tool result of {tool_name} has {len(serialized)} chars (limit {limit}), stored as {handle}")
+
+    return {
+        "truncated": True,
+        "handle": handle,
+        "url": f"/tool-results/{handle}",
+        "total_chars": len(serialized),
+        "preview": serialized[:min(TOOL_RESULT_PREVIEW_CHARS, limit)]
+    }
+
+
+def _cleanup() -> int:
+    if TOOL_RESULT_TTL_SECONDS <= 0 or not os.path.isdir(TOOL_RESULT_STORE_DIR):
+        return 0
+
+    deadline, removed = time.time() - TOOL_RESULT_TTL_SECONDS, 0
+
+    for file in os.listdir(TOOL_RESULT_STORE_DIR):
+        path = os.path.join(TOOL_RESULT_STORE_DIR, file)
+
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+
+    return removed
+
+
+async def cleanup_tool_results() -> int:
+    return await asyncio.to_thread(_cleanup)
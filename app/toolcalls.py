@@ -4,11 +4,23 @@ from .models import browser_use_custom_models
 from typing import Any, Generic, Optional, TypeVar, Callable, Awaitable
 from browser_use import Controller
 from .utils import get_system_prompt, repair_json_no_except
-from langchain_openai import ChatOpenAI
-import os
+from .llms import get_chat_model
+import json
 import logging
 from .callbacks import on_task_completed, on_task_start
-from browser_use import Agent
+from .progress import ProgressChannel
+from .run_context import AgentRunContext
+from .budget import RequestBudget
+from .context_budget import count_text_tokens
+from .browser import AgentBrowserSession
+from .browser_pool import get_browser_pool, LeaseTimeoutError
+from .fetch import fetch_page, FetchError
+from .checkpoints import checkpoint_key, get_checkpoint_store, resume_agent_state, CHECKPOINT_ENABLED
+from .screenshot_spool import create_screenshot_spool, SCREENSHOT_SPOOL_ENABLED
+from .speculation import SpeculativeNavigation
+from browser_use import Agent, AgentHistoryList
+from contextlib import nullcontext
+import asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +30,9 @@ class ResponseMessage(BaseModel, Generic[_generic_type]):
     result: Optional[_generic_type] = None
     error: Optional[str] = None
     success: bool = True
+    # LLM tokens the tool spent on its own, reported in the request usage
+    input_tokens: int = 0
+    output_tokens: int = 0
 
     @model_validator(mode="after")
     def refine_status(self):
@@ -26,39 +41,162 @@ class ResponseMessage(BaseModel, Generic[_generic_type]):
 
         return self
 
-async def browse(ctx: BrowserContext, task: str, **_) -> ResponseMessage[str]:
+def output_tokens(history: AgentHistoryList, start: int = 0) -> int:
+    # the history only keeps the (approximate) input tokens, the output is counted from the parsed model outputs
+    return sum(
+        count_text_tokens(json.dumps(h.model_output.model_dump(exclude_none=True), ensure_ascii=False))
+        for h in history.history[start:]
+        if h.model_output is not None
+    )
+
+
+def partial_result(history: AgentHistoryList, reason: str) -> browser_use_custom_models.FinalAgentResult:
+    findings = history.extracted_content()[-10:]
+    urls = [url for url in history.urls() if url]
+
+    message = f"Stopped before the task was finished ({reason})."
+
+    if urls:
+        message += f" Last page: {urls[-1]}."
+
+    if findings:
+        message += " Findings so far:\n" + "\n".join(f"- {finding}" for finding in findings)
+    else:
+        message += " Nothing was found yet."
+
+    return browser_use_custom_models.FinalAgentResult(
+        status=browser_use_custom_models.RunningStatus.PENDING,
+        message=message
+    )
+
+
+async def browse(
+    ctx: BrowserContext, 
+    task: str, 
+    progress: Optional[ProgressChannel] = None,
+    budget: Optional[RequestBudget] = None,
+    network: Optional[dict[str, Any]] = None,
+    speculation: Optional[SpeculativeNavigation] = None,
+    checkpoint_scope: Optional[str] = None,
+    **_
+) -> ResponseMessage[str]:
+    pool = get_browser_pool()
+
+    if speculation is not None and speculation.matches(task):
+        # the page the task is about is already loading in a leased session
+        lease = speculation.lease()
+    else:
+        if speculation is not None:
+            await speculation.cancel()
+
+        # the pool is filled by the server; without it the given context is used as is.
+        # Waiting for a free context counts against the request deadline
+        lease = pool.lease(timeout=budget.remaining_seconds() if budget else None) if pool.size else nullcontext(ctx)
+
+    try:
+        async with lease as session:
+            async with session.network_policy(network) if isinstance(session, AgentBrowserSession) else nullcontext():
+                return await _browse(session, task, progress=progress, budget=budget, checkpoint_scope=checkpoint_scope)
+    except LeaseTimeoutError as err:
+        return ResponseMessage(error=str(err))
+
+
+async def _browse(
+    ctx: BrowserContext, 
+    task: str, 
+    progress: Optional[ProgressChannel] = None,
+    budget: Optional[RequestBudget] = None,
+    checkpoint_scope: Optional[str] = None
+) -> ResponseMessage[str]:
+    budget = budget or RequestBudget()
+    max_steps = budget.max_steps
 
     controller = Controller(
         output_model=browser_use_custom_models.FinalAgentResult
     )
     system_prompt = get_system_prompt()
 
-    model = ChatOpenAI(
-        model=os.getenv("LLM_MODEL_ID", 'local-llm'),
-        openai_api_base=os.getenv("LLM_BASE_URL", 'http://localhost:65534/v1'),
-        openai_api_key=os.getenv("LLM_API_KEY", 'no-need'),
-    )
 
-    current_agent = Agent(
+    run_context = AgentRunContext(
         task=task,
-        llm=model,
-        page_extraction_llm=model,
-        planner_llm=model,
-        browser_session=ctx,
-        controller=controller,
-        extend_system_message=system_prompt,
-
-        is_planner_reasoning=False,
-        use_vision=True,
-        use_vision_for_planner=True,
-        enable_memory=False
+        max_steps=max_steps,
+        budget=budget,
+        progress=progress,
+        screenshot_spool=create_screenshot_spool() if SCREENSHOT_SPOOL_ENABLED else None
     )
 
-    res = await current_agent.run(
-        max_steps=40,
-        on_step_start=on_task_start, 
-        on_step_end=on_task_completed
+    store = get_checkpoint_store()
+    agent_state = None
+
+    # without a scope a retry could not be told apart from someone else's run of the same task, so there is
+    # no checkpoint; the same task already running here in the same scope keeps it, this run goes without one
+    if CHECKPOINT_ENABLED and checkpoint_scope is not None and store.claim(checkpoint_key(checkpoint_scope, task)):
+        run_context.checkpoint_key = checkpoint_key(checkpoint_scope, task)
+
+    try:
+        if run_context.checkpoint_key is not None:
+            checkpoint = await store.load(run_context.checkpoint_key)
+
+            if checkpoint is not None:
+                agent_state = await resume_agent_state(ctx, controller, checkpoint)
+
+        if agent_state is not None:
+            run_context.resumed_tokens = agent_state.history.total_input_tokens()
+            run_context.resumed_steps = len(agent_state.history.history)
+
+        current_agent = Agent(
+            task=task,
+            llm=get_chat_model("agent"),
+            page_extraction_llm=get_chat_model("extraction"),
+            planner_llm=get_chat_model("planner"),
+            browser_session=ctx,
+            controller=controller,
+            context=run_context,
+            extend_system_message=system_prompt,
+            injected_agent_state=agent_state,
+
+            is_planner_reasoning=False,
+            use_vision=True,
+            use_vision_for_planner=True,
+            enable_memory=False
+        )
+
+        run = current_agent.run(
+            max_steps=max(1, max_steps - len(current_agent.state.history.history)),
+            on_step_start=on_task_start, 
+            on_step_end=on_task_completed
+        )
+
+        try:
+            # the deadline is a hard stop, the callbacks already asked the agent to wrap up before it
+            res = await asyncio.wait_for(run, timeout=budget.remaining_seconds())
+        except asyncio.TimeoutError:
+            logger.warning(f"Deadline reached while browsing for task {task!r}")
+            run_context.finalize_reason = run_context.finalize_reason or "deadline reached"
+            res = current_agent.state.history
+
+        if run_context.checkpoint_key is not None:
+            if current_agent.state.consecutive_failures >= current_agent.settings.max_failures:
+                # most likely the browser broke, a retry of the request picks up from the last good step
+                logger.info(f"Keeping checkpoint {run_context.checkpoint_key} of the failed run")
+            else:
+                await store.discard(run_context.checkpoint_key)
+    finally:
+        if run_context.checkpoint_key is not None:
+            store.release(run_context.checkpoint_key)
+
+        if run_context.screenshot_spool is not None:
+            await run_context.screenshot_spool.close()
+
+    usage = dict(
+        input_tokens=res.total_input_tokens() - run_context.resumed_tokens,
+        output_tokens=output_tokens(res, run_context.resumed_steps)
     )
+    budget.add_tokens(usage["input_tokens"] + usage["output_tokens"])
+
+    if not res.is_done():
+        reason = run_context.finalize_reason or f"no answer within {max_steps} steps"
+        return ResponseMessage(result=partial_result(res, reason).message, **usage)
 
     final_result = res.final_result()
 
@@ -72,12 +210,25 @@ async def browse(ctx: BrowserContext, task: str, **_) -> ResponseMessage[str]:
             if parsed.status == "pending":
                 logger.info(f"Completed task in status {parsed.status}")
 
-            return ResponseMessage(result=parsed.message)
+            return ResponseMessage(result=parsed.message, **usage)
         except Exception as err:
             logger.info(f"Exception raised while parsing final answer: {err}")
-            return ResponseMessage(result=f"task {task!r} completed!")
+            return ResponseMessage(result=f"task {task!r} completed!", **usage)
 
-    return ResponseMessage(result=f"task {task!r} completed")
+    return ResponseMessage(result=f"task {task!r} completed", **usage)
+
+
+async def fetch_url(
+    ctx: BrowserContext, 
+    url: str, 
+    **_
+) -> ResponseMessage[str]:
+    try:
+        page = await fetch_page(url)
+    except FetchError as err:
+        return ResponseMessage(error=str(err))
+
+    return ResponseMessage(result=page.to_text())
 
 
 async def get_context_aware_available_toolcalls(
@@ -107,6 +258,28 @@ async def get_context_aware_available_toolcalls(
             }, 
             browse
         ),
+        (
+            {
+                "type": "function",
+                "function": {
+                    "name": "fetch_url",
+                    "description": "Fetch a web page over plain HTTP and read it as markdown, in milliseconds and without a browser. Use it for static pages (articles, docs, wikis, APIs returning text/JSON). Use xbrowse instead when the page needs javascript, a login, or interaction.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "url": {
+                                "type": "string",
+                                "description": "Absolute http(s) URL of the page to read"
+                            }
+                        },
+                        "required": ["url"],
+                        "additionalProperties": False
+                    },
+                    "strict": True
+                }
+            },
+            fetch_url
+        ),
         # other toolcalls here
     ]
     
@@ -118,13 +291,15 @@ async def get_context_aware_available_toolcalls(
 async def execute_toolcall(
     ctx: BrowserContext, 
     tool_name: str, 
-    args: dict[str, Any]
+    args: dict[str, Any],
+    **kwargs
 ) -> ResponseMessage[Any]:
+    # kwargs carry per-request state (e.g. progress), executors ignore what they do not use
     response_model = ResponseMessage[Any]
 
     for toolcall, executor in await get_context_aware_available_toolcalls(ctx, include_executable=True):
         if toolcall["function"]["name"] == tool_name:
-            return await executor(ctx, **args)
+            return await executor(ctx, **args, **kwargs)
 
     return response_model(error=f"Unavailable tool call: {tool_name}", success=False)
     
\ No newline at end of file
@@ -0,0 +1,451 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import AsyncIterator, Iterable, Optional
+from pydantic import BaseModel
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_STORE_DIR = os.getenv("UPLOAD_STORE_DIR", os.path.join(os.getcwd(), "uploads"))
+UPLOAD_STORE_MAX_BYTES = int(os.getenv("UPLOAD_STORE_MAX_BYTES", 1024 * 1024 * 1024))
+UPLOAD_TTL_SECONDS = float(os.getenv("UPLOAD_TTL_SECONDS", 24 * 3600))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", 100 * 1024 * 1024))
+
+# base64 characters decoded per step, must be a multiple of 4
+_DECODE_CHUNK_CHARS = 4 * 64 * 1024
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._\- ]+")
+
+
+class StoredFile(BaseModel):
+    id: str
+    filename: str
+    path: str
+    size: int
+
+
+class _Entry(BaseModel):
+    size: int
+    last_access: float
+    filenames: set[str] = set()
+    # owner -> unix timestamp the ownership lapses at, 0 for owners that are released explicitly
+    owners: dict[str, float] = {}
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+def sanitize_filename(file_name: str) -> str:
+    file_name = _UNSAFE_FILENAME_CHARS.sub("_", os.path.basename(file_name or "")).strip(" .")
+    return file_name[:200] or "file"
+
+
+class UploadStore(object):
+    # files are stored once per sha256 digest under <directory>/<digest[:2]>/<digest>/<filename>;
+    # the same content under another name becomes a hard link in the same folder.
+    # Owners are kept next to the files in .owners.json, so they survive restarts
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: dict[str, _Entry] = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _entry_dir(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _scan(self):
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+
+            for digest in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, digest)
+                filenames = [e for e in os.listdir(entry_dir) if not e.startswith(".")] if os.path.isdir(entry_dir) else []
+
+                if not filenames:
+                    continue
+
+                stat = os.stat(os.path.join(entry_dir, filenames[0]))
+                self._entries[digest] = _Entry(
+                    size=stat.st_size,
+                    last_access=stat.st_mtime,
+                    filenames=set(filenames),
+                    owners=self._read_owners(digest)
+                )
+
+    def _owners_path(self, digest: str) -> str:
+        return os.path.join(self._entry_dir(digest), ".owners.json")
+
+    def _read_owners(self, digest: str) -> dict[str, float]:
+        try:
+            with open(self._owners_path(digest), "r") as fp:
+                return {str(k): float(v) for k, v in json.load(fp).items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as err:
+            logger.warning(f"Failed to read owners of upload {digest}: {err}")
+            return {}
+
+    def _write_owners(self, digest: str, owners: dict[str, float]):
+        path = self._owners_path(digest)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            return
+
+        with open(path + ".tmp", "w") as fp:
+            json.dump(owners, fp)
+
+        os.replace(path + ".tmp", path)
+
+    async def _save_owners(self, digest: str):
+        entry = self._entries.get(digest)
+
+        if entry is not None:
+            await asyncio.to_thread(self._write_owners, digest, dict(entry.owners))
+
+    def _add_owner(self, entry: _Entry, owner: str, ttl: Optional[float]) -> bool:
+        expires_at = time.time() + ttl if ttl else 0
+        current = entry.owners.get(owner)
+
+        # an explicit owner (0) is never downgraded to a lapsing one
+        if current == 0 or (current is not None and expires_at and current >= expires_at):
+            return False
+
+        entry.owners[owner] = expires_at
+        return True
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(e.size for e in self._entries.values())
+
+    def _tmp_file(self):
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix=".upload-", delete=False)
+
+    def _decode_to_tmp(self, file_data_base64: str) -> tuple[str, str, int]:
+        if any(c in file_data_base64 for c in " \r\n\t"):
+            file_data_base64 = "".join(file_data_base64.split())
+
+        hasher, size = hashlib.sha256(), 0
+
+        with self._tmp_file() as fp:
+            try:
+                for i in range(0, len(file_data_base64), _DECODE_CHUNK_CHARS):
+                    data = base64.b64decode(file_data_base64[i:i + _DECODE_CHUNK_CHARS])
+                    hasher.update(data)
+                    fp.write(data)
+                    size += len(data)
+            except BaseException:
+                os.remove(fp.name)
+                raise
+
+        return fp.name, hasher.hexdigest(), size
+
+    def _materialize(self, tmp_path: str, digest: str, filename: str) -> str:
+        entry_dir = self._entry_dir(digest)
+        target = os.path.join(entry_dir, filename)
+        existing = [e for e in os.listdir(entry_dir) if not e.startswith(".")] if os.path.isdir(entry_dir) else []
+
+        if not existing:
+            os.makedirs(entry_dir, exist_ok=True)
+            os.replace(tmp_path, target)
+
+        else:
+            # content already stored, the new copy is not needed
+            os.remove(tmp_path)
+
+            if filename not in existing:
+                try:
+                    os.link(os.path.join(entry_dir, existing[0]), target)
+                except OSError:
+                    shutil.copyfile(os.path.join(entry_dir, existing[0]), target)
+
+        os.utime(target)
+        return target
+
+    async def _commit(
+        self, 
+        tmp_path: str, 
+        digest: str, 
+        size: int, 
+        file_name: str, 
+        owner: Optional[str], 
+        owner_ttl: Optional[float] = None
+    ) -> StoredFile:
+        filename = sanitize_filename(file_name)
+        path = await asyncio.to_thread(self._materialize, tmp_path, digest, filename)
+
+        entry = self._entries.setdefault(digest, _Entry(size=size, last_access=time.time()))
+        entry.last_access = time.time()
+        entry.filenames.add(filename)
+
+        if owner is not None and self._add_owner(entry, owner, owner_ttl):
+            await self._save_owners(digest)
+
+        await self.enforce_quota(keep=digest)
+        return StoredFile(id=digest, filename=filename, path=path, size=entry.size)
+
+    async def put_base64(self, file_data_base64: str, file_name: str, owner: Optional[str] = None) -> StoredFile:
+        tmp_path, digest, size = await asyncio.to_thread(self._decode_to_tmp, file_data_base64)
+
+        try:
+            return await self._commit(tmp_path, digest, size, file_name, owner)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            raise
+
+    async def put_data_uri(self, file_data_uri: str, file_name: str, owner: Optional[str] = None) -> StoredFile:
+        return await self.put_base64(file_data_uri.split(',')[-1], file_name, owner=owner)
+
+    def get(self, file_id: str, file_name: Optional[str] = None) -> Optional[StoredFile]:
+        entry = self._entries.get(file_id)
+
+        if entry is None or not entry.filenames:
+            return None
+
+        filename = file_name if file_name in entry.filenames else sorted(entry.filenames)[0]
+        entry.last_access = time.time()
+
+        return StoredFile(
+            id=file_id,
+            filename=filename,
+            path=os.path.join(self._entry_dir(file_id), filename),
+            size=entry.size
+        )
+
+    async def retain(self, file_id: str, owner: str, ttl: Optional[float] = None):
+        entry = self._entries.get(file_id)
+
+        if entry is not None and self._add_owner(entry, owner, ttl):
+            await self._save_owners(file_id)
+
+    async def release_owner(self, owner: str):
+        for digest, entry in list(self._entries.items()):
+            if entry.owners.pop(owner, None) is not None:
+                await self._save_owners(digest)
+
+    async def prune_owners(self, keep: Iterable[str]):
+        # owners that are not stored conversations belong to requests of a previous process
+        keep = set(keep)
+
+        for digest, entry in list(self._entries.items()):
+            stale = [owner for owner, expires_at in entry.owners.items() if expires_at == 0 and owner not in keep]
+
+            for owner in stale:
+                entry.owners.pop(owner)
+
+            if stale:
+                await self._save_owners(digest)
+
+    async def _expire_owners(self):
+        now = time.time()
+
+        for digest, entry in list(self._entries.items()):
+            expired = [owner for owner, expires_at in entry.owners.items() if 0 < expires_at < now]
+
+            for owner in expired:
+                entry.owners.pop(owner)
+
+            if expired:
+                await self._save_owners(digest)
+
+    async def _remove(self, digest: str):
+        self._entries.pop(digest, None)
+        await asyncio.to_thread(shutil.rmtree, self._entry_dir(digest), True)
+
+    async def enforce_quota(self, keep: Optional[str] = None):
+        total = self.total_bytes
+
+        if total <= self.max_bytes:
+            return
+
+        # least recently used unreferenced files go first
+        candidates = sorted(
+            [(e.last_access, digest) for digest, e in self._entries.items() if not e.owners and digest != keep]
+        )
+
+        for _, digest in candidates:
+            if total <= self.max_bytes:
+                break
+
+            entry = self._entries.get(digest)
+
+            if entry is None:
+                continue
+
+            total -= entry.size
+            logger.info(f"Upload store over quota, evicting {digest}")
+            await self._remove(digest)
+
+    async def cleanup(self) -> int:
+        removed = 0
+        await self._expire_owners()
+
+        if self.ttl_seconds > 0:
+            deadline = time.time() - self.ttl_seconds
+
+            for digest, entry in list(self._entries.items()):
+                if not entry.owners and entry.last_access < deadline:
+                    await self._remove(digest)
+                    removed += 1
+
+        await self.enforce_quota()
+        return removed
+
+
+class UploadWriter(object):
+    # incrementally hashes and writes one file, chunk by chunk, off the event loop
+    def __init__(self, store: UploadStore, max_bytes: int = UPLOAD_MAX_FILE_BYTES):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._fp = store._tmp_file()
+        self._hasher = hashlib.sha256()
+
+    def _write(self, data: bytes):
+        self._hasher.update(data)
+        self._fp.write(data)
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"File exceeds the limit of {self.max_bytes} bytes")
+
+        await asyncio.to_thread(self._write, data)
+
+    async def commit(self, file_name: str, owner: Optional[str] = None, owner_ttl: Optional[float] = None) -> StoredFile:
+        await asyncio.to_thread(self._fp.close)
+        return await self.store._commit(self._fp.name, self._hasher.hexdigest(), self.size, file_name, owner, owner_ttl)
+
+    def abort(self):
+        self._fp.close()
+
+        if os.path.exists(self._fp.name):
+            os.remove(self._fp.name)
+
+
+async def receive_multipart(
+    store: UploadStore,
+    chunks: AsyncIterator[bytes],
+    content_type: str,
+    owner: Optional[str] = None,
+    owner_ttl: Optional[float] = None,
+    max_file_bytes: int = UPLOAD_MAX_FILE_BYTES
+) -> list[StoredFile]:
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+
+    if not boundary:
+        raise ValueError("Expected a multipart/form-data body with a boundary")
+
+    # the parser callbacks are sync, so events are collected per network chunk and handled after it
+    events: list[tuple[str, bytes]] = []
+    header: dict[str, bytes] = {"field": b"", "value": b""}
+    headers: dict[bytes, bytes] = {}
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["field"].strip().lower()] = header["value"].strip()
+        header["field"], header["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(headers.get(b"content-disposition"))
+        events.append(("file", disposition.get(b"filename", b"")))
+        headers.clear()
+
+    def on_part_data(data: bytes, start: int, end: int):
+        events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(("end", b""))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    files: list[StoredFile] = []
+    writer: Optional[UploadWriter] = None
+    file_name = ""
+
+    async def handle_events():
+        nonlocal writer, file_name
+        pending = []
+
+        for kind, value in events:
+            if kind == "data":
+                if writer is not None:
+                    pending.append(value)
+
+                continue
+
+            if pending:
+                await writer.write(b"".join(pending))
+                pending = []
+
+            if kind == "file":
+                # parts without a filename are plain form fields and are ignored
+                file_name = value.decode("utf-8", errors="replace")
+                writer = UploadWriter(store, max_bytes=max_file_bytes) if file_name else None
+
+            elif kind == "end" and writer is not None:
+                files.append(await writer.commit(file_name, owner=owner, owner_ttl=owner_ttl))
+                writer = None
+
+        if pending:
+            await writer.write(b"".join(pending))
+
+        events.clear()
+
+    try:
+        async for chunk in chunks:
+            parser.write(chunk)
+            await handle_events()
+
+        parser.finalize()
+        await handle_events()
+    finally:
+        if writer is not None:
+            writer.abort()
+
+    return files
+
+
+_store: Optional[UploadStore] = None
+
+
+def get_upload_store() -> UploadStore:
+    global _store
+
+    if _store is None:
+        _store = UploadStore(
+            UPLOAD_STORE_DIR,
+            max_bytes=UPLOAD_STORE_MAX_BYTES,
+            ttl_seconds=UPLOAD_TTL_SECONDS
+        )
+
+    return _store
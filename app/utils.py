@@ -2,14 +2,14 @@ from io import StringIO
 import sys
 from json_repair import repair_json
 import logging 
-import datetime
-import os
-import base64
 import uuid
 from .models.oai_compatible_models import ChatCompletionStreamResponse
+from .uploads import get_upload_store
+from .progress import StepEvent
+from .sse import dumps_json
 import time
 import json
-from typing import Any
+from typing import Any, Optional
 from pydantic import BaseModel
 
 logger = logging.getLogger()
@@ -46,26 +46,34 @@ def repair_json_no_except(json_str: str) -> str:
 
 
 
-async def preserve_upload_file(file_data_uri: str, file_name: str) -> str:
-    os.makedirs(os.path.join(os.getcwd(), 'uploads'), exist_ok=True)
-
-    file_data_base64 = file_data_uri.split(',')[-1]
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-
+async def preserve_upload_file(file_data_uri: str, file_name: str, owner: Optional[str] = None) -> str:
     try:
-        file_data = base64.b64decode(file_data_base64)
-        file_path = os.path.join(os.getcwd(), 'uploads', f"{timestamp}_{file_name}")
-        
-        with open(file_path, 'wb') as f:
-            f.write(file_data)
-        
-        return file_path
+        stored = await get_upload_store().put_data_uri(file_data_uri, file_name, owner=owner)
+        return stored.path
     except Exception as e:
         logger.error(f"Failed to preserve upload file: {e}")
         return None
 
 
-async def refine_chat_history(messages: list[dict[str, str]], system_prompt: str) -> list[dict[str, str]]:
+async def resolve_upload_file(file_id: str, file_name: Optional[str] = None, owner: Optional[str] = None) -> str:
+    store = get_upload_store()
+    stored = store.get(file_id, file_name)
+
+    if stored is None:
+        logger.error(f"Unknown upload file id: {file_id}")
+        return None
+
+    if owner is not None:
+        await store.retain(file_id, owner)
+
+    return stored.path
+
+
+async def refine_chat_history(
+    messages: list[dict[str, str]], 
+    system_prompt: str, 
+    owner: Optional[str] = None
+) -> list[dict[str, str]]:
     refined_messages = []
 
     has_system_prompt = False
@@ -95,7 +103,19 @@ async def refine_chat_history(messages: list[dict[str, str]], system_prompt: str
                     if 'file_data' in file_item and 'filename' in file_item:
                         file_path = await preserve_upload_file(
                             file_item.get('file_data', ''),
-                            file_item.get('filename', '')
+                            file_item.get('filename', ''),
+                            owner=owner
+                        )
+
+                        if file_path:
+                            attachments.append(file_path)
+
+                    elif 'file_id' in file_item:
+                        # uploaded beforehand via POST /uploads, nothing to decode or copy
+                        file_path = await resolve_upload_file(
+                            file_item.get('file_id', ''),
+                            file_item.get('filename'),
+                            owner=owner
                         )
 
                         if file_path:
@@ -162,8 +182,28 @@ async def wrap_chunk(uuid: str, raw: str, role="assistant") -> ChatCompletionStr
         ]
     )
 
+def wrap_progress_event(uuid: str, event: StepEvent) -> ChatCompletionStreamResponse:
+    # the rendered line goes into the content, the structured event rides along as an extra field
+    return ChatCompletionStreamResponse(
+        id=uuid,
+        object='chat.completion.chunk',
+        created=int(time.time()),
+        model='unspecified',
+        choices=[
+            dict(
+                index=0,
+                delta=dict(
+                    content=event.to_markdown(),
+                    role='tool'
+                ),
+            )
+        ],
+        progress=event.model_dump()
+    )
+
 async def to_chunk_data(chunk: ChatCompletionStreamResponse) -> bytes:
-    return ("data: " + json.dumps(chunk.model_dump()) + "\n\n").encode()
+    # through dumps_json: scraped text can carry lone surrogates, which model_dump_json() refuses
+    return b"data: " + dumps_json(chunk.model_dump()) + b"\n\n"
 
 
 
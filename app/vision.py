@@ -0,0 +1,113 @@
+import logging
+import os
+from typing import Any, Optional
+from pydantic import BaseModel
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "adaptive" decides per step, "always" / "never" force it
+VISION_POLICY = os.getenv("VISION_POLICY", "adaptive").lower()
+# share of the viewport covered by canvas / video / svg above which the DOM is not enough
+VISION_VISUAL_RATIO = float(os.getenv("VISION_VISUAL_RATIO", 0.3))
+# share of visible interactive elements without any text or label above which the DOM is ambiguous
+VISION_UNLABELED_RATIO = float(os.getenv("VISION_UNLABELED_RATIO", 0.25))
+
+_PAGE_PROBE_JS = """
+() => {
+    const vw = window.innerWidth, vh = window.innerHeight;
+    const visible = (r) => r.width > 0 && r.height > 0 && r.bottom > 0 && r.top < vh && r.right > 0 && r.left < vw;
+    let interactive = 0, unlabeled = 0, visualArea = 0;
+
+    for (const el of document.querySelectorAll('a,button,input,select,textarea,[role=button],[role=link],[role=tab],[onclick]')) {
+        if (!visible(el.getBoundingClientRect())) continue;
+        interactive++;
+
+        const label = (el.innerText || el.value || el.getAttribute('aria-label') || el.getAttribute('title')
+            || el.getAttribute('placeholder') || el.getAttribute('alt') || '').trim();
+
+        if (!label) unlabeled++;
+    }
+
+    for (const el of document.querySelectorAll('canvas,video,embed,object,svg')) {
+        const r = el.getBoundingClientRect();
+        const w = Math.max(0, Math.min(r.right, vw) - Math.max(r.left, 0));
+        const h = Math.max(0, Math.min(r.bottom, vh) - Math.max(r.top, 0));
+        visualArea += w * h;
+    }
+
+    return {
+        url: location.href,
+        interactive: interactive,
+        unlabeled: unlabeled,
+        visual_ratio: Math.min(1, visualArea / Math.max(1, vw * vh)),
+        text_length: document.body ? document.body.innerText.length : 0,
+        scroll_y: Math.round(window.scrollY)
+    };
+}
+"""
+
+
+class PageProbe(BaseModel):
+    url: str
+    interactive: int
+    unlabeled: int
+    visual_ratio: float
+    text_length: int
+    scroll_y: int
+
+    def signature(self) -> tuple:
+        return (self.url, self.interactive, self.unlabeled, self.text_length, self.scroll_y)
+
+
+class VisionDecision(BaseModel):
+    use_vision: bool
+    reason: str
+    probe: Optional[PageProbe] = None
+
+
+async def probe_page(page) -> Optional[PageProbe]:
+    try:
+        return PageProbe.model_validate(await page.evaluate(_PAGE_PROBE_JS))
+    except Exception as err:
+        logger.debug(f"Vision probe failed: {err}")
+        return None
+
+
+def _last_step_failed(last_result: Optional[list[Any]]) -> bool:
+    return any(getattr(r, "error", None) for r in last_result or [])
+
+
+async def decide_vision(page, last_result: Optional[list[Any]], previous: Optional[PageProbe]) -> VisionDecision:
+    if VISION_POLICY in ("always", "never"):
+        return VisionDecision(use_vision=VISION_POLICY == "always", reason=VISION_POLICY)
+
+    if _last_step_failed(last_result):
+        return VisionDecision(use_vision=True, reason="after_failure", probe=await probe_page(page))
+
+    probe = await probe_page(page)
+
+    if probe is None:
+        return VisionDecision(use_vision=True, reason="probe_failed")
+
+    if probe.visual_ratio >= VISION_VISUAL_RATIO:
+        return VisionDecision(use_vision=True, reason="visual_content", probe=probe)
+
+    if previous is not None and previous.signature() == probe.signature():
+        return VisionDecision(use_vision=False, reason="dom_unchanged", probe=probe)
+
+    if probe.interactive == 0:
+        return VisionDecision(use_vision=True, reason="no_interactive_elements", probe=probe)
+
+    if probe.unlabeled / probe.interactive > VISION_UNLABELED_RATIO:
+        return VisionDecision(use_vision=True, reason="dom_ambiguous", probe=probe)
+
+    return VisionDecision(use_vision=False, reason="dom_sufficient", probe=probe)
+
+
+def record_vision_decision(decision: VisionDecision):
+    metrics.inc(
+        "vision_policy_decisions_total",
+        reason=decision.reason,
+        vision="on" if decision.use_vision else "off"
+    )
@@ -0,0 +1,53 @@
+# micro benchmark of the per-token SSE encoding path
+# usage: python scripts/bench_sse.py [iterations]
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.oai_compatible_models import ChatCompletionStreamResponse
+from app.sse import ChunkEncoder, orjson
+
+TOKEN = " hello \"world\" ünïcode"
+
+
+def encode_with_model(response_id: str, created: int, chunk: str) -> bytes:
+    chunk_model = ChatCompletionStreamResponse(
+        id=response_id,
+        object='chat.completion.chunk',
+        created=created,
+        model='unspecified',
+        choices=[
+            dict(
+                index=0,
+                delta=dict(
+                    content=chunk,
+                    role='assistant'
+                )
+            )
+        ]
+    )
+
+    return (f'data: {chunk_model.model_dump_json()}\n\n').encode('utf-8')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    created = int(time.time())
+    encoder = ChunkEncoder("bench", created=created)
+
+    assert encoder.encode(TOKEN) == encode_with_model("bench", created, TOKEN), "encoder output differs from the model"
+
+    baseline = timeit.timeit(lambda: encode_with_model("bench", created, TOKEN), number=iterations)
+    fast = timeit.timeit(lambda: encoder.encode(TOKEN), number=iterations)
+
+    print(f"orjson: {'yes' if orjson is not None else 'no'}")
+    print(f"model + model_dump_json: {baseline / iterations * 1e6:.2f} us/chunk")
+    print(f"ChunkEncoder:            {fast / iterations * 1e6:.2f} us/chunk")
+    print(f"speedup:                 {baseline / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
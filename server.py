@@ -6,27 +6,54 @@ import uvicorn
 import asyncio
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 import os
 from contextlib import asynccontextmanager
 import sys
 from typing import Union, Dict, List, Tuple
 import signal
 import psutil
-from app.models.oai_compatible_models import (
-    ChatCompletionStreamResponse, 
-    PromptErrorResponse
-)
+from app.models.oai_compatible_models import PromptErrorResponse, ErrorResponse, UsageInfo
 from app import prompt
+from app.sse import ChunkEncoder
+from app.conversations import get_conversation_store, is_valid_conversation_id
+from app.budget import parse_positive_number
+from app.context_budget import parse_token_limit
+from app.network import parse_network_overrides
+from app.uploads import get_upload_store, receive_multipart, UploadTooLargeError, UPLOAD_TTL_SECONDS
+from app.tool_results import cleanup_tool_results, get_tool_result_path
+from app.metrics import metrics
+from app.page_load import get_page_load_stats, PAGE_LOAD_MAX_WAIT
+from app.checkpoints import get_checkpoint_store
+from app.screenshot_spool import clear_screenshot_spools
+from app.fetch import close_http_client
+from app.browser_pool import get_browser_pool, WARM_STANDBY_CONTEXTS
+from app.storage_state import (
+    get_storage_state_store,
+    IsolatedContextFactory,
+    BROWSER_POOL_ISOLATED_CONTEXTS,
+    STORAGE_STATE_REFRESH_INTERVAL
+)
+from app.llms import get_http_client, LLM_ROLES
+from app.llm_routing import check_llm_endpoints, LLM_HEALTH_CHECK_INTERVAL
+from app.batch import get_batch_manager
+from app.completions import (
+    collect_completion, 
+    parse_chat_request, 
+    response_model_name, 
+    run_chat_request, 
+    stream_completion, 
+    InvalidChatRequestError, 
+    PromptFailedError
+)
 from typing import AsyncGenerator
-import time
 import uuid
 import openai
 from browser_use.browser.context import BrowserContextConfig
-from browser_use import BrowserSession, BrowserConfig
+from browser_use import BrowserConfig
+from app.browser import AgentBrowserSession
 import xml.etree.ElementTree as ET
-
-BROWSER_PROFILE_DIR = "/storage/browser-profiles"
+from app.profile_sync import get_profile_sync, BROWSER_PROFILE_DIR, BROWSER_LIVE_PROFILE_DIR, PROFILE_SYNC_INTERVAL
 
 logger = logging.getLogger(__name__)
 
@@ -116,6 +143,19 @@ async def observe_process(command: str, app_signal: asyncio.Event, auto_restart:
 
     logger.info(f"App signal is set, command {command!r} exited")
 
+# run a housekeeping coroutine every `interval` seconds until the app stops
+async def run_periodically(fn, app_signal: asyncio.Event, interval: float):
+    while not app_signal.is_set():
+        try:
+            await fn()
+        except Exception as err:
+            logger.warning(f"Periodic task {fn.__qualname__} failed: {err}")
+
+        try:
+            await asyncio.wait_for(app_signal.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
 
 
 @asynccontextmanager
@@ -126,9 +166,46 @@ async def lifespan(app: fastapi.FastAPI):
     os.makedirs('/tmp/.ICE-unix', exist_ok=True)    
 
     os.makedirs(BROWSER_PROFILE_DIR, exist_ok=True)
+    clear_screenshot_spools()
+    get_profile_sync().restore()
     logger.info(f"Created {BROWSER_PROFILE_DIR}: {os.path.exists(BROWSER_PROFILE_DIR)}")
     
     tasks = []
+
+    tasks.append(asyncio.create_task(
+        run_periodically(get_conversation_store().sweep, app_signal, interval=3600)
+    ))
+
+    # owners left behind by requests that were in flight when the previous process stopped
+    await get_upload_store().prune_owners(get_conversation_store().ids())
+
+    tasks.append(asyncio.create_task(
+        run_periodically(get_upload_store().cleanup, app_signal, interval=600)
+    ))
+
+    tasks.append(asyncio.create_task(
+        run_periodically(cleanup_tool_results, app_signal, interval=600)
+    ))
+
+    tasks.append(asyncio.create_task(
+        run_periodically(get_page_load_stats().save, app_signal, interval=300)
+    ))
+
+    tasks.append(asyncio.create_task(
+        run_periodically(get_checkpoint_store().sweep, app_signal, interval=3600)
+    ))
+
+    tasks.append(asyncio.create_task(
+        run_periodically(get_profile_sync().sync, app_signal, interval=PROFILE_SYNC_INTERVAL)
+    ))
+
+    for role in LLM_ROLES:
+        # builds each role's endpoint group up front so the health checks cover all of them
+        get_http_client(role)
+
+    tasks.append(asyncio.create_task(
+        run_periodically(check_llm_endpoints, app_signal, interval=LLM_HEALTH_CHECK_INTERVAL)
+    ))
     
 
     # Start initial processes
@@ -171,7 +248,7 @@ async def lifespan(app: fastapi.FastAPI):
     ))
     
     for file in ["SingletonLock", "SingletonCookie", "SingletonSocket", "Local State", "Last Version"]:
-        path = os.path.join(BROWSER_PROFILE_DIR, file)
+        path = os.path.join(BROWSER_LIVE_PROFILE_DIR, file)
 
         # check if the path is symlink
         if os.path.islink(path):
@@ -189,14 +266,14 @@ async def lifespan(app: fastapi.FastAPI):
             os.remove(path)
 
     try:
-        browser = BrowserSession(
+        browser = AgentBrowserSession(
             config=BrowserConfig(
                 headless=False,
-                user_data_dir=BROWSER_PROFILE_DIR,
+                user_data_dir=BROWSER_LIVE_PROFILE_DIR,
                 new_context_config=BrowserContextConfig(
                     allowed_domains=["*"],
                     cookies_file=None,
-                    maximum_wait_page_load_time=5,
+                    maximum_wait_page_load_time=PAGE_LOAD_MAX_WAIT,
                     disable_security=False,
                     user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
                 ),
@@ -213,6 +290,22 @@ async def lifespan(app: fastapi.FastAPI):
         _GLOBALS['browser_context'] = ctx
 
         await _GLOBALS['browser_context'].__aenter__()
+        get_browser_pool().add(ctx)
+
+        if BROWSER_POOL_ISOLATED_CONTEXTS > 0:
+            await get_storage_state_store().load(ctx)
+            _GLOBALS['isolated_contexts'] = IsolatedContextFactory(ctx, get_storage_state_store())
+            get_browser_pool().set_factory(
+                _GLOBALS['isolated_contexts'], 
+                limit=BROWSER_POOL_ISOLATED_CONTEXTS, 
+                standby=WARM_STANDBY_CONTEXTS
+            )
+
+            tasks.append(asyncio.create_task(
+                run_periodically(get_storage_state_store().refresh, app_signal, interval=STORAGE_STATE_REFRESH_INTERVAL)
+            ))
+
+        get_batch_manager().resume_all(ctx)
         
         current_page = await ctx.get_current_page()
         await current_page.goto("https://google.com")
@@ -225,6 +318,16 @@ async def lifespan(app: fastapi.FastAPI):
         logger.error(traceback.format_exc())
 
     finally:
+        # stop batch jobs before the browser goes away, they resume on the next start
+        await get_batch_manager().shutdown()
+
+        if _GLOBALS.get('isolated_contexts'):
+            try:
+                await get_browser_pool().close()
+                await get_storage_state_store().refresh()
+                await _GLOBALS['isolated_contexts'].close()
+            except Exception as err:
+                logger.error(f"Exception raised while closing isolated contexts: {err}", stack_info=True)
 
         if _GLOBALS.get('browser_context'):
             try:
@@ -232,8 +335,18 @@ async def lifespan(app: fastapi.FastAPI):
             except Exception as err:
                 logger.error(f"Exception raised while closing browser context: {err}", stack_info=True)
 
+        # Chromium is gone by now, so the last snapshot of the profile is consistent
+        await get_profile_sync().sync(final=True)
+
         app_signal.set()
 
+        try:
+            await get_page_load_stats().save()
+        except Exception as err:
+            logger.warning(f"Failed to save page load stats: {err}")
+
+        await close_http_client()
+
         # Cleanup any remaining Chromium processes
         cleanup_cmd = "pkill -f chromium || true"
         process = await asyncio.create_subprocess_shell(
@@ -247,6 +360,7 @@ async def lifespan(app: fastapi.FastAPI):
 async def stream_reader(s: AsyncGenerator[Union[str, bytes], None]):
     error_message = None
     response_uuid = str(uuid.uuid4())
+    encoder = ChunkEncoder(response_uuid)
 
     try:
         async for chunk in s:
@@ -254,23 +368,7 @@ async def stream_reader(s: AsyncGenerator[Union[str, bytes], None]):
                 continue
 
             if isinstance(chunk, str):
-                chunk_model = ChatCompletionStreamResponse(
-                    id=response_uuid,
-                    object='chat.completion.chunk',
-                    created=int(time.time()),
-                    model='unspecified',
-                    choices=[
-                        dict(
-                            index=0,
-                            delta=dict(
-                                content=chunk,
-                                role='assistant'
-                            )
-                        )
-                    ]
-                )
-
-                yield (f'data: {chunk_model.model_dump_json()}\n\n').encode('utf-8')
+                yield encoder.encode(chunk)
             else:
                 yield chunk
 
@@ -319,6 +417,10 @@ def main():
             status_code=404
         )
 
+    @api_app.get("/metrics")
+    async def get_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
     @api_app.post("/prompt", response_model=None)
     async def post_prompt(body: dict) -> Union[StreamingResponse, PlainTextResponse, JSONResponse]:
         if body.get('ping'):
@@ -342,6 +444,38 @@ def main():
 
         messages[-1].setdefault('role', 'user')
 
+        headers = {}
+        conversation_id = body.get('conversation_id')
+
+        if conversation_id is not None:
+            if not is_valid_conversation_id(conversation_id):
+                return JSONResponse(
+                    content=PromptErrorResponse(
+                        message="Invalid conversation_id, expected 1-128 characters of [A-Za-z0-9_-]"
+                    ).model_dump(),
+                    status_code=400
+                )
+
+            headers['X-Conversation-Id'] = conversation_id
+
+        # set internally (batches), a client resumes a run through its conversation_id
+        body.pop('checkpoint_scope', None)
+
+        try:
+            # checked before streaming starts, a bad limit is a 400 rather than an error chunk
+            for name in ('timeout', 'deadline'):
+                body[name] = parse_positive_number(body.get(name), name)
+
+            for name in ('max_context_tokens', 'max_steps', 'max_tool_calls', 'token_budget'):
+                body[name] = parse_token_limit(body.get(name), name)
+
+            body['network'] = parse_network_overrides(body.get('network'))
+        except ValueError as err:
+            return JSONResponse(
+                content=PromptErrorResponse(message=str(err)).model_dump(),
+                status_code=400
+            )
+
         try:
             stream = prompt(
                 messages, 
@@ -351,7 +485,8 @@ def main():
 
             return StreamingResponse(
                 stream_reader(stream),
-                media_type="text/event-stream"
+                media_type="text/event-stream",
+                headers=headers
             )
         except Exception as err:
             error_message = "Unexpected Error: " + str(err)
@@ -365,6 +500,199 @@ def main():
                 status_code=500
             )
 
+    @api_app.post("/v1/chat/completions", response_model=None)
+    async def post_chat_completions(request: fastapi.Request) -> Union[StreamingResponse, JSONResponse]:
+        usage = UsageInfo()
+
+        try:
+            body = parse_chat_request(await request.json())
+            stream = run_chat_request(body, _GLOBALS["browser_context"], usage=usage)
+        except (InvalidChatRequestError, ValueError) as err:
+            return JSONResponse(
+                content={"error": ErrorResponse(message=str(err), type="invalid_request_error", code=400).model_dump()},
+                status_code=400
+            )
+
+        model = response_model_name(body)
+
+        if body.stream:
+            return StreamingResponse(
+                stream_completion(
+                    stream, 
+                    model=model, 
+                    usage=usage, 
+                    include_usage=bool(body.stream_options and body.stream_options.include_usage)
+                ),
+                media_type="text/event-stream"
+            )
+
+        try:
+            completion = await collect_completion(stream, model=model, usage=usage)
+        except PromptFailedError as err:
+            return JSONResponse(
+                content={"error": ErrorResponse(message=err.message, type="server_error", code=500).model_dump()},
+                status_code=500
+            )
+
+        return JSONResponse(content=completion.model_dump(), status_code=200)
+
+    @api_app.post("/uploads")
+    async def post_uploads(request: fastapi.Request):
+        conversation_id = request.query_params.get("conversation_id")
+
+        if conversation_id is not None and not is_valid_conversation_id(conversation_id):
+            return JSONResponse(
+                content=PromptErrorResponse(message="Invalid conversation_id, expected 1-128 characters of [A-Za-z0-9_-]").model_dump(),
+                status_code=400
+            )
+
+        try:
+            # owned by the conversation until it is deleted, otherwise protected for the upload TTL
+            files = await receive_multipart(
+                get_upload_store(),
+                request.stream(),
+                request.headers.get("content-type", ""),
+                owner=conversation_id or f"upload:{uuid.uuid4().hex}",
+                owner_ttl=None if conversation_id else UPLOAD_TTL_SECONDS
+            )
+        except UploadTooLargeError as err:
+            return JSONResponse(
+                content=PromptErrorResponse(message=str(err)).model_dump(),
+                status_code=413
+            )
+        except ValueError as err:
+            return JSONResponse(
+                content=PromptErrorResponse(message=str(err)).model_dump(),
+                status_code=400
+            )
+
+        if len(files) == 0:
+            return JSONResponse(
+                content=PromptErrorResponse(message="No file part found in the request").model_dump(),
+                status_code=400
+            )
+
+        return JSONResponse(
+            content={
+                "object": "list",
+                "data": [
+                    {
+                        "id": file.id,
+                        "object": "file",
+                        "filename": file.filename,
+                        "bytes": file.size
+                    }
+                    for file in files
+                ]
+            },
+            status_code=200
+        )
+
+    @api_app.get("/tool-results/{handle}", response_model=None)
+    async def get_tool_result(handle: str) -> Union[FileResponse, JSONResponse]:
+        path = get_tool_result_path(handle)
+
+        if path is None:
+            return JSONResponse(
+                content=PromptErrorResponse(message=f"Tool result {handle!r} not found").model_dump(),
+                status_code=404
+            )
+
+        return FileResponse(path, media_type="application/json")
+
+    @api_app.delete("/conversations/{conversation_id}")
+    async def delete_conversation(conversation_id: str):
+        if not is_valid_conversation_id(conversation_id):
+            return JSONResponse(
+                content=PromptErrorResponse(
+                    message="Invalid conversation_id"
+                ).model_dump(),
+                status_code=400
+            )
+
+        deleted = await get_conversation_store().delete(conversation_id)
+
+        return JSONResponse(
+            content={
+                "id": conversation_id,
+                "deleted": deleted
+            },
+            status_code=200 if deleted else 404
+        )
+
+    @api_app.post("/v1/batches")
+    async def post_batches(body: dict):
+        input_file = get_upload_store().get(str(body.get("input_file_id") or ""))
+
+        if input_file is None:
+            return JSONResponse(
+                content=PromptErrorResponse(message="input_file_id does not refer to an uploaded file").model_dump(),
+                status_code=400
+            )
+
+        try:
+            job = await get_batch_manager().create(
+                input_file.path,
+                endpoint=body.get("endpoint", "/v1/chat/completions"),
+                input_file_id=input_file.id,
+                concurrency=body.get("concurrency"),
+                metadata=body.get("metadata")
+            )
+        except (ValueError, TypeError) as err:
+            return JSONResponse(
+                content=PromptErrorResponse(message=str(err)).model_dump(),
+                status_code=400
+            )
+
+        get_batch_manager().start(job, _GLOBALS["browser_context"])
+        return JSONResponse(content=job.model_dump(), status_code=200)
+
+    @api_app.get("/v1/batches")
+    async def list_batches():
+        return JSONResponse(
+            content={
+                "object": "list",
+                "data": [job.model_dump() for job in get_batch_manager().list()]
+            },
+            status_code=200
+        )
+
+    @api_app.get("/v1/batches/{batch_id}")
+    async def get_batch(batch_id: str):
+        job = get_batch_manager().get(batch_id)
+
+        if job is None:
+            return JSONResponse(
+                content=PromptErrorResponse(message=f"Batch {batch_id!r} not found").model_dump(),
+                status_code=404
+            )
+
+        return JSONResponse(content=job.model_dump(), status_code=200)
+
+    @api_app.get("/v1/batches/{batch_id}/output", response_model=None)
+    async def get_batch_output(batch_id: str) -> Union[FileResponse, JSONResponse]:
+        path = get_batch_manager().output_path(batch_id)
+
+        if path is None:
+            return JSONResponse(
+                content=PromptErrorResponse(message=f"No output for batch {batch_id!r} yet").model_dump(),
+                status_code=404
+            )
+
+        return FileResponse(path, media_type="application/jsonl")
+
+    @api_app.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(batch_id: str):
+        job = await get_batch_manager().cancel(batch_id)
+
+        if job is None:
+            return JSONResponse(
+                content=PromptErrorResponse(message=f"Batch {batch_id!r} not found").model_dump(),
+                status_code=404
+            )
+
+        return JSONResponse(content=job.model_dump(), status_code=200)
+
     api_app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
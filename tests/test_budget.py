@@ -0,0 +1,22 @@
+import math
+
+import pytest
+
+from app.budget import PROMPT_MAX_TOOL_CALLS, RequestBudget, parse_positive_number
+
+
+def test_max_tool_calls_is_clamped():
+    assert RequestBudget.from_request(max_tool_calls=PROMPT_MAX_TOOL_CALLS + 100).max_tool_calls == PROMPT_MAX_TOOL_CALLS
+    assert RequestBudget.from_request(max_tool_calls=1).max_tool_calls == 1
+
+
+def test_parse_positive_number():
+    assert parse_positive_number(None, "timeout") is None
+    assert parse_positive_number(30, "timeout") == 30.0
+    assert parse_positive_number(1.5, "timeout") == 1.5
+
+
+@pytest.mark.parametrize("value", [0, -1, "30", True, math.nan, math.inf, [30]])
+def test_parse_positive_number_rejects(value):
+    with pytest.raises(ValueError):
+        parse_positive_number(value, "timeout")
@@ -0,0 +1,11 @@
+from app.checkpoints import checkpoint_key
+
+
+def test_key_is_stable_for_a_retry():
+    assert checkpoint_key("conversation:abc", "find flights") == checkpoint_key("conversation:abc", "find flights")
+
+
+def test_key_is_scoped_to_the_conversation():
+    assert checkpoint_key("conversation:abc", "find flights") != checkpoint_key("conversation:xyz", "find flights")
+    assert checkpoint_key("conversation:abc", "find flights") != checkpoint_key("batch:b1:abc", "find flights")
+
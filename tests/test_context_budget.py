@@ -0,0 +1,64 @@
+import pytest
+from app.context_budget import compact_messages, count_message_tokens, parse_token_limit
+
+
+def long_text(words):
+    return " ".join(f"word{i}" for i in range(words))
+
+
+def conversation():
+    return [
+        {"role": "system", "content": "system prompt " * 20},
+        {"role": "user", "content": "old question " + long_text(400)},
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "c1", "type": "function", "function": {"name": "xbrowse", "arguments": "{\"task\": \"t\"}"}}
+        ]},
+        {"role": "tool", "tool_call_id": "c1", "content": long_text(2000)},
+        {"role": "assistant", "content": "old answer"},
+        {"role": "user", "content": "new question"},
+    ]
+
+
+def test_under_budget_is_untouched():
+    messages = conversation()
+    compacted, report = compact_messages(messages, budget=10 ** 6)
+
+    assert compacted is messages
+    assert not report.changed
+
+
+def test_old_tool_results_are_truncated_first():
+    messages = conversation()
+    budget = sum(count_message_tokens(m) for m in messages) - 500
+    compacted, report = compact_messages(messages, budget=budget, truncate_tokens=64)
+
+    assert report.truncated_messages >= 1
+    assert report.dropped_messages == 0
+    assert "tokens omitted" in compacted[3]["content"]
+    assert compacted[0] == messages[0]
+    assert compacted[-1] == messages[-1]
+    assert report.tokens_after <= budget
+
+
+def test_tool_call_and_result_are_dropped_together():
+    messages = conversation()
+    compacted, report = compact_messages(messages, budget=80, truncate_tokens=16)
+
+    roles = [m["role"] for m in compacted]
+
+    assert roles[0] == "system"
+    assert compacted[-1] == messages[-1]
+    # an orphaned tool result would be rejected by the API
+    assert ("tool" in roles) == any(m.get("tool_calls") for m in compacted)
+    assert report.dropped_roles.get("assistant", 0) >= report.dropped_roles.get("tool", 0)
+
+
+@pytest.mark.parametrize("value, expected", [(None, None), (5, 5), ("7", 7)])
+def test_parse_token_limit(value, expected):
+    assert parse_token_limit(value) == expected
+
+
+@pytest.mark.parametrize("value", ["abc", 0, -1, True, 1.5, [1]])
+def test_parse_token_limit_rejects(value):
+    with pytest.raises(ValueError):
+        parse_token_limit(value)
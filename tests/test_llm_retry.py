@@ -0,0 +1,118 @@
+import asyncio
+import httpx
+import pytest
+from app import llm_retry
+from app.llm_retry import CircuitBreaker, CircuitOpenError, RetryingTransport, retry_after_seconds
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_retry, "backoff_delay", lambda attempt: 0)
+
+
+def transport(statuses, breaker=None):
+    calls = []
+
+    def handler(request):
+        status = statuses[min(len(calls), len(statuses) - 1)]
+        calls.append(status)
+
+        if isinstance(status, Exception):
+            raise status
+
+        return httpx.Response(status)
+
+    return RetryingTransport(httpx.MockTransport(handler), breaker or CircuitBreaker("test")), calls
+
+
+def send(retrying):
+    async def run():
+        async with httpx.AsyncClient(transport=retrying) as client:
+            return await client.get("http://llm/v1/models")
+
+    return asyncio.run(run())
+
+
+def test_retries_transient_statuses_until_success():
+    retrying, calls = transport([503, 429, 200])
+
+    assert send(retrying).status_code == 200
+    assert calls == [503, 429, 200]
+
+
+def test_client_errors_are_not_retried():
+    retrying, calls = transport([400])
+
+    assert send(retrying).status_code == 400
+    assert calls == [400]
+
+
+def test_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(llm_retry, "LLM_RETRY_MAX_ATTEMPTS", 3)
+    retrying, calls = transport([502])
+
+    assert send(retrying).status_code == 502
+    assert len(calls) == 3
+
+
+def test_connection_errors_are_raised_when_exhausted(monkeypatch):
+    monkeypatch.setattr(llm_retry, "LLM_RETRY_MAX_ATTEMPTS", 2)
+    retrying, calls = transport([httpx.ConnectError("refused")])
+
+    with pytest.raises(httpx.ConnectError):
+        send(retrying)
+
+    assert len(calls) == 2
+
+
+def test_no_retry_past_the_deadline():
+    retrying, calls = transport([503])
+    token = llm_retry.llm_deadline.set(0.0)
+
+    try:
+        assert send(retrying).status_code == 503
+    finally:
+        llm_retry.llm_deadline.reset(token)
+
+    assert calls == [503]
+
+
+def test_circuit_opens_after_threshold_and_rejects(monkeypatch):
+    monkeypatch.setattr(llm_retry, "LLM_CIRCUIT_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(llm_retry, "LLM_RETRY_MAX_ATTEMPTS", 5)
+    breaker = CircuitBreaker("test")
+    retrying, calls = transport([500], breaker)
+
+    assert send(retrying).status_code == 500
+    assert breaker.state == "open"
+    assert len(calls) == 2
+
+    with pytest.raises(CircuitOpenError):
+        send(retrying)
+
+    assert len(calls) == 2
+
+
+def test_half_open_probe_closes_or_reopens(monkeypatch):
+    monkeypatch.setattr(llm_retry, "LLM_CIRCUIT_RESET_SECONDS", 0)
+    breaker = CircuitBreaker("test")
+    breaker.state, breaker.opened_at = "open", 0
+
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # only one probe at a time
+    assert not breaker.allow()
+
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": "3"})) == 3
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert retry_after_seconds(httpx.Response(429)) is None
@@ -0,0 +1,30 @@
+from app.metrics import Metrics
+
+
+def test_summary_max_is_a_separate_gauge():
+    metrics = Metrics()
+    metrics.observe("step_seconds", 1.5, role="agent")
+    metrics.observe("step_seconds", 4.0, role="agent")
+
+    lines = metrics.render().splitlines()
+
+    assert lines == [
+        "# TYPE step_seconds summary",
+        'step_seconds_count{role="agent"} 2',
+        'step_seconds_sum{role="agent"} 5.5',
+        "# TYPE step_seconds_max gauge",
+        'step_seconds_max{role="agent"} 4.0',
+    ]
+
+
+def test_counters_and_gauges():
+    metrics = Metrics()
+    metrics.inc("requests_total", status="ok")
+    metrics.set("contexts_idle", 3)
+
+    assert metrics.render().splitlines() == [
+        "# TYPE requests_total counter",
+        'requests_total{status="ok"} 1',
+        "# TYPE contexts_idle gauge",
+        "contexts_idle 3",
+    ]
@@ -0,0 +1,25 @@
+import pytest
+
+from app.network import NetworkPolicy, parse_network_overrides
+
+
+def test_overrides_replace_fields():
+    policy = NetworkPolicy(block_domains={"ads.example"}).with_overrides(
+        {"allow_domains": ["Example.com"], "block_images": True, "unknown": 1}
+    )
+
+    assert policy.allow_domains == {"example.com"}
+    assert policy.block_domains == {"ads.example"}
+    assert policy.block_images is True
+    assert policy.block_reason("https://www.example.com/a.png", "image") is None
+
+
+@pytest.mark.parametrize("value", [["example.com"], "example.com", {"allow_domains": "example.com"}, {"block_images": [1]}])
+def test_bad_overrides_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_network_overrides(value)
+
+
+def test_valid_overrides_pass():
+    assert parse_network_overrides(None) is None
+    assert parse_network_overrides({"block_resource_types": []}) == {"block_resource_types": []}
@@ -0,0 +1,33 @@
+import base64
+import io
+
+import pytest
+
+from app import screenshots
+from app.screenshots import same_frame, screenshot_hash
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+
+def frame(text: str) -> str:
+    img = Image.new("RGB", (800, 600), "white")
+    ImageDraw.Draw(img).text((40, 40), text, fill="black")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def test_identical_frames_are_the_same():
+    assert same_frame(screenshot_hash(frame("Total: 41 items")), screenshot_hash(frame("Total: 41 items")))
+
+
+def test_small_text_change_is_a_new_frame():
+    assert not same_frame(screenshot_hash(frame("Total: 41 items")), screenshot_hash(frame("Total: 42 items")))
+
+
+def test_perceptual_hash_is_opt_in(monkeypatch):
+    assert isinstance(screenshot_hash(frame("a")), str)
+
+    monkeypatch.setattr(screenshots, "SCREENSHOT_DEDUP_PERCEPTUAL", True)
+    assert isinstance(screenshot_hash(frame("a")), int)
@@ -0,0 +1,103 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+from app import speculation
+from app.speculation import SpeculativeNavigation, detect_url, url_host
+
+
+@pytest.mark.parametrize("text, url", [
+    ("open https://example.com/path?q=1 please", "https://example.com/path?q=1"),
+    ("look at (https://example.com/a).", "https://example.com/a"),
+    ("what is on news.ycombinator.com today?", "https://news.ycombinator.com"),
+    ("check github.com/org/repo, thanks", "https://github.com/org/repo"),
+    ("first http://a.org then b.com", "http://a.org"),
+])
+def test_detect_url(text, url):
+    assert detect_url(text) == url
+
+
+@pytest.mark.parametrize("text", [
+    "fix the bug in utils.py",
+    "upgrade to v1.2",
+    "mail me at someone@example.com",
+    "",
+    None,
+])
+def test_detect_url_ignores_non_urls(text):
+    assert detect_url(text) is None
+
+
+def test_url_host_ignores_www_and_case():
+    assert url_host("https://WWW.Example.com/x") == url_host("http://example.com") == "example.com"
+
+
+class FakePage(object):
+    def __init__(self, url="about:blank"):
+        self.url = url
+        self.closed = False
+
+    async def goto(self, url, **_):
+        self.url = url
+
+    async def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+
+class FakeContext(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    async def new_page(self):
+        page = FakePage()
+        self.pages.append(page)
+        return page
+
+
+class FakeSession(object):
+    def __init__(self, context):
+        self.browser_context = context
+        self.agent_current_page = None
+
+    async def get_current_page(self):
+        # what browser-use's BrowserSession does for the Agent's copy, which starts without a current page
+        if self.agent_current_page is None or self.agent_current_page.is_closed():
+            self.agent_current_page = self.browser_context.pages[0]
+
+        return self.agent_current_page
+
+
+class FakePool(object):
+    isolated_limit = 1
+
+    def __init__(self, session):
+        self.session = session
+
+    @asynccontextmanager
+    async def lease(self, wait=True, isolated=False):
+        assert isolated and not wait
+        yield self.session
+
+
+def test_agent_starts_on_the_preloaded_page(monkeypatch):
+    warm = FakePage("https://www.google.com")
+    session = FakeSession(FakeContext([warm]))
+    monkeypatch.setattr(speculation, "get_browser_pool", lambda: FakePool(session))
+
+    async def run():
+        spec = await SpeculativeNavigation.start([{"role": "user", "content": "what is new on example.com?"}])
+        await asyncio.sleep(0)
+
+        assert spec.matches("open https://example.com and read the headlines")
+
+        async with spec.lease() as leased:
+            agent_copy = FakeSession(leased.browser_context)
+            page = await agent_copy.get_current_page()
+
+            assert page is warm
+            assert page.url == "https://example.com"
+            assert len(leased.browser_context.pages) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,28 @@
+import json
+from app.models.oai_compatible_models import ChatCompletionStreamResponse
+from app.sse import ChunkEncoder, dumps_json
+
+
+def test_chunk_matches_model_dump_json():
+    encoder = ChunkEncoder("chatcmpl-1", model="m", created=1700000000)
+
+    for content in ["hello", "quote \" and \\ backslash", "unicode é 漢字 \n newline", ""]:
+        expected = ChatCompletionStreamResponse(
+            id="chatcmpl-1",
+            created=1700000000,
+            model="m",
+            choices=[{"index": 0, "delta": {"role": "assistant", "content": content}}]
+        )
+
+        assert encoder.encode(content) == f"data: {expected.model_dump_json()}\n\n".encode()
+
+
+def test_chunk_is_valid_json_with_lone_surrogates():
+    chunk = ChunkEncoder("chatcmpl-1", created=0).encode("broken \ud800 text")
+    data = json.loads(chunk.decode("utf-8").removeprefix("data: "))
+
+    assert data["choices"][0]["delta"]["content"] == "broken \ud800 text"
+
+
+def test_dumps_json_is_compact_utf8():
+    assert dumps_json({"a": ["é", 1]}) == '{"a":["é",1]}'.encode("utf-8")
@@ -0,0 +1,63 @@
+import time
+from app.storage_state import diff_storage_state, merge_storage_state
+
+
+def cookie(name, value, domain="example.com", path="/", expires=-1):
+    return {"name": name, "value": value, "domain": domain, "path": path, "expires": expires}
+
+
+def test_merge_update_wins_per_cookie_key():
+    base = {"cookies": [cookie("sid", "old"), cookie("sid", "other", path="/app")], "origins": []}
+    update = {"cookies": [cookie("sid", "new")], "origins": []}
+
+    merged = merge_storage_state(base, update)
+
+    assert sorted((c["path"], c["value"]) for c in merged["cookies"]) == [("/", "new"), ("/app", "other")]
+
+
+def test_merge_drops_expired_cookies_and_keeps_session_cookies():
+    base = {"cookies": [cookie("gone", "x", expires=time.time() - 10), cookie("session", "y")], "origins": []}
+
+    merged = merge_storage_state(base, {})
+
+    assert [c["name"] for c in merged["cookies"]] == ["session"]
+
+
+def test_merge_replaces_local_storage_per_origin():
+    base = {"cookies": [], "origins": [
+        {"origin": "https://a.com", "localStorage": [{"name": "k", "value": "1"}]},
+        {"origin": "https://b.com", "localStorage": [{"name": "k", "value": "2"}]}
+    ]}
+    update = {"origins": [{"origin": "https://a.com", "localStorage": []}]}
+
+    merged = merge_storage_state(base, update)
+
+    assert {o["origin"]: o["localStorage"] for o in merged["origins"]} == {
+        "https://a.com": [],
+        "https://b.com": [{"name": "k", "value": "2"}]
+    }
+
+
+def test_diff_keeps_only_changed_entries():
+    before = {
+        "cookies": [cookie("a", "1"), cookie("b", "1")],
+        "origins": [{"origin": "https://a.com", "localStorage": []}]
+    }
+    after = {
+        "cookies": [cookie("a", "1"), cookie("b", "2"), cookie("c", "1")],
+        "origins": [{"origin": "https://a.com", "localStorage": []}, {"origin": "https://b.com", "localStorage": []}]
+    }
+
+    diff = diff_storage_state(before, after)
+
+    assert [(c["name"], c["value"]) for c in diff["cookies"]] == [("b", "2"), ("c", "1")]
+    assert [o["origin"] for o in diff["origins"]] == ["https://b.com"]
+
+
+def test_diff_of_untouched_context_does_not_overwrite_newer_state():
+    snapshot = {"cookies": [cookie("sid", "v1")], "origins": []}
+    newer = merge_storage_state(snapshot, {"cookies": [cookie("sid", "v2")]})
+
+    merged = merge_storage_state(newer, diff_storage_state(snapshot, snapshot))
+
+    assert merged["cookies"][0]["value"] == "v2"
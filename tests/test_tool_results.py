@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+from app import tool_results
+from app.tool_results import get_tool_result_path, limit_tool_result
+
+
+def stored(monkeypatch, tmp_path, result):
+    monkeypatch.setattr(tool_results, "TOOL_RESULT_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(tool_results, "TOOL_RESULT_LIMITS", {"xbrowse": 10})
+    limited = asyncio.run(limit_tool_result("xbrowse", result))
+
+    assert limited["truncated"] is True
+
+    with open(get_tool_result_path(limited["handle"])) as fp:
+        return json.load(fp)
+
+
+def test_stored_text_is_valid_json(monkeypatch, tmp_path):
+    assert stored(monkeypatch, tmp_path, "plain page text, " * 10) == "plain page text, " * 10
+
+
+def test_stored_text_with_lone_surrogate(monkeypatch, tmp_path):
+    assert stored(monkeypatch, tmp_path, "scraped \ud800 text " * 5) == "scraped \ud800 text " * 5
+
+
+def test_stored_object_round_trips(monkeypatch, tmp_path):
+    result = {"items": ["é", "漢字"] * 10}
+    assert stored(monkeypatch, tmp_path, result) == result
+
+
+def test_small_result_passes_through(monkeypatch, tmp_path):
+    monkeypatch.setattr(tool_results, "TOOL_RESULT_STORE_DIR", str(tmp_path))
+    assert asyncio.run(limit_tool_result("xbrowse", "short")) == "short"
@@ -0,0 +1,39 @@
+import asyncio
+import json
+from app.models.oai_compatible_models import ChatCompletionStreamResponse
+from app.progress import StepEvent
+from app.utils import to_chunk_data, wrap_progress_event
+
+
+def chunk(content):
+    return ChatCompletionStreamResponse(
+        id="chatcmpl-1",
+        created=0,
+        model="unspecified",
+        choices=[{"index": 0, "delta": {"role": "tool", "content": content}}]
+    )
+
+
+def parse(data: bytes) -> dict:
+    assert data.startswith(b"data: ") and data.endswith(b"\n\n")
+    return json.loads(data[len(b"data: "):].decode("utf-8"))
+
+
+def test_chunk_data_with_lone_surrogate():
+    data = asyncio.run(to_chunk_data(chunk("scraped \ud800 text")))
+
+    assert parse(data)["choices"][0]["delta"]["content"] == "scraped \ud800 text"
+
+
+def test_chunk_data_keeps_unicode():
+    data = asyncio.run(to_chunk_data(chunk("é 漢字")))
+
+    assert parse(data)["choices"][0]["delta"]["content"] == "é 漢字"
+
+
+def test_progress_event_keeps_thumbnail():
+    event = StepEvent(phase="completed", step=2, url="https://example.com", thumbnail="aGVsbG8=")
+    data = parse(asyncio.run(to_chunk_data(wrap_progress_event("1", event))))
+
+    assert data["progress"]["thumbnail"] == "aGVsbG8="
+    assert "base64,aGVsbG8=" in data["choices"][0]["delta"]["content"]